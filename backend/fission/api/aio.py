@@ -0,0 +1,134 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+import elasticsearch
+import es_client
+
+try:
+    import aiohttp  # noqa: F401, needed by AsyncElasticsearch
+except ImportError:
+    aiohttp = None
+
+# Elasticsearch I/O on a single asyncio event loop per pod.
+#
+# The Fission Python environment calls the handlers synchronously, so the loop
+# runs in a background thread with one AsyncElasticsearch client. Handlers use
+# BlockingClient, which awaits each call on that loop: every request in flight
+# shares the client's connections, and fan_out lets one request wait on several
+# independent queries at once.
+
+ENABLED = os.environ.get("API_ASYNC_ES", "1") == "1" and aiohttp is not None
+FAN_OUT_WORKERS = int(os.environ.get("API_FAN_OUT_WORKERS", 16))
+
+_lock = threading.Lock()
+_loop = None
+_executor = None
+# only touched from the event loop
+_client = None
+_client_stamp = None
+_last_check = 0.0
+
+
+def get_loop():
+    """
+    The pod's event loop, started in a daemon thread on first use
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="es-event-loop", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run(coro, timeout=None):
+    """
+    Runs coro on the pod's event loop and blocks the calling thread until it finishes
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def _create_client():
+    return elasticsearch.AsyncElasticsearch(
+        es_client.ES_URL,
+        http_auth=(es_client.config('ES_USERNAME'), es_client.config('ES_PASSWORD')),
+        verify_certs=False,
+        ssl_show_warn=False,
+        connections_per_node=es_client.CONNECTIONS_PER_NODE,
+    )
+
+
+async def get_client():
+    """
+    Returns the pod-wide AsyncElasticsearch client, rebuilt when the credential files change.
+    Must be awaited on the loop returned by get_loop().
+    """
+    global _client, _client_stamp, _last_check
+
+    now = time.monotonic()
+    if _client is None or now - _last_check >= es_client.CONFIG_CHECK_INTERVAL:
+        _last_check = now
+        stamp = es_client._credentials_stamp()
+        if _client is None or stamp != _client_stamp:
+            if _client is not None:
+                logging.info("Elasticsearch credentials changed, reconnecting async client")
+            stale = _client
+            _client = _create_client()
+            _client_stamp = stamp
+            if stale is not None:
+                await stale.close()
+
+    return _client
+
+
+class BlockingClient:
+    """
+    Synchronous stand-in for elasticsearch.Elasticsearch whose calls are awaited on the
+    pod's event loop, so the existing query code runs unchanged. Namespaces work as on
+    the real client, e.g. es.indices.get_mapping(index=...).
+    """
+
+    def __init__(self, path=(), options=None):
+        self._path = path
+        self._options = options or {}
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return BlockingClient(self._path + (name,), self._options)
+
+    def options(self, **options):
+        # like Elasticsearch.options, e.g. es.options(request_timeout=5)
+        return BlockingClient(self._path, dict(self._options, **options))
+
+    def __call__(self, *args, **kwargs):
+        async def call():
+            target = await get_client()
+            if self._options:
+                target = target.options(**self._options)
+            for name in self._path:
+                target = getattr(target, name)
+            return await target(*args, **kwargs)
+        return run(call())
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(FAN_OUT_WORKERS, thread_name_prefix="fan-out")
+        return _executor
+
+
+def fan_out(calls):
+    """
+    Runs independent callables concurrently and returns {key: result} for {key: callable}.
+    Their Elasticsearch calls interleave on the event loop, so the total time is that of the
+    slowest call rather than the sum. Exceptions are re-raised in the caller.
+    """
+    futures = {key: _get_executor().submit(call) for key, call in calls.items()}
+    return {key: future.result() for key, future in futures.items()}
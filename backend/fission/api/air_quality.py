@@ -1,13 +1,82 @@
+import elasticsearch
 import utils
-import pytz
+import rollups
+import catalog
+import geo
+import field_stats
 
-def get_stations(es):
+# per-station summary statistics, shared by the single and batch queries
+OBSERVATION_AGGS = {
+    "avg_pm25": {
+        "avg": {
+            "field": "averageValue"
+        }
+    },
+    "max_pm25": {
+        "max": {
+            "field": "averageValue"
+        }
+    },
+    "min_pm25": {
+        "min": {
+            "field": "averageValue"
+        }
+    },
+}
+
+# numeric observation fields callers can request statistics for with ?fields=&stats=
+METRIC_FIELDS = ("averageValue", "totalSample")
+DEFAULT_METRIC_FIELDS = ("averageValue",)
+
+# one document per site, upserted by the EPA harvester
+STATIONS_INDEX = "air_quality_stations"
+STATION_FIELDS = ("site_id", "site_name", "latitude", "longitude")
+
+# geo_point holding the station's position, in the catalog and on every observation
+LOCATION_FIELD = "location"
+
+# upper bound on the number of stations accepted by a single batch request
+MAX_BATCH_STATIONS = 500
+
+def get_stations(es, size=None, after=None, fields=None, bbox=None, near=None, radius=None):
+    """
+    Pages through the station catalog, which holds one entry per EPA site
+    """
+    try:
+        size, fields = catalog.parse_page_args(size, fields, STATION_FIELDS)
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    try:
+        return catalog.get_page(es, STATIONS_INDEX, "site_id", fields, size, after or None, area_filters(area))
+    except elasticsearch.NotFoundError:
+        return get_stations_from_observations(es, area)
+
+
+def area_filters(area):
+    # stations and observations both carry their station's position as the geo_point location
+    return [geo.point_filter(LOCATION_FIELD, area)] if area else []
+
+
+def stations_in_area(es, area):
+    """
+    IDs of the catalog's stations inside area
+    """
+    return catalog.find_ids(es, STATIONS_INDEX, "site_id", area_filters(area), MAX_BATCH_STATIONS)
+
+
+def get_stations_from_observations(es, area=None):
+    """
+    Builds the site list from the observations themselves. Only used until the
+    station catalog has been populated by the harvester.
+    """
     query = {
         "size": 0, # don't return any documents
         "aggs": {
             "stations": {
                 "composite": {
-                    "size": 100, # max number of stations
+                    "size": 100, # stations per page
                     "sources": [
                         {"site_id": {"terms": {"field": "site_id.keyword"}}},
                         {"site_name": {"terms": {"field": "site_name.keyword"}}},
@@ -19,87 +88,160 @@ def get_stations(es):
         },
         "_source": False
     }
+    if area:
+        query["query"] = {"bool": {"filter": area_filters(area)}}
 
-    res =  es.search(index="air_quality_data", body=query)
-    results = res["aggregations"]["stations"]["buckets"]
-    stations = [result["key"] for result in results]
+    stations = []
+    while True:
+        res = es.search(index="air_quality_data", body=query)["aggregations"]["stations"]
+        stations.extend(result["key"] for result in res["buckets"])
+        if "after_key" not in res or not res["buckets"]:
+            break
+        query["aggs"]["stations"]["composite"]["after"] = res["after_key"]
     return {"stations": stations}
 
 
-def aggregate_observations(es, station_id, year=None, month=None, day=None, hour=None):
+def get_date_filter(window):
+    """
+    Builds the range filter on since for a window resolved by utils.resolve_window, along
+    with the date_filter summary returned to the caller. Both are None without a window.
+    """
+    if window is None:
+        return None, None
+
+    # since is stored in UTC, Elasticsearch converts the local bounds
+    return utils.window_range("since", window, utils.LOCAL_TZ_NAME), utils.describe_window(window)
+
+
+def aggregate_observations(es, station_id, year=None, month=None, day=None, hour=None, interval=None,
+                           fields=None, stats=None, start=None, end=None, last=None):
+    """
+    Summary statistics for one station. With an interval (hour, day, week or month) the
+    statistics are returned as a time series of parallel arrays instead of single values.
+    The window is a calendar period, start/end or last, see utils.resolve_window.
+    fields and stats select other statistics than the default PM2.5 summary, see field_stats.
+    """
     query = {
         "query": {
             "bool": { "filter": [ { "term": { "site_id.keyword": { "value": station_id } } }, ] }
         },
         "size": 0,
-        "aggs": {
-            "avg_pm25": {
-                "avg": {
-                    "field": "averageValue"
-                }
-            },
-            "max_pm25": {
-                "max": {
-                    "field": "averageValue"
-                }
-            },
-            "min_pm25": {
-                "min": {
-                    "field": "averageValue"
-                }
-            },
-        }
+        "aggs": OBSERVATION_AGGS
     }
     
-    if year:
-        try:
-            year = int(year)
-        except ValueError:
-            return {"error": "year must be an integer"}
-        
-    if month:
-        try:
-            month = int(month)
-        except ValueError:
-            return {"error": "year must be an integer"}
-        
-    if day:
-        try:
-            day = int(day)
-        except ValueError:
-            return {"error": "year must be an integer"}
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        selection = field_stats.parse(fields, stats, METRIC_FIELDS, DEFAULT_METRIC_FIELDS)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    if selection:
+        query["aggs"] = field_stats.build_aggs(selection)
     
-    if hour:
-        try:
-            hour = int(hour)
-        except ValueError:
-            return {"error": "year must be an integer"}
+    range_filter, date_filter = get_date_filter(window)
+    if range_filter:
+        query["query"]["bool"]["filter"].append(range_filter)
+
+    if interval:
+        if interval not in utils.HISTOGRAM_INTERVALS:
+            return {"error": f"interval must be one of {', '.join(utils.HISTOGRAM_INTERVALS)}"}
+        # since is stored in UTC, bucket on Melbourne days and hours
+        query["aggs"] = {
+            "series": utils.date_histogram_agg("since", interval, query["aggs"], date_filter, time_zone='Australia/Melbourne')
+        }
     
-    if year:
-        # times are utc, other apis are in local time, so we need to convert
-        # to Melbourne time for the easy of this assignment
-        start_date, end_date = utils.get_date_limits(year, month, day, hour)
-
-        melb_tz = pytz.timezone('Australia/Melbourne')
-        start_date = melb_tz.localize(start_date).astimezone(pytz.utc)
-        end_date = melb_tz.localize(end_date).astimezone(pytz.utc)
-
-        query["query"]["bool"]["filter"].append({
-            "range": {
-                "since": {
-                    "gte": start_date.isoformat(),
-                    "lte": end_date.isoformat()
+    if interval:
+        res = es.search(index="air_quality_data", body=query).body["aggregations"]
+        if selection:
+            res = utils.histogram_columns(res["series"]["buckets"], field_stats.names(selection),
+                                          lambda bucket: field_stats.values(bucket, selection))
+        else:
+            res = utils.histogram_columns(res["series"]["buckets"], OBSERVATION_AGGS)
+        res["interval"] = interval
+    elif selection and not field_stats.from_rollups(selection, "air_quality_data"):
+        # deviations and percentiles can't be rebuilt from the rollups, read the raw observations
+        res = field_stats.values(es.search(index="air_quality_data", body=query).body["aggregations"], selection)
+    else:
+        # summaries come from the hourly/daily rollups, with raw observations for the edges
+        window_start, window_end = utils.window_bounds(window)
+        summary = rollups.summarise(es, "air_quality_data", {"site_id": station_id}, window_start, window_end)
+        if selection:
+            res = field_stats.summary_values(summary.get(None), selection)
+        else:
+            res = rollups.metric_values(OBSERVATION_AGGS, summary.get(None))
+    
+    if date_filter:
+        res["date_filter"] = date_filter
+        
+    return res
+
+
+def aggregate_observations_batch(es, station_ids, year=None, month=None, day=None, hour=None,
+                                 fields=None, stats=None, start=None, end=None, last=None,
+                                 bbox=None, near=None, radius=None):
+    """
+    Same statistics as aggregate_observations for many sites at once, computed in a single
+    search with a terms aggregation bucketing on the site ID. With bbox or near/radius
+    (see geo.parse) the sites in that area are used, only those listed if any are.
+    """
+    station_ids = sorted(set(station_ids))
+
+    try:
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+    if area:
+        in_area = stations_in_area(es, area)
+        station_ids = sorted(set(in_area) & set(station_ids) if station_ids else set(in_area))
+        if not station_ids:
+            return {"stations": {}, "area": geo.describe(area)}
+    elif not station_ids:
+        return {"error": "no station IDs provided"}
+    if len(station_ids) > MAX_BATCH_STATIONS:
+        return {"error": f"at most {MAX_BATCH_STATIONS} stations can be requested at once"}
+
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        selection = field_stats.parse(fields, stats, METRIC_FIELDS, DEFAULT_METRIC_FIELDS)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    range_filter, date_filter = get_date_filter(window)
+    names = field_stats.names(selection) if selection else OBSERVATION_AGGS
+
+    # sites without observations in the window still get an entry, like the single station route
+    stations = {station_id: { key: None for key in names } for station_id in station_ids}
+
+    if selection and not field_stats.from_rollups(selection, "air_quality_data"):
+        conditions = [{"terms": {"site_id.keyword": station_ids}}]
+        if range_filter:
+            conditions.append(range_filter)
+        query = {
+            "size": 0,
+            "query": {"bool": {"filter": conditions}},
+            "aggs": {
+                "stations": {
+                    "terms": {"field": "site_id.keyword", "size": len(station_ids)},
+                    "aggs": field_stats.build_aggs(selection)
                 }
             }
-        })
-    
-    res = es.search(index="air_quality_data", body=query).body["aggregations"]
-    res = { key: res[key]["value"] for key in res }
-    
-    if year:
-        res["date_filter"] = {
-            "start": start_date.astimezone(melb_tz).strftime("%Y-%m-%d %H:%M:%S"),
-            "end": end_date.astimezone(melb_tz).strftime("%Y-%m-%d %H:%M:%S")
         }
-        
+        buckets = es.search(index="air_quality_data", body=query).body["aggregations"]["stations"]["buckets"]
+        for bucket in buckets:
+            stations[bucket["key"]] = field_stats.values(bucket, selection)
+    else:
+        window_start, window_end = utils.window_bounds(window)
+        res = rollups.summarise(es, "air_quality_data", {"site_id": station_ids}, window_start, window_end, group_by="site_id")
+        for station_id, summary in res.items():
+            if selection:
+                stations[station_id] = field_stats.summary_values(summary, selection)
+            else:
+                stations[station_id] = rollups.metric_values(OBSERVATION_AGGS, summary)
+
+    res = {"stations": stations}
+    if date_filter:
+        res["date_filter"] = date_filter
+    if area:
+        res["area"] = geo.describe(area)
+
     return res
@@ -1,57 +1,299 @@
 import weather
 import air_quality
-import json
-from flask import request
+import es_client
+import aio
+import cache
+import admission
+import resilience
+import export
+import grid
+import responses
+import timing
+import query_log
 import elasticsearch
+from flask import request, Response, stream_with_context, copy_current_request_context
 
-def config(k):
-    with open(f'/configs/default/shared-data/{k}', 'r') as f:
-        return f.read().strip()
-    
-def connect_elasticsearch():
-    return elasticsearch.Elasticsearch(
-        f"https://elasticsearch-master.elastic.svc.cluster.local:9200",
-        http_auth=(config('ES_USERNAME'), config('ES_PASSWORD')),
-        verify_certs=False
-    )
+WEATHER_INDEX = "new_weather_data"
+AIR_QUALITY_INDEX = "air_quality_data"
+
+# seconds each route's Elasticsearch calls may take, see resilience.py
+DEADLINES = {
+    "stations": 5,
+    "observations": 10,
+    "observations_batch": 15,
+    "dashboard": 15,
+    "grid": 10,
+}
+
+def get_es(deadline=None):
+    # Elasticsearch calls go through the pod's shared event loop unless API_ASYNC_ES=0
+    with timing.stage("client"):
+        es = aio.BlockingClient() if aio.ENABLED else es_client.get_client()
+    return resilience.with_deadline(es, deadline) if deadline else es
+
+def window_args():
+    # the time window parameters accepted by every observation route, see utils.resolve_window
+    return {name: request.args.get(name, None) for name in ("year", "month", "day", "hour", "start", "end", "last")}
+
+def area_args():
+    # the spatial parameters accepted by the station and batch observation routes, see geo.parse
+    return {name: request.args.get(name, None) for name in ("bbox", "near", "radius")}
 
+def cached_response(es, index, key, compute):
+    """
+    Caches compute()'s result under the route-specific key plus the normalised date window.
+    Raises admission.Overloaded if the pod is too busy to compute it, and resilience.Unavailable
+    if Elasticsearch is degraded and there's no earlier result to serve.
+    With ?profile=true the result is always computed and carries its searches' profiles.
+    """
+    if query_log.profiling():
+        return profiled(compute)
+
+    try:
+        window, window_end = cache.window_key(**window_args())
+    except ValueError:
+        # invalid parameters, let the handler report the error
+        return compute()
+
+    # identical requests in flight share one lookup, and only cache misses take a query slot.
+    # While Elasticsearch is degraded the last good result is served instead.
+    key = tuple(key) + window
+    lookup = lambda: cache.cached(es, index, key, window_end, lambda: admission.admitted(compute))
+    return resilience.call((index,) + key, lambda: admission.single_flight((index,) + key, lookup))
+
+def profiled(compute):
+    # bypasses the caches so the profile describes the queries the request actually needs
+    value = admission.admitted(compute)
+    if isinstance(value, dict):
+        value = dict(value, profile=query_log.collected())
+    return value
+
+@timing.timed("weather-stations")
+@admission.sheds_load
+@resilience.serves_unavailable
 def weather_get_stations():
-    es = connect_elasticsearch()
-    return json.dumps(weather.get_stations(es))
+    es = get_es(DEADLINES["stations"])
+    size = request.args.get("size", None)
+    after = request.args.get("after", None)
+    fields = request.args.get("fields", None)
+    area = area_args()
+
+    return responses.json_response(cached_response(
+        es, WEATHER_INDEX, ["stations", size, after, fields] + list(area.values()),
+        lambda: weather.get_stations(es, size, after, fields, **area)
+    ))
 
+@timing.timed("weather-stations-observations")
+@admission.sheds_load
+@resilience.serves_unavailable
 def weather_aggregate_observations():
-    es = connect_elasticsearch()
+    es = get_es(DEADLINES["observations"])
 
     try:
         station_id = request.headers["X-Fission-Params-station-id"]
-        print(f"station_id: {station_id}")
     except KeyError:
         return "Error: station_id not provided", 400
     
-    year = request.args.get("year", None)
-    month = request.args.get("month", None)
-    day = request.args.get("day", None)
-    hour = request.args.get("hour", None)
+    window = window_args()
+    interval = request.args.get("interval", None)
+    fields = request.args.get("fields", None)
+    stats = request.args.get("stats", None)
     
-    return json.dumps(weather.aggregate_observations(es, station_id, year, month, day, hour)) 
+    return responses.json_response(cached_response(
+        es, WEATHER_INDEX, ["observations", station_id, interval, fields, stats],
+        lambda: weather.aggregate_observations(es, station_id, interval=interval, fields=fields, stats=stats, **window)
+    )) 
     
+@timing.timed("air-quality-stations")
+@admission.sheds_load
+@resilience.serves_unavailable
 def air_quality_get_stations():
-    es = connect_elasticsearch()
-    return json.dumps(air_quality.get_stations(es))
+    es = get_es(DEADLINES["stations"])
+    size = request.args.get("size", None)
+    after = request.args.get("after", None)
+    fields = request.args.get("fields", None)
+    area = area_args()
 
+    return responses.json_response(cached_response(
+        es, AIR_QUALITY_INDEX, ["stations", size, after, fields] + list(area.values()),
+        lambda: air_quality.get_stations(es, size, after, fields, **area)
+    ))
+
+@timing.timed("air-quality-stations-observations")
+@admission.sheds_load
+@resilience.serves_unavailable
 def air_quality_aggregate_observations():
-    es = connect_elasticsearch()
+    es = get_es(DEADLINES["observations"])
 
     try:
         station_id = request.headers["X-Fission-Params-station-id"]
-        print(f"station_id: {station_id}")
     except KeyError:
         return "Error: station_id not provided", 400
     
-    year = request.args.get("year", None)
-    month = request.args.get("month", None)
-    day = request.args.get("day", None)
-    hour = request.args.get("hour", None)
+    window = window_args()
+    interval = request.args.get("interval", None)
+    fields = request.args.get("fields", None)
+    stats = request.args.get("stats", None)
     
-    return json.dumps(air_quality.aggregate_observations(es, station_id, year, month, day, hour))
+    return responses.json_response(cached_response(
+        es, AIR_QUALITY_INDEX, ["observations", station_id, interval, fields, stats],
+        lambda: air_quality.aggregate_observations(es, station_id, interval=interval, fields=fields, stats=stats, **window)
+    ))
+
+
+def grid_args():
+    # see grid.get_grid
+    return {name: request.args.get(name, None) for name in ("metric", "grid", "zoom", "bbox", "near", "radius")}
+
+@timing.timed("weather-grid")
+@admission.sheds_load
+@resilience.serves_unavailable
+def weather_grid():
+    """
+    Weather observations aggregated into map grid cells, see grid.py
+    """
+    es = get_es(DEADLINES["grid"])
+    args = grid_args()
+
+    return responses.json_response(cached_response(
+        es, WEATHER_INDEX, ["grid"] + list(args.values()),
+        lambda: grid.get_grid(es, "weather", **args, **window_args())
+    ))
+
+@timing.timed("air-quality-grid")
+@admission.sheds_load
+@resilience.serves_unavailable
+def air_quality_grid():
+    """
+    PM2.5 observations aggregated into map grid cells, see grid.py
+    """
+    es = get_es(DEADLINES["grid"])
+    args = grid_args()
+
+    return responses.json_response(cached_response(
+        es, AIR_QUALITY_INDEX, ["grid"] + list(args.values()),
+        lambda: grid.get_grid(es, "air_quality", **args, **window_args())
+    ))
+
+
+def get_station_ids():
+    # accepts ?stations=a,b,c and/or repeated ?station=a&station=b
+    station_ids = request.args.getlist("station")
+    for stations in request.args.getlist("stations"):
+        station_ids.extend(stations.split(","))
+    return [station_id.strip() for station_id in station_ids if station_id.strip()]
+
+@timing.timed("weather-observations-batch")
+@admission.sheds_load
+@resilience.serves_unavailable
+def weather_aggregate_observations_batch():
+    es = get_es(DEADLINES["observations_batch"])
+
+    station_ids = get_station_ids()
+    area = area_args()
+    if not station_ids and not (area["bbox"] or area["near"]):
+        return "Error: stations, bbox or near not provided", 400
 
+    window = window_args()
+    fields = request.args.get("fields", None)
+    stats = request.args.get("stats", None)
+
+    return responses.json_response(cached_response(
+        es, WEATHER_INDEX, ["observations_batch", fields, stats] + list(area.values()) + sorted(set(station_ids)),
+        lambda: weather.aggregate_observations_batch(es, station_ids, fields=fields, stats=stats, **window, **area)
+    ))
+
+@timing.timed("air-quality-observations-batch")
+@admission.sheds_load
+@resilience.serves_unavailable
+def air_quality_aggregate_observations_batch():
+    es = get_es(DEADLINES["observations_batch"])
+
+    station_ids = get_station_ids()
+    area = area_args()
+    if not station_ids and not (area["bbox"] or area["near"]):
+        return "Error: stations, bbox or near not provided", 400
+
+    window = window_args()
+    fields = request.args.get("fields", None)
+    stats = request.args.get("stats", None)
+
+    return responses.json_response(cached_response(
+        es, AIR_QUALITY_INDEX, ["observations_batch", fields, stats] + list(area.values()) + sorted(set(station_ids)),
+        lambda: air_quality.aggregate_observations_batch(es, station_ids, fields=fields, stats=stats, **window, **area)
+    ))
+
+def export_observations():
+    es = get_es()
+
+    try:
+        dataset = request.headers["X-Fission-Params-dataset"]
+    except KeyError:
+        return "Error: dataset not provided", 400
+
+    fields = request.args.get("fields", None)
+    fields = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    fmt = request.args.get("format", "ndjson")
+
+    error, chunks = export.export(
+        es, dataset, fmt,
+        stations=get_station_ids() or None,
+        fields=fields,
+        page_size=request.args.get("page_size", None),
+        **window_args()
+    )
+    if error:
+        return f"Error: {error}", 400
+
+    return Response(stream_with_context(chunks), mimetype=export.FORMATS[fmt])
+
+
+def get_id_list(name):
+    # accepts ?name=a,b,c and/or repeated ?name=a&name=b
+    ids = []
+    for value in request.args.getlist(name):
+        ids.extend(value.split(","))
+    return [station_id.strip() for station_id in ids if station_id.strip()]
+
+@timing.timed("dashboard")
+@admission.sheds_load
+@resilience.serves_unavailable
+def dashboard():
+    """
+    Weather and air quality summaries for the stations on a dashboard. The two lookups are
+    independent, so they run concurrently and the response takes as long as the slower one.
+    """
+    es = get_es(DEADLINES["dashboard"])
+
+    weather_ids = get_id_list("weather_stations")
+    air_quality_ids = get_id_list("air_quality_stations")
+    if not weather_ids and not air_quality_ids:
+        return "Error: weather_stations or air_quality_stations not provided", 400
+
+    window = window_args()
+
+    calls = {}
+    if weather_ids:
+        calls["weather"] = copy_current_request_context(lambda: cached_response(
+            es, WEATHER_INDEX, ["observations_batch", None, None] + sorted(set(weather_ids)),
+            lambda: weather.aggregate_observations_batch(es, weather_ids, **window)
+        ))
+    if air_quality_ids:
+        calls["air_quality"] = copy_current_request_context(lambda: cached_response(
+            es, AIR_QUALITY_INDEX, ["observations_batch", None, None] + sorted(set(air_quality_ids)),
+            lambda: air_quality.aggregate_observations_batch(es, air_quality_ids, **window)
+        ))
+
+    return responses.json_response(aio.fan_out(calls))
+
+
+def metrics():
+    """
+    Request stage histograms of every API pod in the Prometheus text format, see timing.py
+    """
+    es = es_client.get_client()
+    try:
+        snapshots = timing.collect(es)
+    except (elasticsearch.ApiError, elasticsearch.TransportError) as e:
+        return f"Error: could not read metrics ({e})", 503
+    return Response(timing.render(snapshots), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import hashlib
+import datetime
+import logging
+import threading
+from collections import OrderedDict
+import pytz
+import elasticsearch
+import utils
+
+# Response cache for the API handlers.
+#
+# Entries for date windows that are fully in the past never expire, since the
+# observations behind them no longer change. Entries for windows that are still
+# open (or have no end at all) expire after OPEN_WINDOW_TTL seconds, or earlier
+# if the harvester for the source index bumps its ingestion watermark.
+#
+# There is an in-process LRU tier per pod and an optional shared tier stored in
+# an Elasticsearch index so that all pods benefit from each other's work.
+
+MAX_ENTRIES = int(os.environ.get("API_CACHE_MAX_ENTRIES", 1024))
+OPEN_WINDOW_TTL = float(os.environ.get("API_CACHE_OPEN_TTL", 60))
+# observations can arrive a while after the period they describe, so a window
+# only counts as closed once it ended at least this long ago
+CLOSED_WINDOW_GRACE = datetime.timedelta(hours=float(os.environ.get("API_CACHE_GRACE_HOURS", 3)))
+# how long a watermark read from Elasticsearch is trusted before re-reading it
+WATERMARK_CHECK_INTERVAL = float(os.environ.get("API_CACHE_WATERMARK_INTERVAL", 5))
+SHARED_CACHE = os.environ.get("API_SHARED_CACHE", "0") == "1"
+
+WATERMARK_INDEX = "ingest_watermarks"
+SHARED_CACHE_INDEX = "api_response_cache"
+
+MELB_TZ = pytz.timezone('Australia/Melbourne')
+
+_lock = threading.Lock()
+_entries = OrderedDict()
+_watermarks = {}
+_shared_index_ready = False
+stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
+
+
+def window_key(year=None, month=None, day=None, hour=None, start=None, end=None, last=None):
+    """
+    Normalises the time window parameters of a request into a cache key component and
+    the (naive, Melbourne local) end of the window, or None if it has no end. Relative
+    windows are rounded, so refreshes within the same period share an entry.
+    Raises ValueError for parameters the handlers would reject.
+    """
+    window = utils.resolve_window(year, month, day, hour, start, end, last)
+    start, end = utils.window_bounds(window)
+    return (start, end), end
+
+
+def is_closed(window_end):
+    if window_end is None:
+        return False
+    now = datetime.datetime.now(MELB_TZ).replace(tzinfo=None)
+    return window_end + CLOSED_WINDOW_GRACE < now
+
+
+def get_watermark(es, index):
+    """
+    Returns the last ingestion time recorded by the harvester writing to index
+    """
+    now = time.monotonic()
+    cached = _watermarks.get(index)
+    if cached is not None and now - cached[0] < WATERMARK_CHECK_INTERVAL:
+        return cached[1]
+
+    try:
+        watermark = es.get(index=WATERMARK_INDEX, id=index)["_source"].get("updated_at")
+    except elasticsearch.NotFoundError:
+        watermark = None
+
+    _watermarks[index] = (now, watermark)
+    return watermark
+
+
+def _is_valid(entry, watermark):
+    if entry["expires_at"] is None:
+        return True
+    return entry["expires_at"] > time.time() and entry["watermark"] == watermark
+
+
+def _local_get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+        return entry
+
+
+def _local_put(key, entry):
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+            stats["evictions"] += 1
+
+
+def _shared_id(key):
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _ensure_shared_index(es):
+    global _shared_index_ready
+    if _shared_index_ready:
+        return
+    try:
+        # values are only ever fetched by id, so nothing but expiry needs indexing
+        es.indices.create(index=SHARED_CACHE_INDEX, mappings={
+            "dynamic": False,
+            "properties": {"expires_at": {"type": "date", "format": "epoch_second"}}
+        })
+    except elasticsearch.BadRequestError as e:
+        if e.error != "resource_already_exists_exception":
+            raise
+    _shared_index_ready = True
+
+
+def _shared_get(es, key):
+    try:
+        doc = es.get(index=SHARED_CACHE_INDEX, id=_shared_id(key))["_source"]
+    except elasticsearch.NotFoundError:
+        return None
+    return {"value": json.loads(doc["value"]), "expires_at": doc["expires_at"], "watermark": doc["watermark"]}
+
+
+def _shared_put(es, key, entry):
+    _ensure_shared_index(es)
+    es.index(index=SHARED_CACHE_INDEX, id=_shared_id(key), document={
+        "key": key,
+        "value": json.dumps(entry["value"]),
+        "expires_at": entry["expires_at"],
+        "watermark": entry["watermark"],
+    })
+
+
+def cached(es, index, key, window_end, compute):
+    """
+    Returns the cached result for key, or calls compute() and caches its result.
+
+    index is the observation index the result was computed from (its watermark
+    invalidates open windows) and window_end the end of the requested date window.
+    Results containing an "error" are never cached.
+    """
+    key = json.dumps([index] + list(key), default=str)
+    closed = is_closed(window_end)
+    watermark = None if closed else get_watermark(es, index)
+
+    entry = _local_get(key)
+    if entry is not None and _is_valid(entry, watermark):
+        stats["hits"] += 1
+        return entry["value"]
+
+    if SHARED_CACHE:
+        try:
+            entry = _shared_get(es, key)
+        except elasticsearch.ApiError as e:
+            logging.warning("Shared cache read failed: %s", e)
+            entry = None
+        if entry is not None and _is_valid(entry, watermark):
+            stats["shared_hits"] += 1
+            _local_put(key, entry)
+            return entry["value"]
+
+    stats["misses"] += 1
+    value = compute()
+    if isinstance(value, dict) and "error" in value:
+        return value
+
+    entry = {
+        "value": value,
+        "expires_at": None if closed else time.time() + OPEN_WINDOW_TTL,
+        "watermark": watermark,
+    }
+    _local_put(key, entry)
+    if SHARED_CACHE:
+        try:
+            _shared_put(es, key, entry)
+        except elasticsearch.ApiError as e:
+            logging.warning("Shared cache write failed: %s", e)
+
+    return value
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _watermarks.clear()
@@ -0,0 +1,69 @@
+# Reads the station catalog indexes the harvesters upsert into (one document per
+# station, keyed by its ID), with cursor pagination and field selection.
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+
+def parse_page_args(size=None, fields=None, allowed_fields=()):
+    """
+    Validates the size and fields query parameters. Raises ValueError with a message for the caller.
+    """
+    if size:
+        try:
+            size = int(size)
+        except ValueError:
+            raise ValueError("size must be an integer")
+        if not 0 < size <= MAX_PAGE_SIZE:
+            raise ValueError(f"size must be between 1 and {MAX_PAGE_SIZE}")
+    else:
+        size = DEFAULT_PAGE_SIZE
+
+    if fields:
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in allowed_fields]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    else:
+        fields = list(allowed_fields)
+
+    return size, fields
+
+
+def get_page(es, index, id_field, fields, size, after=None, filters=None):
+    """
+    One page of catalog entries sorted by id_field, starting after the cursor value after,
+    optionally restricted to the entries matching filters (e.g. a geo.point_filter).
+    The response carries a "next" cursor if there may be more entries.
+    Raises elasticsearch.NotFoundError if the catalog index doesn't exist yet.
+    """
+    query = {
+        "size": size,
+        "sort": [{id_field: "asc"}],
+        "_source": fields,
+    }
+    if filters:
+        query["query"] = {"bool": {"filter": filters}}
+    if after is not None:
+        query["search_after"] = [after]
+
+    hits = es.search(index=index, body=query)["hits"]["hits"]
+
+    res = {"stations": [hit["_source"] for hit in hits]}
+    if len(hits) == size:
+        res["next"] = str(hits[-1]["sort"][0])
+    return res
+
+
+def find_ids(es, index, id_field, filters, limit):
+    """
+    IDs of up to limit catalog entries matching filters, sorted
+    """
+    query = {
+        "size": limit,
+        "sort": [{id_field: "asc"}],
+        "_source": [id_field],
+        "query": {"bool": {"filter": filters}},
+    }
+    hits = es.search(index=index, body=query)["hits"]["hits"]
+    return [hit["_source"][id_field] for hit in hits]
@@ -0,0 +1,281 @@
+import io
+import json
+import logging
+import elasticsearch
+import utils
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow output is optional when running locally
+    pa = None
+
+# Streams raw observations out of Elasticsearch page by page, using a point in
+# time and search_after so memory stays constant however large the export is.
+
+DATASETS = {
+    "weather": {
+        "index": "new_weather_data",
+        "time_field": "local_date_time_full",
+        "time_zone": None,
+        "station_field": "wmo",
+    },
+    "air-quality": {
+        "index": "air_quality_data",
+        "time_field": "since",
+        "time_zone": "Australia/Melbourne",
+        "station_field": "site_id.keyword",
+    },
+    "traffic": {
+        "index": "traffic-data",
+        "time_field": "publishedTime",
+        "time_zone": None,
+        "station_field": "freewayName.keyword",
+    },
+}
+
+# the daily traffic layout (see traffic-api/daily.py), read instead of traffic-data while the
+# traffic harvester marks it as harvested. Every observation is exported as a record of its own,
+# like a traffic-data document.
+DAILY_TRAFFIC = {
+    "index": "traffic-daily",
+    "time_field": "times",
+    "time_zone": None,
+    "station_field": "freewayName",
+}
+DAILY_TRAFFIC_METRICS = ("actualTravelTime", "averageSpeed", "congestionIndex")
+PY_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+PIT_KEEP_ALIVE = "2m"
+
+
+def build_query(settings, stations=None, window=None):
+    conditions = []
+    if stations:
+        conditions.append({"terms": {settings["station_field"]: stations}})
+    if window is not None:
+        conditions.append(utils.window_range(settings["time_field"], window, settings["time_zone"]))
+    return {"bool": {"filter": conditions}} if conditions else {"match_all": {}}
+
+
+def daily_traffic(es):
+    """
+    Whether the traffic harvester writes the daily layout instead of traffic-data
+    """
+    try:
+        mapping = es.indices.get_mapping(index=DAILY_TRAFFIC["index"])
+    except elasticsearch.NotFoundError:
+        return False
+    return any(index.get("mappings", {}).get("_meta", {}).get("harvested") is True for index in mapping.values())
+
+
+def iter_pages(es, index, query, fields=None, page_size=PAGE_SIZE):
+    """
+    Yields lists of _source documents, one list per page, until the matching documents run out
+    """
+    pit = es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE)["id"]
+    try:
+        search_after = None
+        while True:
+            body = {
+                "size": page_size,
+                "query": query,
+                "pit": {"id": pit, "keep_alive": PIT_KEEP_ALIVE},
+                # _shard_doc is the cheapest stable sort for a point in time
+                "sort": [{"_shard_doc": "asc"}],
+                "track_total_hits": False,
+            }
+            if fields:
+                body["_source"] = fields
+            if search_after is not None:
+                body["search_after"] = search_after
+
+            res = es.search(body=body)
+            hits = res["hits"]["hits"]
+            if not hits:
+                break
+
+            # the point in time id can change between pages
+            pit = res.get("pit_id", pit)
+            search_after = hits[-1]["sort"]
+            yield [hit["_source"] for hit in hits]
+
+            if len(hits) < page_size:
+                break
+    finally:
+        try:
+            es.close_point_in_time(id=pit)
+        except elasticsearch.ApiError:
+            pass
+
+
+def daily_observations(pages, window, fields=None):
+    """
+    Pages of daily traffic documents as pages of their observations in the window
+    """
+    start, end = (bound.strftime(PY_TIME_FORMAT) if bound else None for bound in utils.window_bounds(window))
+    for page in pages:
+        records = []
+        for doc in page:
+            for i, time in enumerate(doc.get("times") or []):
+                if (start and time < start) or (end and time >= end):
+                    continue
+                record = {name: doc.get(name) for name in ("segmentId", "freewayName", "segmentName")}
+                record["publishedTime"] = time
+                for metric in DAILY_TRAFFIC_METRICS:
+                    values = doc.get(metric) or []
+                    record[metric] = values[i] if i < len(values) else None
+                record["location"] = doc.get("location")
+                records.append({name: record[name] for name in fields if name in record} if fields else record)
+        if records:
+            yield records
+
+
+def ndjson_stream(pages):
+    for page in pages:
+        yield "".join(json.dumps(doc) + "\n" for doc in page).encode("utf-8")
+
+
+# Elasticsearch field types and the Arrow type their _source values are written as
+ARROW_TYPES = {
+    "long": "int64",
+    "integer": "int64",
+    "short": "int64",
+    "byte": "int64",
+    "double": "float64",
+    "float": "float64",
+    "half_float": "float64",
+    "scaled_float": "float64",
+    "keyword": "string",
+    "text": "string",
+    "date": "string",
+    "boolean": "bool",
+}
+
+
+def arrow_schema(es, index, table):
+    """
+    Schema for the export: column types come from the index mapping where it has a
+    scalar type, so a page of whole numbers can't pin a float field to int64, and are
+    otherwise inferred from the first page
+    """
+    mapping = es.indices.get_mapping(index=index)
+    properties = {}
+    for index_mapping in mapping.values():
+        properties.update(index_mapping["mappings"].get("properties", {}))
+
+    schema_fields = []
+    for field in table.schema:
+        es_type = properties.get(field.name, {}).get("type")
+        if es_type in ARROW_TYPES:
+            field = pa.field(field.name, ARROW_TYPES[es_type])
+        elif pa.types.is_null(field.type):
+            # empty throughout the first page, later pages may hold anything
+            field = pa.field(field.name, pa.string())
+        schema_fields.append(field)
+    return pa.schema(schema_fields)
+
+
+def arrow_column(values, arrow_type):
+    """
+    values as an Arrow array of arrow_type. _source values don't always match the mapping
+    (BOM stores precise_lat/precise_lon as strings of floats), so they are converted, and
+    a value that can't be is written as null rather than breaking the stream part way.
+    """
+    try:
+        return pa.array(values, type=arrow_type, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    try:
+        return pa.array(values, from_pandas=True).cast(arrow_type, safe=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pass
+    converted = []
+    for value in values:
+        try:
+            converted.append(pa.array([value], from_pandas=True).cast(arrow_type, safe=False)[0].as_py())
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            logging.warning("Exporting %r as null, it is not a %s", value, arrow_type)
+            converted.append(None)
+    return pa.array(converted, type=arrow_type)
+
+
+def arrow_table(page, schema):
+    """
+    The page's documents as a table of the export's schema
+    """
+    columns = [arrow_column([doc.get(field.name) for doc in page], field.type) for field in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def arrow_stream(es, index, pages, fields=None):
+    """
+    Writes the pages as record batches of one Arrow IPC stream. Columns are the requested
+    fields, or those present in the first page.
+    """
+    sink = io.BytesIO()
+    writer = None
+    schema = None
+
+    for page in pages:
+        if schema is None:
+            table = pa.Table.from_pylist(page)
+            if fields:
+                table = table.select([field for field in fields if field in table.column_names])
+            schema = arrow_schema(es, index, table)
+            writer = pa.ipc.new_stream(sink, schema)
+
+        writer.write_table(arrow_table(page, schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+
+    if writer is not None:
+        writer.close()
+        yield sink.getvalue()
+
+
+def export(es, dataset, fmt="ndjson", stations=None, fields=None, page_size=None,
+           year=None, month=None, day=None, hour=None, start=None, end=None, last=None):
+    """
+    Validates the export parameters. Returns (error, None) or (None, generator of bytes chunks).
+    """
+    if dataset not in DATASETS:
+        return f"dataset must be one of {', '.join(DATASETS)}", None
+    if fmt not in FORMATS:
+        return f"format must be one of {', '.join(FORMATS)}", None
+    if fmt == "arrow" and pa is None:
+        return "arrow output requires pyarrow", None
+
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+    except ValueError as e:
+        return str(e), None
+
+    if page_size:
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            return "page_size must be an integer", None
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            return f"page_size must be between 1 and {MAX_PAGE_SIZE}", None
+    else:
+        page_size = PAGE_SIZE
+
+    settings = DATASETS[dataset]
+    if dataset == "traffic" and daily_traffic(es):
+        settings = DAILY_TRAFFIC
+        pages = daily_observations(iter_pages(es, settings["index"], build_query(settings, stations, window),
+                                              page_size=page_size), window, fields)
+    else:
+        pages = iter_pages(es, settings["index"], build_query(settings, stations, window), fields, page_size)
+
+    if fmt == "arrow":
+        return None, arrow_stream(es, settings["index"], pages, fields)
+    return None, ndjson_stream(pages)
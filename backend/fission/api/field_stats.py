@@ -0,0 +1,128 @@
+import rollups
+
+# Caller-selected statistics for the observation routes, e.g.
+# ?fields=air_temp,rel_hum&stats=avg,stddev,p90
+#
+# Each field is aggregated in a single stats (or extended_stats, when stddev or
+# variance is asked for) pass rather than one aggregation per statistic, plus a
+# single percentiles aggregation (TDigest) when percentiles are asked for.
+# Results are named <stat>_<field>, e.g. p90_air_temp.
+#
+# Keep in sync with traffic-api/field_stats.py.
+
+BASIC_STATS = ("count", "sum", "avg", "min", "max")
+EXTENDED_STATS = {"stddev": "std_deviation", "variance": "variance"}
+PERCENTILES = {"p50": 50.0, "p90": 90.0, "p95": 95.0, "p99": 99.0}
+STATS = BASIC_STATS + tuple(EXTENDED_STATS) + tuple(PERCENTILES)
+
+DEFAULT_STATS = ("avg", "min", "max")
+TDIGEST_COMPRESSION = 100
+
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse(fields, stats, allowed_fields, default_fields):
+    """
+    Validates the fields and stats query parameters. Returns None if neither is given (the
+    route's fixed statistics apply), otherwise (fields, stats) with defaults filled in.
+    Raises ValueError for unknown fields or statistics.
+    """
+    if not fields and not stats:
+        return None
+
+    fields = _split(fields) if fields else list(default_fields)
+    stats = _split(stats) if stats else list(DEFAULT_STATS)
+
+    unknown = [field for field in fields if field not in allowed_fields]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    unknown = [stat for stat in stats if stat not in STATS]
+    if unknown:
+        raise ValueError(f"unknown stats: {', '.join(unknown)}, expected some of {', '.join(STATS)}")
+
+    # drop duplicates, keeping the requested order
+    return list(dict.fromkeys(fields)), list(dict.fromkeys(stats))
+
+
+def names(selection):
+    fields, stats = selection
+    return [f"{stat}_{field}" for field in fields for stat in stats]
+
+
+def build_aggs(selection):
+    """
+    Aggregations computing every selected statistic, at most two per field
+    """
+    fields, stats = selection
+    percents = [PERCENTILES[stat] for stat in stats if stat in PERCENTILES]
+    kind = "extended_stats" if any(stat in EXTENDED_STATS for stat in stats) else "stats"
+    needs_stats = any(stat not in PERCENTILES for stat in stats)
+
+    aggs = {}
+    for field in fields:
+        if needs_stats:
+            aggs[f"{field}_stats"] = {kind: {"field": field}}
+        if percents:
+            aggs[f"{field}_percentiles"] = {
+                "percentiles": {
+                    "field": field,
+                    "percents": percents,
+                    "keyed": False,
+                    "tdigest": {"compression": TDIGEST_COMPRESSION},
+                }
+            }
+    return aggs
+
+
+def values(aggs, selection):
+    """
+    Reads the selected statistics out of the results of build_aggs
+    """
+    fields, stats = selection
+    res = {}
+    for field in fields:
+        field_stats = aggs.get(f"{field}_stats", {})
+        percentiles = {
+            item["key"]: item["value"] for item in aggs.get(f"{field}_percentiles", {}).get("values", [])
+        }
+        for stat in stats:
+            if stat in PERCENTILES:
+                value = percentiles.get(PERCENTILES[stat])
+            elif stat in EXTENDED_STATS:
+                value = field_stats.get(EXTENDED_STATS[stat])
+            else:
+                value = field_stats.get(stat)
+            res[f"{stat}_{field}"] = value
+    return res
+
+
+def from_rollups(selection, source):
+    """
+    True if every selected statistic can be answered from the rollups of source, which only
+    keep count/sum/min/max
+    """
+    fields, stats = selection
+    rolled_up = rollups.SOURCES[source]["metric_fields"]
+    return all(field in rolled_up for field in fields) and all(stat in BASIC_STATS for stat in stats)
+
+
+def summary_values(summary, selection):
+    """
+    Selected statistics from rollups.summarise stats, for selections where from_rollups is True
+    """
+    fields, stats = selection
+    res = {}
+    for field in fields:
+        field_stats = (summary or {}).get(field) or {"count": 0, "sum": 0, "min": None, "max": None}
+        for stat in stats:
+            if stat == "avg":
+                value = field_stats["sum"] / field_stats["count"] if field_stats["count"] else None
+            elif stat == "sum":
+                # matches the stats aggregation, which reports 0 for no observations
+                value = field_stats["sum"] or 0
+            else:
+                value = field_stats[stat]
+            res[f"{stat}_{field}"] = value
+    return res
@@ -0,0 +1,153 @@
+import math
+import logging
+import utils
+import geo
+
+# Map grids: observations bucketed into geotile or geohash cells with the avg and
+# max of one measure per cell, for heatmap layers. The map's zoom level sets the
+# cell size, so a layer costs at most MAX_CELLS cells whatever the data volume.
+#
+# Keep in sync with the copy in traffic-api/.
+
+# observation indices with a geo_point location, and the measures a grid can show by their API names
+SOURCES = {
+    "weather": {
+        "index": "new_weather_data",
+        "time_field": "local_date_time_full",
+        "time_zone": None,
+        "metrics": {"temperature": "air_temp", "wind_speed": "wind_spd_kmh"},
+    },
+    "air_quality": {
+        "index": "air_quality_data",
+        "time_field": "since",
+        "time_zone": utils.LOCAL_TZ_NAME,
+        "metrics": {"pm25": "averageValue"},
+    },
+    "traffic": {
+        "index": "traffic-data",
+        "time_field": "publishedTime",
+        "time_zone": None,
+        "metrics": {"congestion": "congestionIndex", "speed": "averageSpeed", "travel_time": "actualTravelTime"},
+    },
+    # the daily traffic layout (see traffic-api/daily.py), whose documents hold a segment's day
+    # of observations in arrays parallel to their local times
+    "traffic_daily": {
+        "index": "traffic-daily",
+        "time_field": "times",
+        "time_zone": None,
+        "metrics": {"congestion": "congestionIndex", "speed": "averageSpeed", "travel_time": "actualTravelTime"},
+    },
+}
+LOCATION_FIELD = "location"
+GRIDS = ("geotile", "geohash")
+DEFAULT_WINDOW = "24h"
+DEFAULT_ZOOM = 10
+MAX_ZOOM = 20
+# cells are this many zoom levels finer than the map's tiles, i.e. 8x8 cells per 256px tile
+CELL_ZOOM_OFFSET = 3
+MAX_GEOTILE_PRECISION = 29
+MAX_GEOHASH_PRECISION = 12
+# upper bound on the cells of one grid
+MAX_CELLS = 10000
+
+
+def precision(grid, zoom):
+    """
+    Precision of a geotile or geohash grid whose cells suit a map at zoom
+    """
+    cell_zoom = zoom + CELL_ZOOM_OFFSET
+    if grid == "geotile":
+        return min(MAX_GEOTILE_PRECISION, cell_zoom)
+    # a geohash of length n resolves about 5n/2 bits of longitude, a tile at cell_zoom resolves cell_zoom
+    return max(1, min(MAX_GEOHASH_PRECISION, math.ceil(2 * cell_zoom / 5)))
+
+
+def parse_args(source, metric=None, grid=None, zoom=None):
+    metrics = SOURCES[source]["metrics"]
+    metric = metric or next(iter(metrics))
+    grid = grid or "geotile"
+    if metric not in metrics:
+        raise ValueError(f"metric must be one of {', '.join(metrics)}")
+    if grid not in GRIDS:
+        raise ValueError(f"grid must be one of {', '.join(GRIDS)}")
+    try:
+        zoom = int(zoom) if zoom is not None else DEFAULT_ZOOM
+    except ValueError:
+        raise ValueError("zoom must be a whole number")
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+    return metric, grid, zoom
+
+
+def get_grid(es, source, metric=None, grid=None, zoom=None, bbox=None, near=None, radius=None,
+             year=None, month=None, day=None, hour=None, start=None, end=None, last=None, window_fields=None):
+    """
+    avg and max of metric over source's observations in the window (24 hours by default), per
+    grid cell at the precision for zoom, limited to bbox or near/radius if given (see geo.parse).
+    Cells are returned as parallel arrays of keys, counts, values and centroids. For documents
+    holding arrays of observations, window_fields(start, end) gives runtime fields limiting the
+    metrics to the window's values, and cells count those values rather than documents.
+    """
+    settings = SOURCES[source]
+    try:
+        metric, grid, zoom = parse_args(source, metric, grid, zoom)
+        area = geo.parse(bbox, near, radius)
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        if window is None:
+            window = utils.resolve_window(last=DEFAULT_WINDOW)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    cell_precision = precision(grid, zoom)
+    cells = {"field": LOCATION_FIELD, "precision": cell_precision, "size": MAX_CELLS}
+    filters = [utils.window_range(settings["time_field"], window, settings["time_zone"])]
+    if area:
+        filters.append(geo.point_filter(LOCATION_FIELD, area))
+        if "bbox" in area:
+            # no cells are built outside the viewport, even for points on its edge
+            min_lon, min_lat, max_lon, max_lat = area["bbox"]
+            cells["bounds"] = {"top_left": {"lat": max_lat, "lon": min_lon},
+                               "bottom_right": {"lat": min_lat, "lon": max_lon}}
+
+    field = settings["metrics"][metric]
+    query = {
+        "size": 0,
+        "query": {"bool": {"filter": filters}},
+        "aggs": {
+            "cells": {
+                f"{grid}_grid": cells,
+                "aggs": {
+                    "avg": {"avg": {"field": field}},
+                    "max": {"max": {"field": field}},
+                    "centroid": {"geo_centroid": {"field": LOCATION_FIELD}},
+                }
+            }
+        }
+    }
+    if window_fields is not None:
+        query["runtime_mappings"] = window_fields(*utils.window_bounds(window))
+        query["aggs"]["cells"]["aggs"]["count"] = {"value_count": {"field": field}}
+
+    buckets = es.search(index=settings["index"], body=query).body["aggregations"]["cells"]["buckets"]
+    logging.info("Grid of %d %s cells at precision %d", len(buckets), grid, cell_precision)
+
+    def rounded(value):
+        return round(value, 3) if value is not None else None
+
+    centroids = [bucket["centroid"].get("location") or {} for bucket in buckets]
+    res = {
+        "metric": metric,
+        "grid": grid,
+        "zoom": zoom,
+        "precision": cell_precision,
+        "keys": [bucket["key"] for bucket in buckets],
+        "counts": [bucket["count"]["value"] if window_fields else bucket["doc_count"] for bucket in buckets],
+        "avg": [rounded(bucket["avg"]["value"]) for bucket in buckets],
+        "max": [rounded(bucket["max"]["value"]) for bucket in buckets],
+        "lat": [centroid.get("lat") for centroid in centroids],
+        "lon": [centroid.get("lon") for centroid in centroids],
+        "date_filter": utils.describe_window(window),
+    }
+    if area:
+        res["area"] = geo.describe(area)
+    return res
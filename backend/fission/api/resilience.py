@@ -0,0 +1,272 @@
+import os
+import time
+import logging
+import functools
+import threading
+from collections import OrderedDict
+import elasticsearch
+import timing
+import query_log
+from flask import g, has_app_context, Response
+
+# Keeps handlers responsive while Elasticsearch is slow or down.
+#
+# Every call gets a deadline, enforced by the transport (request_timeout) and by
+# Elasticsearch itself (the search timeout), so a struggling cluster can't hold a
+# request until the function times out. Repeated failures trip a circuit breaker,
+# after which calls fail fast until a cool-down has passed. Meanwhile handlers
+# answer from the last good result for the same request, marked with X-Stale and
+# Age headers, or with 503 if they have none.
+#
+# Keep in sync with the copies in traffic-api/ and sudo-api/.
+
+DEFAULT_DEADLINE = float(os.environ.get("API_ES_DEADLINE", 10))
+# share of the deadline given to Elasticsearch's own search timeout, leaving time for the response
+SEARCH_TIMEOUT_SHARE = 0.8
+
+FAILURE_THRESHOLD = int(os.environ.get("API_BREAKER_FAILURES", 5))
+COOL_DOWN = float(os.environ.get("API_BREAKER_COOL_DOWN", 30))
+LAST_GOOD_MAX_ENTRIES = int(os.environ.get("API_LAST_GOOD_MAX_ENTRIES", 512))
+RETRY_AFTER = int(os.environ.get("API_RETRY_AFTER", 2))
+
+# client namespaces, e.g. es.indices.create(...)
+NAMESPACES = ("indices", "cluster", "cat", "nodes", "tasks", "ingest", "snapshot")
+
+# HTTP statuses from Elasticsearch that mean it's overloaded or unavailable, not that the request was bad
+DEGRADED_STATUSES = (429, 500, 502, 503, 504)
+
+_lock = threading.Lock()
+_last_good = OrderedDict()
+_breaker = {"failures": 0, "opened_at": None, "trial": False}
+stats = {"failures": 0, "trips": 0, "stale_served": 0, "unavailable": 0}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class Unavailable(Exception):
+    """
+    Elasticsearch is degraded and there's no earlier result to fall back on
+    """
+
+
+class ObservedNamespace:
+    """
+    A client namespace such as es.indices whose calls feed the circuit breaker like the client's own
+    """
+
+    def __init__(self, namespace):
+        self._namespace = namespace
+
+    def __getattr__(self, name):
+        attr = getattr(self._namespace, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        return functools.partial(_observe, attr)
+
+
+class DeadlineClient:
+    """
+    Wraps an Elasticsearch client so that every call gives up after seconds. Searches also
+    carry an Elasticsearch-side timeout; one that hits it raises DeadlineExceeded rather than
+    returning partial results. The outcome of each call feeds the circuit breaker.
+    """
+
+    def __init__(self, es, seconds):
+        self._es = es.options(request_timeout=seconds)
+        self._search_timeout = f"{int(seconds * SEARCH_TIMEOUT_SHARE * 1000)}ms"
+
+    def __getattr__(self, name):
+        attr = getattr(self._es, name)
+        if name in NAMESPACES:
+            # aio.BlockingClient namespaces are callable, so they're recognised by name
+            return ObservedNamespace(attr)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        return functools.partial(_observe, attr)
+
+    def search(self, body=None, index=None, **kwargs):
+        if body is not None:
+            body = query_log.prepare(dict(body, timeout=self._search_timeout))
+        else:
+            kwargs["timeout"] = self._search_timeout
+            if query_log.profiling():
+                kwargs["profile"] = True
+
+        def search():
+            started = time.perf_counter()
+            res = self._es.search(body=body, index=index, **kwargs)
+            query_log.observe(index, body if body is not None else kwargs, res, (time.perf_counter() - started) * 1000)
+            if res.get("timed_out") is True:
+                raise DeadlineExceeded(f"search timed out after {self._search_timeout}")
+            return res
+        return _observe(search)
+
+    def msearch(self, searches, index=None, **kwargs):
+        # searches alternate between headers and bodies
+        searches = [
+            query_log.prepare(dict(item, timeout=self._search_timeout)) if i % 2 else item
+            for i, item in enumerate(searches)
+        ]
+
+        def msearch():
+            started = time.perf_counter()
+            res = self._es.msearch(searches=searches, index=index, **kwargs)
+            wall_ms = (time.perf_counter() - started) * 1000
+            for header, body, item in zip(searches[::2], searches[1::2], res["responses"]):
+                query_log.observe(header.get("index", index), body, item, wall_ms)
+            if any(item.get("timed_out") is True for item in res["responses"]):
+                raise DeadlineExceeded(f"msearch timed out after {self._search_timeout}")
+            return res
+        return _observe(msearch)
+
+
+def _observe(fn, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        res = fn(*args, **kwargs)
+    except Exception as e:
+        timing.record_es(started, time.perf_counter())
+        if is_degraded(e):
+            record_failure()
+        else:
+            # Elasticsearch answered, even if it rejected the request
+            record_success()
+        raise
+    timing.record_es(started, time.perf_counter(), res.get("took") if hasattr(res, "get") else None)
+    record_success()
+    return res
+
+
+def with_deadline(es, seconds=None):
+    return DeadlineClient(es, seconds or DEFAULT_DEADLINE)
+
+
+def is_degraded(error):
+    """
+    True for errors meaning Elasticsearch is unreachable, overloaded or too slow
+    """
+    if isinstance(error, (DeadlineExceeded, CircuitOpen, elasticsearch.TransportError)):
+        return True
+    return isinstance(error, elasticsearch.ApiError) and error.meta is not None and error.meta.status in DEGRADED_STATUSES
+
+
+def allow_request():
+    """
+    Whether the breaker lets a call through. Once the cool-down has passed a single trial
+    call is let through, and its first Elasticsearch request decides whether the breaker closes.
+    """
+    with _lock:
+        if _breaker["opened_at"] is None:
+            return True
+        if time.monotonic() - _breaker["opened_at"] < COOL_DOWN or _breaker["trial"]:
+            return False
+        _breaker["trial"] = True
+        return True
+
+
+def record_success():
+    with _lock:
+        if _breaker["opened_at"] is not None:
+            logging.info("Elasticsearch recovered, closing circuit breaker")
+        _breaker.update(failures=0, opened_at=None, trial=False)
+
+
+def record_failure():
+    with _lock:
+        stats["failures"] += 1
+        _breaker["failures"] += 1
+        if _breaker["trial"] or (_breaker["opened_at"] is None and _breaker["failures"] >= FAILURE_THRESHOLD):
+            if _breaker["opened_at"] is None:
+                stats["trips"] += 1
+                logging.warning("Elasticsearch failed %d times in a row, opening circuit breaker", _breaker["failures"])
+            _breaker.update(opened_at=time.monotonic(), trial=False)
+
+
+def retry_after():
+    with _lock:
+        opened_at = _breaker["opened_at"]
+    if opened_at is None:
+        return RETRY_AFTER
+    return max(RETRY_AFTER, int(COOL_DOWN - (time.monotonic() - opened_at)) + 1)
+
+
+def _remember(key, value):
+    with _lock:
+        _last_good[key] = (time.time(), value)
+        _last_good.move_to_end(key)
+        while len(_last_good) > LAST_GOOD_MAX_ENTRIES:
+            _last_good.popitem(last=False)
+
+
+def _fall_back(key, error):
+    with _lock:
+        entry = _last_good.get(key)
+    if entry is None:
+        stats["unavailable"] += 1
+        raise Unavailable(str(error) or type(error).__name__) from error
+
+    stored_at, value = entry
+    stats["stale_served"] += 1
+    logging.warning("Serving stale result for %s: %s", key, error)
+    if has_app_context():
+        # picked up by responses.json_response
+        g.stale_since = min(g.get("stale_since", stored_at), stored_at)
+    return value
+
+
+def call(key, compute):
+    """
+    Returns compute()'s result, remembering it under key. If Elasticsearch is degraded (or the
+    breaker is open) the last good result for key is returned instead, and Unavailable raised
+    if there is none. Other exceptions propagate unchanged.
+    """
+    if not allow_request():
+        return _fall_back(key, CircuitOpen("circuit breaker open"))
+
+    try:
+        value = compute()
+    except Exception as e:
+        if not is_degraded(e):
+            raise
+        return _fall_back(key, e)
+    finally:
+        # a trial call that never reached Elasticsearch (e.g. a cache hit) proves nothing,
+        # let the next request try again
+        with _lock:
+            _breaker["trial"] = False
+
+    if not (isinstance(value, dict) and "error" in value):
+        _remember(key, value)
+    return value
+
+
+def unavailable_response(error):
+    return Response(
+        f"Error: Elasticsearch is unavailable ({error}), retry shortly", status=503,
+        headers={"Retry-After": str(retry_after())}
+    )
+
+
+def reset():
+    with _lock:
+        _last_good.clear()
+        _breaker.update(failures=0, opened_at=None, trial=False)
+
+
+def serves_unavailable(handler):
+    """
+    Decorator for handlers turning Unavailable into a 503 response with Retry-After
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        except Unavailable as e:
+            return unavailable_response(e)
+    return wrapper
@@ -0,0 +1,120 @@
+import gzip
+import json
+import time
+import hashlib
+import timing
+from flask import request, g, Response
+
+try:
+    import orjson
+except ImportError:  # falls back to the standard library encoder when running locally
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON responses for the API handlers: serialised with orjson, compressed with
+# brotli or gzip depending on the client's Accept-Encoding, and tagged with an
+# ETag so a client repeating a request gets 304 Not Modified instead of the body.
+# Results served from the last good copy while Elasticsearch is degraded (see
+# resilience.py) are marked with X-Stale and Age headers.
+#
+# Keep in sync with the copies in traffic-api/ and sudo-api/.
+
+# bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+# brotli's higher qualities cost far more CPU than they save in bytes for JSON this size
+BROTLI_QUALITY = 5
+
+
+def dumps(value):
+    """
+    Serialises value to JSON bytes
+    """
+    if orjson is not None:
+        # json.dumps turns integer keys into strings, keep doing the same
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value).encode("utf-8")
+
+
+def make_etag(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def choose_encoding(accept_encoding):
+    """
+    Picks "br", "gzip" or None from an Accept-Encoding header, honouring q=0
+    """
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+
+    def allowed(coding):
+        return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _mark_stale(response):
+    stale_since = g.get("stale_since")
+    if stale_since is not None:
+        response.headers["X-Stale"] = "true"
+        response.headers["Age"] = str(max(0, int(time.time() - stale_since)))
+    return response
+
+
+def json_response(value, status=200):
+    """
+    Response for a handler result. The ETag is computed from the uncompressed body and is
+    weak, so the gzip and brotli representations of the same result share it.
+    """
+    with timing.stage("serialization"):
+        return _json_response(value, status)
+
+
+def _json_response(value, status):
+    body = dumps(value)
+    etag = make_etag(body)
+
+    if status == 200 and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.vary.add("Accept-Encoding")
+        return _mark_stale(response)
+
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            body = compress(body, encoding)
+
+    response = Response(body, status=status, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return _mark_stale(response)
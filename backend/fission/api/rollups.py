@@ -0,0 +1,288 @@
+import os
+import time
+import datetime
+import elasticsearch
+
+# Reads the hourly and daily summaries maintained by the rollup function
+# (backend/fission/rollup/rollup.py). A window is answered from the coarsest
+# rollup that covers it exactly, with raw observations only used for the
+# partial hours at its edges and for anything newer than the rollup checkpoint.
+#
+# Keep SOURCES in sync with rollup/rollup.py.
+
+SOURCES = {
+    "new_weather_data": {
+        "time_field": "local_date_time_full",
+        "time_zone": None,
+        "group_fields": {"wmo": "wmo"},
+        "metric_fields": ["air_temp", "wind_spd_kmh"],
+    },
+    "air_quality_data": {
+        "time_field": "since",
+        "time_zone": "Australia/Melbourne",
+        "group_fields": {"site_id": "site_id.keyword"},
+        "metric_fields": ["averageValue"],
+    },
+    "traffic-data": {
+        "time_field": "publishedTime",
+        "time_zone": None,
+        "group_fields": {"freewayName": "freewayName.keyword", "segmentName": "segmentName.keyword"},
+        "metric_fields": ["congestionIndex", "actualTravelTime", "averageSpeed"],
+    },
+}
+
+ENABLED = os.environ.get("API_USE_ROLLUPS", "1") == "1"
+CHECKPOINT_INDEX = "rollup_checkpoints"
+CHECKPOINT_CHECK_INTERVAL = float(os.environ.get("API_ROLLUP_CHECKPOINT_INTERVAL", 60))
+BUCKET_FORMAT = "yyyy-MM-dd HH:mm:ss"
+PY_BUCKET_FORMAT = "%Y-%m-%d %H:%M:%S"
+MAX_GROUPS = 1000
+
+_checkpoints = {}
+
+
+class SearchError(Exception):
+    """
+    One search of a multi-search failed. status is its HTTP status.
+    """
+
+    def __init__(self, item):
+        error = item.get("error") or {}
+        self.status = item.get("status")
+        super().__init__(f"{error.get('type', 'search error')}: {error.get('reason', '')}".rstrip(": "))
+
+
+def rollup_index(source, interval):
+    return f"{source}-rollup-{interval}"
+
+
+def get_checkpoint(es, source):
+    """
+    End (exclusive, local time) of the hours that have been rolled up for source, or None
+    """
+    now = time.monotonic()
+    cached = _checkpoints.get(source)
+    if cached is not None and now - cached[0] < CHECKPOINT_CHECK_INTERVAL:
+        return cached[1]
+
+    try:
+        checkpoint = es.get(index=CHECKPOINT_INDEX, id=source)["_source"]["rolled_up_to"]
+        checkpoint = datetime.datetime.strptime(checkpoint, PY_BUCKET_FORMAT)
+    except elasticsearch.NotFoundError:
+        checkpoint = None
+
+    _checkpoints[source] = (now, checkpoint)
+    return checkpoint
+
+
+def _floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _floor_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(dt):
+    floored = _floor_hour(dt)
+    return dt if floored == dt else floored + datetime.timedelta(hours=1)
+
+
+def _ceil_day(dt):
+    floored = _floor_day(dt)
+    return dt if floored == dt else floored + datetime.timedelta(days=1)
+
+
+def plan(start, end, checkpoint):
+    """
+    Splits the window [start, end) into (kind, start, end) pieces where kind is "day", "hour" or "raw".
+    start and end may be None for an unbounded window. Only whole hours/days before the checkpoint
+    are read from rollups.
+    """
+    if checkpoint is None:
+        return [("raw", start, end)]
+
+    covered_end = checkpoint if end is None else min(end, checkpoint)
+    first_hour = None if start is None else _ceil_hour(start)
+    last_hour = _floor_hour(covered_end)
+    if first_hour is not None and first_hour >= last_hour:
+        return [("raw", start, end)]
+
+    first_day = None if first_hour is None else _ceil_day(first_hour)
+    last_day = _floor_day(last_hour)
+
+    pieces = []
+    if start is not None and start < first_hour:
+        pieces.append(("raw", start, first_hour))
+    if first_day is None or first_day < last_day:
+        if first_day is not None and first_hour < first_day:
+            pieces.append(("hour", first_hour, first_day))
+        pieces.append(("day", first_day, last_day))
+        if last_day < last_hour:
+            pieces.append(("hour", last_day, last_hour))
+    else:
+        pieces.append(("hour", first_hour, last_hour))
+    if end is None or last_hour < end:
+        pieces.append(("raw", last_hour, end))
+
+    return pieces
+
+
+def _range(field, start, end, time_zone=None):
+    bounds = {"format": BUCKET_FORMAT}
+    if start is not None:
+        bounds["gte"] = start.strftime(PY_BUCKET_FORMAT)
+    if end is not None:
+        bounds["lt"] = end.strftime(PY_BUCKET_FORMAT)
+    if time_zone:
+        bounds["time_zone"] = time_zone
+    return {"range": {field: bounds}}
+
+
+def _filter(field, value, as_str=False):
+    if isinstance(value, (list, tuple, set)):
+        return {"terms": {field: [str(v) if as_str else v for v in value]}}
+    return {"term": {field: str(value) if as_str else value}}
+
+
+def _piece_search(source, kind, start, end, filters, group_by):
+    settings = SOURCES[source]
+
+    if kind == "raw":
+        index = source
+        fields = settings["group_fields"]
+        conditions = [_filter(fields[name], value) for name, value in filters.items()]
+        if start is not None or end is not None:
+            conditions.append(_range(settings["time_field"], start, end, settings["time_zone"]))
+        metrics = {field: {"stats": {"field": field}} for field in settings["metric_fields"]}
+    else:
+        index = rollup_index(source, kind)
+        fields = {name: name for name in settings["group_fields"]}
+        # rollup group fields are all keywords
+        conditions = [_filter(name, value, as_str=True) for name, value in filters.items()]
+        if start is not None or end is not None:
+            conditions.append(_range("bucket", start, end))
+        metrics = {}
+        for field in settings["metric_fields"]:
+            metrics[f"{field}_count"] = {"sum": {"field": f"{field}_count"}}
+            metrics[f"{field}_sum"] = {"sum": {"field": f"{field}_sum"}}
+            metrics[f"{field}_min"] = {"min": {"field": f"{field}_min"}}
+            metrics[f"{field}_max"] = {"max": {"field": f"{field}_max"}}
+
+    aggs = metrics
+    if isinstance(group_by, (list, tuple)):
+        aggs = {"groups": {"multi_terms": {"terms": [{"field": fields[name]} for name in group_by], "size": MAX_GROUPS},
+                           "aggs": metrics}}
+    elif group_by:
+        aggs = {"groups": {"terms": {"field": fields[group_by], "size": MAX_GROUPS}, "aggs": metrics}}
+
+    body = {"size": 0, "query": {"bool": {"filter": conditions}}, "aggs": aggs}
+    return {"index": index}, body
+
+
+def _piece_stats(source, kind, aggs):
+    stats = {}
+    for field in SOURCES[source]["metric_fields"]:
+        if kind == "raw":
+            raw = aggs[field]
+            stats[field] = {"count": raw["count"], "sum": raw["sum"], "min": raw["min"], "max": raw["max"]}
+        else:
+            stats[field] = {
+                "count": int(aggs[f"{field}_count"]["value"] or 0),
+                "sum": aggs[f"{field}_sum"]["value"] or 0,
+                "min": aggs[f"{field}_min"]["value"],
+                "max": aggs[f"{field}_max"]["value"],
+            }
+    return stats
+
+
+def _merge(total, stats):
+    for field, s in stats.items():
+        t = total.setdefault(field, {"count": 0, "sum": 0, "min": None, "max": None})
+        t["count"] += s["count"]
+        t["sum"] += s["sum"] or 0
+        if s["min"] is not None:
+            t["min"] = s["min"] if t["min"] is None else min(t["min"], s["min"])
+        if s["max"] is not None:
+            t["max"] = s["max"] if t["max"] is None else max(t["max"], s["max"])
+
+
+def summary_searches(es, source, filters, start=None, end=None, group_by=None):
+    """
+    The pieces of summarise's window and their multi-search (header, body) lines, for callers
+    that send further searches along with them. Read the responses with summary_groups.
+    """
+    checkpoint = get_checkpoint(es, source) if ENABLED else None
+    pieces = plan(start, end, checkpoint)
+
+    searches = []
+    for kind, piece_start, piece_end in pieces:
+        header, body = _piece_search(source, kind, piece_start, piece_end, filters, group_by)
+        searches.extend([header, body])
+    return pieces, searches
+
+
+def summary_groups(es, source, filters, pieces, responses, group_by=None):
+    """
+    summarise's result from the responses to summary_searches' searches
+    """
+    pieces, responses = list(pieces), list(responses)
+
+    # a rollup that can't be read (e.g. an index the rollup function hasn't created yet)
+    # is replaced by the raw observations of its window
+    failed = [i for i, res in enumerate(responses) if "error" in res and pieces[i][0] != "raw"]
+    if failed:
+        searches = []
+        for i in failed:
+            _, piece_start, piece_end = pieces[i]
+            pieces[i] = ("raw", piece_start, piece_end)
+            searches.extend(_piece_search(source, "raw", piece_start, piece_end, filters, group_by))
+        for i, res in zip(failed, es.msearch(searches=searches)["responses"]):
+            responses[i] = res
+
+    groups = {}
+    for (kind, _, _), res in zip(pieces, responses):
+        if "error" in res:
+            raise SearchError(res)
+        aggs = res["aggregations"]
+        if group_by:
+            for bucket in aggs["groups"]["buckets"]:
+                key = tuple(map(str, bucket["key"])) if isinstance(group_by, (list, tuple)) else str(bucket["key"])
+                _merge(groups.setdefault(key, {}), _piece_stats(source, kind, bucket))
+        else:
+            _merge(groups.setdefault(None, {}), _piece_stats(source, kind, aggs))
+
+    return groups
+
+
+def summarise(es, source, filters, start=None, end=None, group_by=None):
+    """
+    count/sum/min/max of every metric field of source for observations matching filters in the
+    local window [start, end), using rollups where possible. filters maps group field names
+    (e.g. "wmo") to a value or list of values.
+
+    Returns {group: {field: stats}}, keyed by the group_by value as a string, or by None if
+    group_by isn't given. group_by may also be a tuple of group fields, whose groups are keyed
+    by tuples of their values as strings.
+    """
+    pieces, searches = summary_searches(es, source, filters, start, end, group_by)
+    responses = es.msearch(searches=searches)["responses"]
+    return summary_groups(es, source, filters, pieces, responses, group_by)
+
+
+def metric_values(aggs, stats):
+    """
+    Evaluates avg/min/max aggregation definitions like {"avg_pm25": {"avg": {"field": "averageValue"}}}
+    against summarised stats, giving the same values Elasticsearch would have returned
+    """
+    values = {}
+    for name, agg in aggs.items():
+        kind, body = next(iter(agg.items()))
+        field_stats = (stats or {}).get(body["field"])
+        if not field_stats or not field_stats["count"]:
+            values[name] = None
+        elif kind == "avg":
+            values[name] = field_stats["sum"] / field_stats["count"]
+        else:
+            values[name] = field_stats[kind]
+    return values
@@ -0,0 +1,76 @@
+import time
+import threading
+import unittest
+from unittest.mock import patch
+
+import admission
+
+
+class TestAdmission(unittest.TestCase):
+    def test_single_flight_coalesces_concurrent_calls(self):
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(1)
+            return {"stations": []}
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(admission.single_flight(("stations",), compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"stations": []}] * 5)
+        self.assertEqual(admission._in_flight, {})
+
+    def test_single_flight_shares_errors(self):
+        def compute():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            admission.single_flight(("stations",), compute)
+        # the failure isn't remembered once the call is over
+        self.assertEqual(admission.single_flight(("stations",), lambda: 1), 1)
+
+    def test_sheds_load_when_queue_is_full(self):
+        with patch.object(admission, "_slots", threading.BoundedSemaphore(1)), \
+                patch.object(admission, "MAX_QUEUED", 0):
+            admission._slots.acquire()
+            try:
+                with self.assertRaises(admission.Overloaded):
+                    admission.admitted(lambda: None)
+            finally:
+                admission._slots.release()
+            self.assertEqual(admission.admitted(lambda: "ok"), "ok")
+
+    def test_queued_request_times_out(self):
+        with patch.object(admission, "_slots", threading.BoundedSemaphore(1)), \
+                patch.object(admission, "QUEUE_TIMEOUT", 0.05):
+            admission._slots.acquire()
+            try:
+                with self.assertRaises(admission.Overloaded):
+                    admission.admitted(lambda: None)
+            finally:
+                admission._slots.release()
+
+    def test_overloaded_handler_returns_503(self):
+        @admission.sheds_load
+        def handler():
+            raise admission.Overloaded()
+
+        response = handler()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], str(admission.RETRY_AFTER))
+
+
+if __name__ == "__main__":
+    unittest.main()
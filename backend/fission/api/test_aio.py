@@ -0,0 +1,71 @@
+import time
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import aio
+import resilience
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self.indices = self
+
+    async def search(self, index=None, body=None):
+        await asyncio.sleep(0.2)
+        return {"index": index, "hits": {"hits": []}}
+
+    async def get_mapping(self, index=None):
+        return {index: {"mappings": {}}}
+
+    async def create(self, index=None, mappings=None):
+        return {"acknowledged": True, "index": index}
+
+    def options(self, **options):
+        return self
+
+
+class TestAio(unittest.TestCase):
+    def setUp(self):
+        client = FakeAsyncClient()
+
+        async def get_client():
+            return client
+
+        patcher = patch.object(aio, "get_client", get_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_blocking_client_awaits_on_loop(self):
+        es = aio.BlockingClient()
+        self.assertEqual(es.search(index="new_weather_data", body={})["index"], "new_weather_data")
+        self.assertEqual(es.indices.get_mapping(index="air_quality_data"), {"air_quality_data": {"mappings": {}}})
+
+    def test_namespaces_behind_deadline_client(self):
+        es = resilience.with_deadline(aio.BlockingClient(), 5)
+        self.assertEqual(es.indices.create(index="api_cache", mappings={})["index"], "api_cache")
+
+    def test_fan_out_runs_concurrently(self):
+        es = aio.BlockingClient()
+        started = time.monotonic()
+        res = aio.fan_out({
+            "weather": lambda: es.search(index="new_weather_data"),
+            "air_quality": lambda: es.search(index="air_quality_data"),
+        })
+        elapsed = time.monotonic() - started
+
+        self.assertEqual(res["weather"]["index"], "new_weather_data")
+        self.assertEqual(res["air_quality"]["index"], "air_quality_data")
+        # two 0.2s queries in parallel, not one after the other
+        self.assertLess(elapsed, 0.35)
+
+    def test_fan_out_reraises(self):
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            aio.fan_out({"weather": fail})
+
+
+if __name__ == "__main__":
+    unittest.main()
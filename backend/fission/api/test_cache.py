@@ -0,0 +1,85 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+import elasticsearch
+import cache
+
+
+def watermark_es(updated_at):
+    es = MagicMock()
+    es.get.return_value = {"_source": {"index": "new_weather_data", "updated_at": updated_at}}
+    return es
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = patch.object(cache, "WATERMARK_CHECK_INTERVAL", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_window_key_normalises_parameters(self):
+        window, end = cache.window_key("2024", "05", None, "")
+        self.assertEqual(window, (datetime.datetime(2024, 5, 1), datetime.datetime(2024, 6, 1)))
+        self.assertEqual(end, datetime.datetime(2024, 6, 1))
+
+        # the same period given as bounds shares the entry
+        self.assertEqual(cache.window_key(start="2024-05-01", end="2024-06-01")[0], window)
+
+    def test_closed_window_ignores_watermark(self):
+        es = watermark_es("2024-05-01T00:00:00")
+        compute = MagicMock(return_value={"avg_temperature": 12.0})
+        end = datetime.datetime(2020, 1, 31, 23, 59, 59)
+
+        cache.cached(es, "new_weather_data", ["observations", "94839"], end, compute)
+        es.get.return_value = {"_source": {"updated_at": "2024-06-01T00:00:00"}}
+        res = cache.cached(es, "new_weather_data", ["observations", "94839"], end, compute)
+
+        self.assertEqual(res, {"avg_temperature": 12.0})
+        compute.assert_called_once()
+        es.get.assert_not_called()
+
+    def test_open_window_invalidated_by_watermark(self):
+        es = watermark_es("2024-05-01T00:00:00")
+        compute = MagicMock(return_value={"stations": []})
+
+        cache.cached(es, "new_weather_data", ["stations"], None, compute)
+        cache.cached(es, "new_weather_data", ["stations"], None, compute)
+        self.assertEqual(compute.call_count, 1)
+
+        es.get.return_value = {"_source": {"updated_at": "2024-05-01T00:10:00"}}
+        cache.cached(es, "new_weather_data", ["stations"], None, compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_missing_watermark_index(self):
+        es = MagicMock()
+        es.get.side_effect = elasticsearch.NotFoundError("not found", MagicMock(), {})
+        compute = MagicMock(return_value={"stations": []})
+
+        cache.cached(es, "air_quality_data", ["stations"], None, compute)
+        cache.cached(es, "air_quality_data", ["stations"], None, compute)
+        self.assertEqual(compute.call_count, 1)
+
+    def test_errors_are_not_cached(self):
+        es = watermark_es(None)
+        compute = MagicMock(return_value={"error": "year must be an integer"})
+
+        cache.cached(es, "new_weather_data", ["observations", "1"], None, compute)
+        cache.cached(es, "new_weather_data", ["observations", "1"], None, compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_lru_eviction(self):
+        es = watermark_es(None)
+        end = datetime.datetime(2020, 1, 1)
+        with patch.object(cache, "MAX_ENTRIES", 2):
+            for station in ("1", "2", "3"):
+                cache.cached(es, "new_weather_data", [station], end, lambda: {"station": station})
+
+        compute = MagicMock(return_value={"station": "1"})
+        cache.cached(es, "new_weather_data", ["1"], end, compute)
+        compute.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
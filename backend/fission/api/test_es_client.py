@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+import es_client
+
+
+class TestEsClient(unittest.TestCase):
+    def setUp(self):
+        self.config_dir = tempfile.TemporaryDirectory()
+        for k, v in (("ES_USERNAME", "elastic"), ("ES_PASSWORD", "secret")):
+            with open(os.path.join(self.config_dir.name, k), "w") as f:
+                f.write(v + "\n")
+
+        patcher = patch.multiple(es_client, CONFIG_DIR=self.config_dir.name, CONFIG_CHECK_INTERVAL=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.config_dir.cleanup)
+        self.addCleanup(es_client.reset)
+        es_client.reset()
+        es_client._config_cache.clear()
+
+    @patch("es_client.elasticsearch.Elasticsearch")
+    def test_client_is_reused(self, mock_es):
+        first = es_client.get_client()
+        second = es_client.get_client()
+
+        self.assertIs(first, second)
+        self.assertEqual(mock_es.call_count, 1)
+        self.assertEqual(mock_es.call_args.kwargs["http_auth"], ("elastic", "secret"))
+
+    @patch("es_client.elasticsearch.Elasticsearch")
+    def test_reconnects_when_credentials_change(self, mock_es):
+        mock_es.side_effect = lambda *args, **kwargs: MagicMock()
+        first = es_client.get_client()
+
+        path = os.path.join(self.config_dir.name, "ES_PASSWORD")
+        with open(path, "w") as f:
+            f.write("rotated-secret\n")
+        os.utime(path, ns=(0, 0))
+
+        second = es_client.get_client()
+
+        self.assertIsNot(first, second)
+        first.close.assert_called_once()
+        self.assertEqual(mock_es.call_args.kwargs["http_auth"], ("elastic", "rotated-secret"))
+
+
+if __name__ == "__main__":
+    unittest.main()
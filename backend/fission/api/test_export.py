@@ -0,0 +1,111 @@
+import io
+import json
+import unittest
+from unittest.mock import MagicMock
+
+import export
+
+
+def paged_es(pages):
+    es = MagicMock()
+    es.open_point_in_time.return_value = {"id": "pit-1"}
+    responses = []
+    for i, page in enumerate(pages):
+        hits = [{"_source": doc, "sort": [i, j]} for j, doc in enumerate(page)]
+        responses.append({"pit_id": f"pit-{i + 2}", "hits": {"hits": hits}})
+    responses.append({"hits": {"hits": []}})
+    es.search.side_effect = responses
+    return es
+
+
+class TestExport(unittest.TestCase):
+    def test_ndjson_pages_with_search_after(self):
+        es = paged_es([[{"wmo": 1}, {"wmo": 2}], [{"wmo": 3}]])
+
+        error, chunks = export.export(es, "weather", "ndjson", stations=["1"], fields=["wmo"], page_size="2", year="2024")
+        lines = b"".join(chunks).decode().splitlines()
+
+        self.assertIsNone(error)
+        self.assertEqual([json.loads(line) for line in lines], [{"wmo": 1}, {"wmo": 2}, {"wmo": 3}])
+
+        first, second = [c.kwargs["body"] for c in es.search.call_args_list]
+        self.assertEqual(first["_source"], ["wmo"])
+        self.assertNotIn("search_after", first)
+        self.assertEqual(second["search_after"], [0, 1])
+        self.assertEqual(second["pit"]["id"], "pit-2")
+        self.assertEqual(first["query"]["bool"]["filter"][0], {"terms": {"wmo": ["1"]}})
+        es.close_point_in_time.assert_called_once_with(id="pit-3")
+
+    def test_daily_traffic_as_observations(self):
+        day = {"segmentId": "101", "freewayName": "Monash Fwy", "segmentName": "A", "date": "2024-05-01",
+               "times": ["2024-05-01T07:00:00", "2024-05-01T09:00:00"], "congestionIndex": [3.0, 1.5],
+               "actualTravelTime": [300, 150], "averageSpeed": [40, 80], "count": 2}
+        es = paged_es([[day]])
+        es.indices.get_mapping.return_value = {"traffic-daily": {"mappings": {"_meta": {"harvested": True}}}}
+
+        error, chunks = export.export(es, "traffic", stations=["Monash Fwy"], fields=["publishedTime", "congestionIndex"],
+                                      start="2024-05-01T08:00")
+        lines = b"".join(chunks).decode().splitlines()
+
+        self.assertIsNone(error)
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{"publishedTime": "2024-05-01T09:00:00", "congestionIndex": 1.5}])
+        self.assertEqual(es.open_point_in_time.call_args.kwargs["index"], "traffic-daily")
+        body = es.search.call_args_list[0].kwargs["body"]
+        self.assertNotIn("_source", body)
+        self.assertEqual(body["query"]["bool"]["filter"][0], {"terms": {"freewayName": ["Monash Fwy"]}})
+
+    def test_rejects_unknown_dataset(self):
+        error, chunks = export.export(MagicMock(), "rainfall")
+        self.assertIn("dataset must be one of", error)
+        self.assertIsNone(chunks)
+
+    @unittest.skipIf(export.pa is None, "pyarrow not installed")
+    def test_arrow_stream(self):
+        es = paged_es([[{"site_id": "a", "averageValue": 1}], [{"site_id": "b", "averageValue": 2.5}]])
+        es.indices.get_mapping.return_value = {"air_quality_data": {"mappings": {"properties": {
+            "averageValue": {"type": "float"},
+            "site_id": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+        }}}}
+
+        error, chunks = export.export(es, "air-quality", "arrow", page_size="1")
+        table = export.pa.ipc.open_stream(io.BytesIO(b"".join(chunks))).read_all()
+
+        self.assertIsNone(error)
+        self.assertEqual(table.column("site_id").to_pylist(), ["a", "b"])
+        # typed from the mapping, so the whole number in the first page doesn't truncate later ones
+        self.assertEqual(table.column("averageValue").to_pylist(), [1.0, 2.5])
+
+    @unittest.skipIf(export.pa is None, "pyarrow not installed")
+    def test_arrow_numbers_stored_as_strings(self):
+        # the BOM harvester stores precise_lat/precise_lon as strings, the mapping has floats
+        es = paged_es([[{"wmo": 94866, "precise_lat": "-36.2847"}], [{"wmo": 94868, "precise_lat": "not known"}]])
+        es.indices.get_mapping.return_value = {"new_weather_data": {"mappings": {"properties": {
+            "wmo": {"type": "long"},
+            "precise_lat": {"type": "float"},
+        }}}}
+
+        error, chunks = export.export(es, "weather", "arrow", page_size="1")
+        table = export.pa.ipc.open_stream(io.BytesIO(b"".join(chunks))).read_all()
+
+        self.assertIsNone(error)
+        self.assertEqual(table.schema.field("precise_lat").type, export.pa.float64())
+        self.assertEqual(table.column("precise_lat").to_pylist(), [-36.2847, None])
+
+    @unittest.skipIf(export.pa is None, "pyarrow not installed")
+    def test_arrow_column_null_on_first_page(self):
+        es = paged_es([[{"site_id": "a", "note": None}], [{"site_id": "b", "note": "calibrating"}],
+                       [{"site_id": "c", "note": 3}]])
+        es.indices.get_mapping.return_value = {"air_quality_data": {"mappings": {"properties": {
+            "site_id": {"type": "keyword"},
+        }}}}
+
+        error, chunks = export.export(es, "air-quality", "arrow", page_size="1")
+        table = export.pa.ipc.open_stream(io.BytesIO(b"".join(chunks))).read_all()
+
+        self.assertEqual(table.schema.field("note").type, export.pa.string())
+        self.assertEqual(table.column("note").to_pylist(), [None, "calibrating", "3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
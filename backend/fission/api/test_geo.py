@@ -0,0 +1,33 @@
+import unittest
+
+import geo
+
+
+class TestGeo(unittest.TestCase):
+    def test_bbox(self):
+        area = geo.parse(bbox="144.5,-38.1,145.5,-37.5")
+        self.assertEqual(geo.point_filter("location", area), {"geo_bounding_box": {"location": {
+            "top_left": {"lat": -37.5, "lon": 144.5}, "bottom_right": {"lat": -38.1, "lon": 145.5},
+        }}})
+        shape = geo.shape_filter("geometry", area)["geo_shape"]["geometry"]
+        self.assertEqual(shape["shape"]["coordinates"], [[144.5, -37.5], [145.5, -38.1]])
+
+    def test_near(self):
+        self.assertEqual(geo.parse(near="-37.8,144.96", radius="500m")["radius_km"], 0.5)
+        self.assertEqual(geo.parse(near="-37.8,144.96")["radius_km"], 5)
+        self.assertEqual(geo.parse(near="-37.8,144.96", radius="250")["radius_km"], 0.25)
+
+    def test_no_area(self):
+        self.assertIsNone(geo.parse())
+
+    def test_rejects_invalid_areas(self):
+        for args in ({"bbox": "144.5,-38.1,145.5"}, {"bbox": "145.5,-38.1,144.5,-37.5"}, {"bbox": "a,b,c,d"},
+                     {"near": "-95,144"}, {"near": "-37.8,144.96", "radius": "5 miles"},
+                     {"near": "-37.8,144.96", "radius": "5000km"}, {"radius": "5km"},
+                     {"bbox": "144.5,-38.1,145.5,-37.5", "near": "-37.8,144.96"}):
+            with self.assertRaises(ValueError):
+                geo.parse(**args)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import MagicMock
+
+import grid
+
+
+def cell(key, count, avg, high):
+    return {"key": key, "doc_count": count, "avg": {"value": avg}, "max": {"value": high},
+            "centroid": {"location": {"lat": -37.81, "lon": 144.96}, "count": count}}
+
+
+class TestGrid(unittest.TestCase):
+    def test_geotile_cells(self):
+        es = MagicMock()
+        es.search.return_value.body = {"aggregations": {"cells": {"buckets": [
+            cell("13/7395/5027", 12, 18.1234, 21.5), cell("13/7396/5027", 3, 17.0, 17.0),
+        ]}}}
+
+        res = grid.get_grid(es, "weather", zoom="10", bbox="144.5,-38.1,145.5,-37.5", last="24h")
+
+        query = es.search.call_args.kwargs["body"]
+        self.assertEqual(es.search.call_args.kwargs["index"], "new_weather_data")
+        cells = query["aggs"]["cells"]["geotile_grid"]
+        self.assertEqual(cells["precision"], 13)
+        self.assertEqual(cells["size"], grid.MAX_CELLS)
+        self.assertEqual(cells["bounds"]["top_left"], {"lat": -37.5, "lon": 144.5})
+        self.assertEqual(query["aggs"]["cells"]["aggs"]["avg"], {"avg": {"field": "air_temp"}})
+        self.assertIn("geo_bounding_box", query["query"]["bool"]["filter"][1])
+
+        self.assertEqual(res["keys"], ["13/7395/5027", "13/7396/5027"])
+        self.assertEqual(res["counts"], [12, 3])
+        self.assertEqual(res["avg"], [18.123, 17.0])
+        self.assertEqual(res["lat"], [-37.81, -37.81])
+
+    def test_geohash_precision_follows_zoom(self):
+        self.assertEqual(grid.precision("geohash", 0), 2)
+        self.assertLess(grid.precision("geohash", 8), grid.precision("geohash", 16))
+        self.assertEqual(grid.precision("geohash", 20), 10)
+        self.assertEqual(grid.precision("geotile", 20), 23)
+
+    def test_time_zone_of_source(self):
+        es = MagicMock()
+        es.search.return_value.body = {"aggregations": {"cells": {"buckets": []}}}
+
+        grid.get_grid(es, "air_quality", grid="geohash", year="2024", month="5")
+
+        query = es.search.call_args.kwargs["body"]
+        self.assertEqual(query["query"]["bool"]["filter"][0]["range"]["since"]["time_zone"], "Australia/Melbourne")
+        self.assertIn("geohash_grid", query["aggs"]["cells"])
+
+    def test_arrays_limited_to_the_window(self):
+        es = MagicMock()
+        es.search.return_value.body = {"aggregations": {"cells": {"buckets": [
+            dict(cell("13/7395/5027", 2, 1.25, 2.0), count={"value": 96}),
+        ]}}}
+        window_fields = MagicMock(return_value={"congestionIndex": {"type": "double"}})
+
+        res = grid.get_grid(es, "traffic_daily", start="2024-05-01T08:00", end="2024-05-01T09:00",
+                            window_fields=window_fields)
+
+        query = es.search.call_args.kwargs["body"]
+        self.assertEqual(es.search.call_args.kwargs["index"], "traffic-daily")
+        self.assertEqual(query["runtime_mappings"], {"congestionIndex": {"type": "double"}})
+        self.assertEqual(window_fields.call_args.args[0].hour, 8)
+        self.assertIn("times", query["query"]["bool"]["filter"][0]["range"])
+        # observations are counted, not the documents holding them
+        self.assertEqual(res["counts"], [96])
+
+    def test_rejects_invalid_arguments(self):
+        self.assertIn("error", grid.get_grid(MagicMock(), "weather", metric="pm25"))
+        self.assertIn("error", grid.get_grid(MagicMock(), "weather", grid="hexagon"))
+        self.assertIn("error", grid.get_grid(MagicMock(), "weather", zoom="25"))
+
+
+if __name__ == "__main__":
+    unittest.main()
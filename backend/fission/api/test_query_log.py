@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from flask import Flask
+
+import query_log
+import resilience
+
+app = Flask(__name__)
+
+PROFILE = {
+    "shards": [{
+        "id": "[node][new_weather_data][0]",
+        "searches": [{
+            "query": [{
+                "type": "BooleanQuery",
+                "description": "+stn_name:melbourne",
+                "time_in_nanos": 2500000,
+                "children": [{"type": "TermQuery", "description": "stn_name:melbourne", "time_in_nanos": 1000000}],
+            }],
+            "rewrite_time": 50000,
+            "collector": [{"name": "QueryPhaseCollector", "reason": "search_query_phase", "time_in_nanos": 300000}],
+        }],
+        "aggregations": [{"type": "MaxAggregator", "description": "max_temp", "time_in_nanos": 4000000}],
+    }]
+}
+
+
+class TestQueryLog(unittest.TestCase):
+    def setUp(self):
+        resilience.reset()
+
+    def test_condense(self):
+        shard = query_log.condense(PROFILE)[0]
+
+        self.assertEqual(shard["shard"], "[node][new_weather_data][0]")
+        self.assertEqual(shard["query"][0]["ms"], 2.5)
+        self.assertEqual(shard["query"][0]["children"][0]["type"], "TermQuery")
+        self.assertEqual(shard["rewrite_ms"], 0.05)
+        self.assertEqual(shard["collectors"], [{"name": "QueryPhaseCollector", "reason": "search_query_phase", "ms": 0.3}])
+        self.assertEqual(shard["aggregations"][0]["ms"], 4.0)
+
+    def test_profile_requested(self):
+        es = MagicMock()
+        es.options.return_value.search.return_value = {"timed_out": False, "took": 3, "profile": PROFILE}
+
+        with app.test_request_context("/?profile=true"), patch.object(query_log, "PROFILE_ENABLED", True):
+            resilience.with_deadline(es, 5).search(index="new_weather_data", body={"size": 0})
+            profiles = query_log.collected()
+
+        body = es.options.return_value.search.call_args.kwargs["body"]
+        self.assertIs(body["profile"], True)
+        self.assertEqual(profiles[0]["index"], "new_weather_data")
+        self.assertEqual(len(profiles[0]["shards"]), 1)
+
+    def test_not_profiled_by_default(self):
+        es = MagicMock()
+        es.options.return_value.search.return_value = {"timed_out": False, "took": 3}
+
+        with app.test_request_context("/"):
+            resilience.with_deadline(es, 5).search(index="new_weather_data", body={"size": 0})
+
+        self.assertNotIn("profile", es.options.return_value.search.call_args.kwargs["body"])
+
+    def test_profile_ignored_unless_allowed(self):
+        es = MagicMock()
+        es.options.return_value.search.return_value = {"timed_out": False, "took": 3}
+
+        with app.test_request_context("/?profile=true"):
+            resilience.with_deadline(es, 5).search(index="new_weather_data", body={"size": 0})
+
+        self.assertNotIn("profile", es.options.return_value.search.call_args.kwargs["body"])
+
+    def test_slow_query_logged(self):
+        res = {"took": 900, "timed_out": False, "hits": {"total": {"value": 42}}, "_shards": {"total": 1, "successful": 1}}
+
+        with patch.object(query_log, "SLOW_QUERY_MS", 500), self.assertLogs(level="WARNING") as logs:
+            query_log.observe("traffic-data", {"size": 0}, res, 950.0)
+
+        self.assertIn('"hits": 42', logs.output[0])
+        self.assertIn('"took_ms": 900', logs.output[0])
+
+    def test_fast_query_not_logged(self):
+        with patch.object(query_log, "SLOW_QUERY_MS", 500), patch.object(query_log.logging, "warning") as warning:
+            query_log.observe("traffic-data", {"size": 0}, {"took": 5}, 6.0)
+        warning.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
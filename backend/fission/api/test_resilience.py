@@ -0,0 +1,101 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import elasticsearch
+from flask import Flask
+
+import resilience
+import responses
+
+app = Flask(__name__)
+
+
+def connection_error():
+    return elasticsearch.ConnectionError("connection refused")
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+
+    def test_deadline_passed_to_elasticsearch(self):
+        es = MagicMock()
+        es.options.return_value.search.return_value = {"timed_out": False, "hits": {"hits": []}}
+
+        client = resilience.with_deadline(es, 5)
+        client.search(index="new_weather_data", body={"size": 0})
+
+        es.options.assert_called_once_with(request_timeout=5)
+        body = es.options.return_value.search.call_args.kwargs["body"]
+        self.assertEqual(body, {"size": 0, "timeout": "4000ms"})
+
+    def test_timed_out_search_raises(self):
+        es = MagicMock()
+        es.options.return_value.search.return_value = {"timed_out": True}
+        with self.assertRaises(resilience.DeadlineExceeded):
+            resilience.with_deadline(es, 5).search(index="new_weather_data", body={})
+
+    def test_serves_last_good_result_when_degraded(self):
+        self.assertEqual(resilience.call(("stations",), lambda: {"stations": [1]}), {"stations": [1]})
+
+        def fail():
+            raise connection_error()
+
+        with app.test_request_context("/"):
+            res = resilience.call(("stations",), fail)
+            response = responses.json_response(res)
+
+        self.assertEqual(res, {"stations": [1]})
+        self.assertEqual(response.headers["X-Stale"], "true")
+        self.assertIn("Age", response.headers)
+
+    def test_unavailable_without_earlier_result(self):
+        def fail():
+            raise connection_error()
+
+        with self.assertRaises(resilience.Unavailable):
+            resilience.call(("stations",), fail)
+
+    def test_other_errors_propagate(self):
+        def fail():
+            raise KeyError("aggregations")
+
+        with self.assertRaises(KeyError):
+            resilience.call(("stations",), fail)
+
+    def test_breaker_opens_after_repeated_failures(self):
+        es = MagicMock()
+        es.options.return_value.search.side_effect = connection_error()
+        client = resilience.with_deadline(es, 5)
+
+        with patch.object(resilience, "FAILURE_THRESHOLD", 2):
+            for _ in range(2):
+                with self.assertRaises(resilience.Unavailable):
+                    resilience.call(("stations",), lambda: client.search(index="new_weather_data", body={}))
+
+            compute = MagicMock()
+            with self.assertRaises(resilience.Unavailable):
+                resilience.call(("stations",), compute)
+            # fails fast without calling Elasticsearch
+            compute.assert_not_called()
+
+            # after the cool-down a trial request goes through and closes the breaker
+            with patch.object(resilience, "COOL_DOWN", 0):
+                es.options.return_value.search.side_effect = None
+                es.options.return_value.search.return_value = {"timed_out": False}
+                resilience.call(("stations",), lambda: client.search(index="new_weather_data", body={}))
+            self.assertIsNone(resilience._breaker["opened_at"])
+
+    def test_unavailable_handler_returns_503(self):
+        @resilience.serves_unavailable
+        def handler():
+            raise resilience.Unavailable("connection refused")
+
+        response = handler()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import responses
+
+app = Flask(__name__)
+RESULT = {"stations": {str(wmo): {"avg_temperature": 12.5} for wmo in range(94000, 94200)}}
+
+
+class TestResponses(unittest.TestCase):
+    def test_uncompressed_without_accept_encoding(self):
+        with app.test_request_context("/"):
+            response = responses.json_response(RESULT)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(json.loads(response.get_data()), RESULT)
+
+    def test_gzip_when_accepted(self):
+        with patch.object(responses, "brotli", None), \
+                app.test_request_context("/", headers={"Accept-Encoding": "gzip, deflate"}):
+            response = responses.json_response(RESULT)
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertEqual(json.loads(gzip.decompress(response.get_data())), RESULT)
+
+    def test_small_bodies_not_compressed(self):
+        with app.test_request_context("/", headers={"Accept-Encoding": "gzip"}):
+            response = responses.json_response({"error": "month must be an integer"})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_choose_encoding(self):
+        with patch.object(responses, "brotli", object()):
+            self.assertEqual(responses.choose_encoding("gzip, br"), "br")
+            self.assertEqual(responses.choose_encoding("br;q=0, gzip"), "gzip")
+        with patch.object(responses, "brotli", None):
+            self.assertEqual(responses.choose_encoding("br"), None)
+        self.assertEqual(responses.choose_encoding("identity"), None)
+        self.assertEqual(responses.choose_encoding(None), None)
+
+    def test_not_modified_for_matching_etag(self):
+        with app.test_request_context("/"):
+            etag = responses.json_response(RESULT).get_etag()[0]
+
+        with app.test_request_context("/", headers={"If-None-Match": f'W/"{etag}"'}):
+            response = responses.json_response(RESULT)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+
+        changed = dict(RESULT, date_filter={"start": "2024-05-01 00:00:00"})
+        with app.test_request_context("/", headers={"If-None-Match": f'W/"{etag}"'}):
+            response = responses.json_response(changed)
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
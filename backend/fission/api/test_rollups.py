@@ -0,0 +1,118 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+import rollups
+
+dt = datetime.datetime
+
+
+class TestRollups(unittest.TestCase):
+    def test_plan_without_checkpoint_reads_raw(self):
+        self.assertEqual(rollups.plan(dt(2024, 5, 1), dt(2024, 6, 1), None), [("raw", dt(2024, 5, 1), dt(2024, 6, 1))])
+
+    def test_plan_whole_days(self):
+        pieces = rollups.plan(dt(2024, 5, 1), dt(2024, 6, 1), dt(2024, 7, 1, 3))
+        self.assertEqual(pieces, [("day", dt(2024, 5, 1), dt(2024, 6, 1))])
+
+    def test_plan_partial_edges(self):
+        pieces = rollups.plan(dt(2024, 5, 1, 10, 30), dt(2024, 5, 3, 5, 15), dt(2024, 7, 1))
+        self.assertEqual(pieces, [
+            ("raw", dt(2024, 5, 1, 10, 30), dt(2024, 5, 1, 11)),
+            ("hour", dt(2024, 5, 1, 11), dt(2024, 5, 2)),
+            ("day", dt(2024, 5, 2), dt(2024, 5, 3)),
+            ("hour", dt(2024, 5, 3), dt(2024, 5, 3, 5)),
+            ("raw", dt(2024, 5, 3, 5), dt(2024, 5, 3, 5, 15)),
+        ])
+
+    def test_plan_window_past_checkpoint(self):
+        pieces = rollups.plan(dt(2024, 5, 1), dt(2024, 6, 1), dt(2024, 5, 20, 14))
+        self.assertEqual(pieces, [
+            ("day", dt(2024, 5, 1), dt(2024, 5, 20)),
+            ("hour", dt(2024, 5, 20), dt(2024, 5, 20, 14)),
+            ("raw", dt(2024, 5, 20, 14), dt(2024, 6, 1)),
+        ])
+
+    def test_plan_unbounded(self):
+        pieces = rollups.plan(None, None, dt(2024, 5, 20, 14))
+        self.assertEqual(pieces, [
+            ("day", None, dt(2024, 5, 20)),
+            ("hour", dt(2024, 5, 20), dt(2024, 5, 20, 14)),
+            ("raw", dt(2024, 5, 20, 14), None),
+        ])
+
+    def test_summarise_merges_rollups_and_raw(self):
+        es = MagicMock()
+        es.get.return_value = {"_source": {"rolled_up_to": "2024-05-20 14:00:00"}}
+        rollup = {
+            "averageValue_count": {"value": 4.0}, "averageValue_sum": {"value": 20.0},
+            "averageValue_min": {"value": 2.0}, "averageValue_max": {"value": 9.0},
+        }
+        raw = {"averageValue": {"count": 1, "sum": 10.0, "min": 10.0, "max": 10.0}}
+        es.msearch.return_value = {"responses": [
+            {"aggregations": rollup}, {"aggregations": rollup}, {"aggregations": raw},
+        ]}
+
+        with patch.dict(rollups._checkpoints, clear=True):
+            stats = rollups.summarise(es, "air_quality_data", {"site_id": "abc"}, dt(2024, 5, 1), dt(2024, 6, 1))
+
+        searches = es.msearch.call_args.kwargs["searches"]
+        self.assertEqual([s["index"] for s in searches[::2]], [
+            "air_quality_data-rollup-day", "air_quality_data-rollup-hour", "air_quality_data",
+        ])
+        self.assertEqual(searches[5]["query"]["bool"]["filter"][0], {"term": {"site_id.keyword": "abc"}})
+        self.assertEqual(stats[None]["averageValue"], {"count": 9, "sum": 50.0, "min": 2.0, "max": 10.0})
+
+        values = rollups.metric_values({"avg_pm25": {"avg": {"field": "averageValue"}}}, stats[None])
+        self.assertAlmostEqual(values["avg_pm25"], 50.0 / 9)
+
+    def test_summarise_by_several_fields(self):
+        es = MagicMock()
+        es.get.return_value = {"_source": {"rolled_up_to": "2024-05-20 14:00:00"}}
+        stats = {f"{field}_{kind}": {"value": 1.0} for field in rollups.SOURCES["traffic-data"]["metric_fields"]
+                 for kind in ("count", "sum", "min", "max")}
+        es.msearch.return_value = {"responses": [
+            {"aggregations": {"groups": {"buckets": [dict(stats, key=["Monash Fwy", "Segment A"])]}}},
+        ]}
+
+        with patch.dict(rollups._checkpoints, clear=True):
+            res = rollups.summarise(es, "traffic-data", {}, dt(2024, 5, 1), dt(2024, 5, 20),
+                                    group_by=("freewayName", "segmentName"))
+
+        body = es.msearch.call_args.kwargs["searches"][1]
+        self.assertEqual(body["aggs"]["groups"]["multi_terms"]["terms"],
+                         [{"field": "freewayName"}, {"field": "segmentName"}])
+        self.assertEqual(res[("Monash Fwy", "Segment A")]["congestionIndex"]["count"], 1)
+
+    def test_failed_rollup_read_from_raw(self):
+        es = MagicMock()
+        es.get.return_value = {"_source": {"rolled_up_to": "2024-05-20 14:00:00"}}
+        raw = {"averageValue": {"count": 1, "sum": 10.0, "min": 10.0, "max": 10.0}}
+        missing = {"error": {"type": "index_not_found_exception", "reason": "no such index"}, "status": 404}
+        es.msearch.side_effect = [
+            {"responses": [missing, {"aggregations": raw}]},
+            {"responses": [{"aggregations": raw}]},
+        ]
+
+        with patch.dict(rollups._checkpoints, clear=True):
+            stats = rollups.summarise(es, "air_quality_data", {"site_id": "abc"}, dt(2024, 5, 20, 10), dt(2024, 5, 20, 15))
+
+        retried = es.msearch.call_args.kwargs["searches"]
+        self.assertEqual(retried[0], {"index": "air_quality_data"})
+        self.assertEqual(stats[None]["averageValue"]["count"], 2)
+
+    def test_failed_raw_search_raises(self):
+        es = MagicMock()
+        es.msearch.return_value = {"responses": [
+            {"error": {"type": "search_phase_execution_exception", "reason": "all shards failed"}, "status": 400},
+        ]}
+
+        with patch.object(rollups, "ENABLED", False), self.assertRaises(rollups.SearchError) as raised:
+            rollups.summarise(es, "air_quality_data", {"site_id": "abc"})
+
+        self.assertEqual(raised.exception.status, 400)
+        self.assertEqual(str(raised.exception), "search_phase_execution_exception: all shards failed")
+
+
+if __name__ == "__main__":
+    unittest.main()
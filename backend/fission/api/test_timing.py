@@ -0,0 +1,89 @@
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from flask import Flask
+
+import timing
+import resilience
+import responses
+
+app = Flask(__name__)
+
+
+class TestTiming(unittest.TestCase):
+    def setUp(self):
+        timing._histograms.clear()
+        timing._requests.clear()
+        resilience.reset()
+        self.addCleanup(timing._histograms.clear)
+        self.addCleanup(timing._requests.clear)
+
+    def test_stages_split_wall_time(self):
+        timings = {
+            "started": 0.0, "client": 0.1, "config": 0.05, "es_wall": 0.5, "es_took": 0.3, "es_calls": 1,
+            "first_es": 0.3, "last_es": 0.8, "serialization_started": 0.9, "serialization": 0.1,
+        }
+        stages = timing._stages(timings, 1.0)
+
+        self.assertAlmostEqual(stages["query_build"], 0.2)
+        self.assertAlmostEqual(stages["processing"], 0.1)
+        self.assertAlmostEqual(stages["total"], 1.0)
+        self.assertAlmostEqual(
+            stages["client"] + stages["query_build"] + stages["es_wall"] + stages["processing"] + stages["serialization"],
+            stages["total"]
+        )
+
+    def test_handler_records_elasticsearch_and_serialization(self):
+        es = MagicMock()
+        es.options.return_value.search.return_value = {"timed_out": False, "took": 12, "hits": {"hits": []}}
+
+        @timing.timed("weather-stations")
+        def handler():
+            res = resilience.with_deadline(es, 5).search(index="new_weather_data", body={})
+            return responses.json_response(res["hits"])
+
+        with app.test_request_context("/"), patch.object(timing, "_maybe_flush"):
+            handler()
+
+        histograms = timing.snapshot()["histograms"]
+        self.assertEqual(histograms["weather-stations|es_wall"]["count"], 1)
+        self.assertAlmostEqual(histograms["weather-stations|es_took"]["sum"], 0.012)
+        self.assertEqual(histograms["weather-stations|serialization"]["count"], 1)
+        self.assertEqual(timing.snapshot()["requests"], {"weather-stations|200": 1})
+
+    def test_flush_runs_off_the_request(self):
+        es = MagicMock()
+        written = threading.Event()
+        es.options.return_value.index.side_effect = lambda **kwargs: written.set()
+
+        with patch.object(timing, "_last_flush", 0.0), patch.object(timing, "_index_ready", True), \
+                patch("es_client.get_client", return_value=es):
+            timing._maybe_flush()
+            # a second request inside the interval doesn't start another flush
+            timing._maybe_flush()
+            self.assertTrue(written.wait(5))
+
+        es.options.assert_called_once_with(request_timeout=timing.FLUSH_TIMEOUT)
+
+    def test_render_adds_up_pods(self):
+        snapshot = {
+            "histograms": {"dashboard|total": {"buckets": [0] * 5 + [1] * 9, "sum": 0.04, "count": 1}},
+            "requests": {"dashboard|200": 1},
+        }
+        text = timing.render([snapshot, snapshot])
+
+        self.assertIn('api_request_stage_seconds_bucket{route="dashboard",stage="total",le="0.05"} 2', text)
+        self.assertIn('api_request_stage_seconds_bucket{route="dashboard",stage="total",le="+Inf"} 2', text)
+        self.assertIn('api_request_stage_seconds_count{route="dashboard",stage="total"} 2', text)
+        self.assertIn('api_requests_total{route="dashboard",status="200"} 2', text)
+
+    def test_outside_a_request_nothing_is_recorded(self):
+        with timing.stage("config"):
+            pass
+        timing.record_es(0.0, 1.0, 5)
+        self.assertEqual(timing.snapshot()["histograms"], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+import utils
+
+dt = datetime.datetime
+
+
+class TestWindows(unittest.TestCase):
+    def test_calendar_window(self):
+        window = utils.resolve_window("2024", "2")
+        self.assertEqual(utils.window_bounds(window), (dt(2024, 2, 1), dt(2024, 3, 1)))
+        self.assertEqual(utils.describe_window(window), {"start": "2024-02-01 00:00:00", "end": "2024-02-29 23:59:59"})
+
+    def test_no_window(self):
+        self.assertIsNone(utils.resolve_window())
+        self.assertEqual(utils.window_bounds(None), (None, None))
+
+    def test_relative_window_is_rounded(self):
+        window = utils.resolve_window(last="24h", now=dt(2024, 5, 2, 10, 37, 12))
+        self.assertEqual(utils.window_bounds(window), (dt(2024, 5, 1, 10), dt(2024, 5, 2, 11)))
+
+        # the same query text for every refresh within the hour
+        later = utils.resolve_window(last="24h", now=dt(2024, 5, 2, 10, 59, 59))
+        self.assertEqual(utils.window_range("since", later, "Australia/Melbourne"), {
+            "range": {"since": {"gte": "now-24h/h", "lt": "now+1h/h", "time_zone": "Australia/Melbourne"}}
+        })
+
+        weeks = utils.resolve_window(last="2w", now=dt(2024, 5, 20, 10, 37))
+        self.assertEqual(utils.window_bounds(weeks), (dt(2024, 5, 6), dt(2024, 5, 21)))
+
+    def test_local_time_fields_use_absolute_bounds(self):
+        window = utils.resolve_window(last="30m", now=dt(2024, 5, 2, 10, 37, 12))
+        bounds = utils.window_range("local_date_time_full", window)["range"]["local_date_time_full"]
+        self.assertEqual(bounds["gte"], "2024-05-02 10:07:00")
+        self.assertEqual(bounds["lt"], "2024-05-02 10:38:00")
+        self.assertNotIn("time_zone", bounds)
+
+    def test_iso_bounds_are_converted_to_local_time(self):
+        window = utils.resolve_window(start="2024-05-01T00:00:00Z", end="2024-05-02")
+        # UTC midnight is 10am in Melbourne in May, bounds without an offset are already local
+        self.assertEqual(utils.window_bounds(window), (dt(2024, 5, 1, 10), dt(2024, 5, 2)))
+
+        open_ended = utils.resolve_window(start="2024-05-01")
+        self.assertEqual(utils.window_range("since", open_ended)["range"]["since"], {
+            "format": "yyyy-MM-dd HH:mm:ss", "gte": "2024-05-01 00:00:00"
+        })
+
+    def test_invalid_windows(self):
+        for kwargs, message in (
+            ({"last": "24x"}, "last must be"),
+            ({"last": "0h"}, "last must be"),
+            ({"start": "yesterday"}, "start must be an ISO 8601"),
+            ({"start": "2024-05-02", "end": "2024-05-01"}, "start must be before end"),
+            ({"year": "2024", "last": "24h"}, "year and last can't be combined"),
+            ({"year": "2024", "month": "13"}, "invalid date"),
+        ):
+            with self.assertRaisesRegex(ValueError, message):
+                utils.resolve_window(**kwargs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import elasticsearch
+import rollups
+import weather
+
+
+def mock_es(aggregations):
+    es = MagicMock()
+    es.search.return_value.body = {"aggregations": aggregations}
+    return es
+
+
+class TestWeatherApi(unittest.TestCase):
+    def test_get_stations_pages_catalog(self):
+        es = MagicMock()
+        es.search.return_value = {"hits": {"hits": [
+            {"_source": {"wmo": 94839, "name": "Charlton"}, "sort": [94839]},
+            {"_source": {"wmo": 95936, "name": "Melbourne (Olympic Park)"}, "sort": [95936]},
+        ]}}
+
+        res = weather.get_stations(es, size="2", after="90000", fields="wmo,name")
+
+        query = es.search.call_args.kwargs["body"]
+        self.assertEqual(es.search.call_args.kwargs["index"], "weather_stations")
+        self.assertEqual(query["search_after"], [90000])
+        self.assertEqual(query["_source"], ["wmo", "name"])
+        self.assertEqual(res["next"], "95936")
+        self.assertEqual(len(res["stations"]), 2)
+
+    def test_get_stations_rejects_unknown_fields(self):
+        res = weather.get_stations(MagicMock(), fields="wmo,password")
+        self.assertEqual(res, {"error": "unknown fields: password"})
+
+    def test_aggregate_observations_rejects_bad_month(self):
+        res = weather.aggregate_observations(MagicMock(), "94839", "2024", "May")
+        self.assertEqual(res, {"error": "month must be an integer"})
+
+    def test_aggregate_observations_interval(self):
+        buckets = [
+            dict(key_as_string=f"2024-05-0{day} 00:00:00", doc_count=day, **{key: {"value": float(day)} for key in weather.OBSERVATION_AGGS})
+            for day in (1, 2)
+        ]
+        es = mock_es({"series": {"buckets": buckets}})
+
+        res = weather.aggregate_observations(es, "94839", "2024", "5", interval="day")
+
+        histogram = es.search.call_args.kwargs["body"]["aggs"]["series"]["date_histogram"]
+        self.assertEqual(histogram["calendar_interval"], "day")
+        self.assertEqual(histogram["extended_bounds"], {"min": "2024-05-01 00:00:00", "max": "2024-05-31 23:59:59"})
+        self.assertEqual(res["timestamps"], ["2024-05-01 00:00:00", "2024-05-02 00:00:00"])
+        self.assertEqual(res["count"], [1, 2])
+        self.assertEqual(res["max_temperature"], [1.0, 2.0])
+        self.assertEqual(res["interval"], "day")
+
+    def test_aggregate_observations_rejects_unknown_interval(self):
+        res = weather.aggregate_observations(MagicMock(), "94839", "2024", interval="fortnight")
+        self.assertIn("interval must be one of", res["error"])
+
+    def test_aggregate_observations_batch(self):
+        stats = {"count": 2, "sum": 24.0, "min": 10.0, "max": 14.0}
+        es = MagicMock()
+        es.get.side_effect = elasticsearch.NotFoundError("not found", MagicMock(), {})
+        es.msearch.return_value = {"responses": [{"aggregations": {"groups": {"buckets": [
+            {"key": 94839, "doc_count": 2, "air_temp": stats, "wind_spd_kmh": stats}
+        ]}}}]}
+
+        with patch.dict(rollups._checkpoints, clear=True):
+            res = weather.aggregate_observations_batch(es, ["94839", "95936", "94839"], "2024", "5")
+
+        # without a rollup checkpoint the whole window is read from the raw index in one search
+        searches = es.msearch.call_args.kwargs["searches"]
+        self.assertEqual(searches[0], {"index": "new_weather_data"})
+        self.assertEqual(searches[1]["query"]["bool"]["filter"][0], {"terms": {"wmo": [94839, 95936]}})
+        self.assertEqual(res["stations"]["94839"]["avg_temperature"], 12.0)
+        self.assertEqual(res["stations"]["94839"]["max_wind_speed_kmh"], 14.0)
+        self.assertIsNone(res["stations"]["95936"]["avg_temperature"])
+        self.assertEqual(res["date_filter"], {"start": "2024-05-01 00:00:00", "end": "2024-05-31 23:59:59"})
+        es.msearch.assert_called_once()
+
+    def test_aggregate_observations_batch_in_area(self):
+        es = MagicMock()
+        es.get.side_effect = elasticsearch.NotFoundError("not found", MagicMock(), {})
+        es.search.return_value = {"hits": {"hits": [{"_source": {"wmo": 95936}}, {"_source": {"wmo": 94866}}]}}
+        es.msearch.return_value = {"responses": [{"aggregations": {"groups": {"buckets": []}}}]}
+
+        with patch.dict(rollups._checkpoints, clear=True):
+            res = weather.aggregate_observations_batch(es, [], last="24h", bbox="144.5,-38.1,145.5,-37.5")
+
+        catalog_query = es.search.call_args.kwargs["body"]
+        self.assertEqual(es.search.call_args.kwargs["index"], "weather_stations")
+        self.assertIn("geo_bounding_box", catalog_query["query"]["bool"]["filter"][0])
+        searches = es.msearch.call_args.kwargs["searches"]
+        self.assertEqual(searches[1]["query"]["bool"]["filter"][0], {"terms": {"wmo": [94866, 95936]}})
+        self.assertEqual(sorted(res["stations"]), ["94866", "95936"])
+        self.assertEqual(res["area"], {"bbox": [144.5, -38.1, 145.5, -37.5]})
+
+    def test_get_stations_near(self):
+        es = MagicMock()
+        es.search.return_value = {"hits": {"hits": []}}
+
+        weather.get_stations(es, near="-37.8,144.96", radius="10km")
+
+        query = es.search.call_args.kwargs["body"]
+        self.assertEqual(query["query"]["bool"]["filter"], [
+            {"geo_distance": {"distance": "10.0km", "location": {"lat": -37.8, "lon": 144.96}}}
+        ])
+
+    def test_aggregate_observations_batch_rejects_non_numeric_ids(self):
+        res = weather.aggregate_observations_batch(MagicMock(), ["abc"])
+        self.assertEqual(res, {"error": "station IDs must be integers"})
+
+    def test_aggregate_observations_selected_stats_single_pass(self):
+        es = mock_es({
+            "rel_hum_stats": {"count": 4, "avg": 60.0, "min": 40.0, "max": 80.0, "sum": 240.0, "std_deviation": 15.0},
+            "rel_hum_percentiles": {"values": [{"key": 90.0, "value": 78.0}]},
+        })
+
+        res = weather.aggregate_observations(es, "94839", "2024", "5", fields="rel_hum", stats="avg,stddev,p90")
+
+        aggs = es.search.call_args.kwargs["body"]["aggs"]
+        self.assertEqual(set(aggs), {"rel_hum_stats", "rel_hum_percentiles"})
+        self.assertIn("extended_stats", aggs["rel_hum_stats"])
+        self.assertEqual(aggs["rel_hum_percentiles"]["percentiles"]["percents"], [90.0])
+        self.assertEqual(res["avg_rel_hum"], 60.0)
+        self.assertEqual(res["stddev_rel_hum"], 15.0)
+        self.assertEqual(res["p90_rel_hum"], 78.0)
+
+    def test_aggregate_observations_selected_stats_from_rollups(self):
+        stats = {"count": 2, "sum": 24.0, "min": 10.0, "max": 14.0}
+        es = MagicMock()
+        es.get.side_effect = elasticsearch.NotFoundError("not found", MagicMock(), {})
+        es.msearch.return_value = {"responses": [{"aggregations": {"air_temp": stats, "wind_spd_kmh": stats}}]}
+
+        with patch.dict(rollups._checkpoints, clear=True):
+            res = weather.aggregate_observations(es, "94839", "2024", fields="air_temp", stats="count,avg")
+
+        es.search.assert_not_called()
+        self.assertEqual(res["count_air_temp"], 2)
+        self.assertEqual(res["avg_air_temp"], 12.0)
+
+    def test_aggregate_observations_rejects_unknown_stats(self):
+        res = weather.aggregate_observations(MagicMock(), "94839", fields="air_temp", stats="mode")
+        self.assertIn("unknown stats: mode", res["error"])
+        res = weather.aggregate_observations(MagicMock(), "94839", fields="station_name")
+        self.assertEqual(res, {"error": "unknown fields: station_name"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,103 @@
+import elasticsearch
 import utils
+import rollups
+import catalog
+import geo
+import field_stats
 
-def get_stations(es):
-    # distinct stations
+# per-station summary statistics, shared by the single and batch queries
+OBSERVATION_AGGS = {
+    "avg_temperature": {
+        "avg": {
+            "field": "air_temp"
+        }
+    },
+    "max_temperature": {
+        "max": {
+            "field": "air_temp"
+        }
+    },
+    "min_temperature": {
+        "min": {
+            "field": "air_temp"
+        }
+    },
+    "avg_wind_speed_kmh": {
+        "avg": {
+            "field": "wind_spd_kmh"
+        }
+    },
+    "max_wind_speed_kmh": {
+        "max": {
+            "field": "wind_spd_kmh"
+        }
+    },
+    "min_wind_speed_kmh": {
+        "min": {
+            "field": "wind_spd_kmh"
+        }
+    },
+}
+
+# numeric observation fields callers can request statistics for with ?fields=&stats=,
+# the first two are used when only stats are given
+METRIC_FIELDS = (
+    "air_temp", "wind_spd_kmh", "apparent_t", "dewpt", "delta_t", "rel_hum",
+    "press", "press_msl", "press_qnh", "gust_kmh", "gust_kt", "wind_spd_kt",
+)
+DEFAULT_METRIC_FIELDS = ("air_temp", "wind_spd_kmh")
+
+# one document per station, upserted by the BOM harvester
+STATIONS_INDEX = "weather_stations"
+STATION_FIELDS = ("wmo", "name", "lat", "lon")
+
+# geo_point holding the station's position, in the catalog and on every observation
+LOCATION_FIELD = "location"
+
+# upper bound on the number of stations accepted by a single batch request
+MAX_BATCH_STATIONS = 500
+
+
+def get_stations(es, size=None, after=None, fields=None, bbox=None, near=None, radius=None):
+    """
+    Pages through the station catalog, which holds one entry per WMO ID
+    """
+    try:
+        size, fields = catalog.parse_page_args(size, fields, STATION_FIELDS)
+        area = geo.parse(bbox, near, radius)
+        after = int(after) if after else None
+    except ValueError as e:
+        return {"error": str(e)}
+
+    try:
+        return catalog.get_page(es, STATIONS_INDEX, "wmo", fields, size, after, area_filters(area))
+    except elasticsearch.NotFoundError:
+        return get_stations_from_observations(es, area)
+
+
+def area_filters(area):
+    # stations and observations both carry their station's position as the geo_point location
+    return [geo.point_filter(LOCATION_FIELD, area)] if area else []
+
+
+def stations_in_area(es, area):
+    """
+    IDs of the catalog's stations inside area
+    """
+    return catalog.find_ids(es, STATIONS_INDEX, "wmo", area_filters(area), MAX_BATCH_STATIONS)
+
+
+def get_stations_from_observations(es, area=None):
+    """
+    Builds the station list from the observations themselves. Only used until the
+    station catalog has been populated by the harvester.
+    """
     query = {
         "size": 0, # don't return any documents
         "aggs": {
             "stations": {
                 "composite": {
-                    "size": 100, # max number of stations
+                    "size": 100, # stations per page
                     "sources": [
                         {"wmo": {"terms": {"field": "wmo"}}},
                         {"name": {"terms": {"field": "name.keyword"}}},
@@ -21,10 +111,16 @@ def get_stations(es):
         },
         "_source": False
     }
+    if area:
+        query["query"] = {"bool": {"filter": area_filters(area)}}
     
-    res = es.search(index="new_weather_data", body=query)
-    results = res["aggregations"]["stations"]["buckets"]
-    stations = [result["key"] for result in results]
+    stations = []
+    while True:
+        res = es.search(index="new_weather_data", body=query)["aggregations"]["stations"]
+        stations.extend(result["key"] for result in res["buckets"])
+        if "after_key" not in res or not res["buckets"]:
+            break
+        query["aggs"]["stations"]["composite"]["after"] = res["after_key"]
 
     # rename precise_lat and precise_lon to lat and lon
     for station in stations:
@@ -49,91 +145,151 @@ def get_stations(es):
     return {"station_wmos": unique_stations}
 
 
-def aggregate_observations(es, station_id, year=None, month=None, day=None, hour=None):
+def get_date_filter(window):
+    """
+    Builds the range filter on local_date_time_full for a window resolved by utils.resolve_window, along
+    with the date_filter summary returned to the caller. Both are None without a window.
+    """
+    if window is None:
+        return None, None
+
+    # local_date_time_full holds Melbourne local time, so the bounds are used as they are
+    return utils.window_range("local_date_time_full", window), utils.describe_window(window)
+
+
+def aggregate_observations(es, station_id, year=None, month=None, day=None, hour=None, interval=None,
+                           fields=None, stats=None, start=None, end=None, last=None):
+    """
+    Summary statistics for one station. With an interval (hour, day, week or month) the
+    statistics are returned as a time series of parallel arrays instead of single values.
+    The window is a calendar period, start/end or last, see utils.resolve_window.
+    fields and stats select other statistics than the default temperature and wind speed
+    summary, see field_stats.
+    """
     query = {
         "query": {
             "bool": { "filter": [ { "term": { "wmo": { "value": station_id } } }, ] }
         },
         "size": 0,
-        "aggs": {
-            "avg_temperature": {
-                "avg": {
-                    "field": "air_temp"
-                }
-            },
-            "max_temperature": {
-                "max": {
-                    "field": "air_temp"
-                }
-            },
-            "min_temperature": {
-                "min": {
-                    "field": "air_temp"
-                }
-            },
-            "avg_wind_speed_kmh": {
-                "avg": {
-                    "field": "wind_spd_kmh"
-                }
-            },
-            "max_wind_speed_kmh": {
-                "max": {
-                    "field": "wind_spd_kmh"
-                }
-            },
-            "min_wind_speed_kmh": {
-                "min": {
-                    "field": "wind_spd_kmh"
-                }
-            },
-        }
+        "aggs": OBSERVATION_AGGS
     }
 
-    if year:
-        try:
-            year = int(year)
-        except ValueError:
-            return {"error": "year must be an integer"}
-        
-    if month:
-        try:
-            month = int(month)
-        except ValueError:
-            return {"error": "year must be an integer"}
-        
-    if day:
-        try:
-            day = int(day)
-        except ValueError:
-            return {"error": "year must be an integer"}
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        selection = field_stats.parse(fields, stats, METRIC_FIELDS, DEFAULT_METRIC_FIELDS)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    if selection:
+        query["aggs"] = field_stats.build_aggs(selection)
+
+    range_filter, date_filter = get_date_filter(window)
+    if range_filter:
+        query["query"]["bool"]["filter"].append(range_filter)
+
+    if interval:
+        if interval not in utils.HISTOGRAM_INTERVALS:
+            return {"error": f"interval must be one of {', '.join(utils.HISTOGRAM_INTERVALS)}"}
+        # local_date_time_full is already local time, so no time_zone is needed
+        query["aggs"] = {
+            "series": utils.date_histogram_agg("local_date_time_full", interval, query["aggs"], date_filter)
+        }
+
+    if interval:
+        res = es.search(index="new_weather_data", body=query).body["aggregations"]
+        if selection:
+            res = utils.histogram_columns(res["series"]["buckets"], field_stats.names(selection),
+                                          lambda bucket: field_stats.values(bucket, selection))
+        else:
+            res = utils.histogram_columns(res["series"]["buckets"], OBSERVATION_AGGS)
+        res["interval"] = interval
+    elif selection and not field_stats.from_rollups(selection, "new_weather_data"):
+        # deviations and percentiles can't be rebuilt from the rollups, read the raw observations
+        res = field_stats.values(es.search(index="new_weather_data", body=query).body["aggregations"], selection)
+    else:
+        # summaries come from the hourly/daily rollups, with raw observations for the edges
+        window_start, window_end = utils.window_bounds(window)
+        summary = rollups.summarise(es, "new_weather_data", {"wmo": station_id}, window_start, window_end)
+        if selection:
+            res = field_stats.summary_values(summary.get(None), selection)
+        else:
+            res = rollups.metric_values(OBSERVATION_AGGS, summary.get(None))
     
-    if hour:
-        try:
-            hour = int(hour)
-        except ValueError:
-            return {"error": "year must be an integer"}
-
-    if year:
-        start_date, end_date = utils.get_date_limits(year, month, day, hour)
-        query["query"]["bool"]["filter"].append({
-            "range": {
-                "local_date_time_full": {
-                    "gte": start_date.strftime("%Y%m%d%H%M%S"),
-                    "lte": end_date.strftime("%Y%m%d%H%M%S"),
-                    "format": "yyyyMMddHHmmss"
+    if date_filter:
+        res["date_filter"] = date_filter
+        
+    return res
+
+
+def aggregate_observations_batch(es, station_ids, year=None, month=None, day=None, hour=None,
+                                 fields=None, stats=None, start=None, end=None, last=None,
+                                 bbox=None, near=None, radius=None):
+    """
+    Same statistics as aggregate_observations for many stations at once, computed in a single
+    search with a terms aggregation bucketing on the station's WMO ID. With bbox or near/radius
+    (see geo.parse) the stations in that area are used, only those listed if any are.
+    """
+    try:
+        station_ids = sorted({int(station_id) for station_id in station_ids})
+    except ValueError:
+        return {"error": "station IDs must be integers"}
+
+    try:
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+    if area:
+        in_area = stations_in_area(es, area)
+        station_ids = sorted(set(in_area) & set(station_ids) if station_ids else set(in_area))
+        if not station_ids:
+            return {"stations": {}, "area": geo.describe(area)}
+    elif not station_ids:
+        return {"error": "no station IDs provided"}
+    if len(station_ids) > MAX_BATCH_STATIONS:
+        return {"error": f"at most {MAX_BATCH_STATIONS} stations can be requested at once"}
+
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        selection = field_stats.parse(fields, stats, METRIC_FIELDS, DEFAULT_METRIC_FIELDS)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    range_filter, date_filter = get_date_filter(window)
+    names = field_stats.names(selection) if selection else OBSERVATION_AGGS
+
+    # stations without observations in the window still get an entry, like the single station route
+    stations = {str(station_id): { key: None for key in names } for station_id in station_ids}
+
+    if selection and not field_stats.from_rollups(selection, "new_weather_data"):
+        conditions = [{"terms": {"wmo": station_ids}}]
+        if range_filter:
+            conditions.append(range_filter)
+        query = {
+            "size": 0,
+            "query": {"bool": {"filter": conditions}},
+            "aggs": {
+                "stations": {
+                    "terms": {"field": "wmo", "size": len(station_ids)},
+                    "aggs": field_stats.build_aggs(selection)
                 }
             }
-        })
-     
-    print(query)
-    
-    res = es.search(index="new_weather_data", body=query).body["aggregations"]
-    res = { key: res[key]["value"] for key in res }
-    
-    if year:
-        res["date_filter"] = {
-            "start": start_date.strftime("%Y-%m-%d %H:%M:%S"),
-            "end": end_date.strftime("%Y-%m-%d %H:%M:%S")
         }
-        
+        buckets = es.search(index="new_weather_data", body=query).body["aggregations"]["stations"]["buckets"]
+        for bucket in buckets:
+            stations[str(bucket["key"])] = field_stats.values(bucket, selection)
+    else:
+        window_start, window_end = utils.window_bounds(window)
+        res = rollups.summarise(es, "new_weather_data", {"wmo": station_ids}, window_start, window_end, group_by="wmo")
+        for station_id, summary in res.items():
+            if selection:
+                stations[station_id] = field_stats.summary_values(summary, selection)
+            else:
+                stations[station_id] = rollups.metric_values(OBSERVATION_AGGS, summary)
+
+    res = {"stations": stations}
+    if date_filter:
+        res["date_filter"] = date_filter
+    if area:
+        res["area"] = geo.describe(area)
+
     return res
@@ -0,0 +1,29 @@
+# script to add the location geo_point to existing records in the new_weather_data index
+import elasticsearch
+import bom
+
+es = elasticsearch.Elasticsearch(
+            'https://localhost:9200',
+            verify_certs=False,
+            http_auth=('elastic', 'elastic')
+)
+
+bom.ensure_location_mapping(es, "new_weather_data")
+
+# precise_lat/precise_lon are mapped as floats, but the harvester stores them as strings
+es.update_by_query(
+    index="new_weather_data",
+    query={"bool": {"must_not": [{"exists": {"field": bom.LOCATION_FIELD}}], "filter": [{"exists": {"field": "lat"}}]}},
+    script={
+        "source": """
+            def lat = ctx._source.containsKey('precise_lat') ? ctx._source.precise_lat : ctx._source.lat;
+            def lon = ctx._source.containsKey('precise_lon') ? ctx._source.precise_lon : ctx._source.lon;
+            if (lat != null && lon != null) {
+                ctx._source.location = ['lat': Double.parseDouble(lat.toString()), 'lon': Double.parseDouble(lon.toString())];
+            }
+        """,
+        "lang": "painless"
+    },
+    conflicts="proceed",
+    wait_for_completion=False
+)
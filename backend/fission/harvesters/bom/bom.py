@@ -4,14 +4,22 @@ import pandas as pd
 from bs4 import BeautifulSoup as bs
 from io import StringIO
 import re
+import datetime
 from flask import current_app
 import elasticsearch
+from elasticsearch import helpers
 import urllib3
 from urllib3.exceptions import InsecureRequestWarning
 
 
 STATIONS_INDEX = "https://reg.bom.gov.au/climate/data/lists_by_element/stations.txt"
 VIC_WEATHER_STATIONS = "https://reg.bom.gov.au/vic/observations/vicall.shtml"
+# the API caches results for open date windows until this is bumped
+WATERMARK_INDEX = "ingest_watermarks"
+# station catalog served by the weather-stations API, one document per WMO ID
+STATIONS_CATALOG_INDEX = "weather_stations"
+# geo_point on stations and observations, for the API's bbox/near queries
+LOCATION_FIELD = "location"
 
 def config(k):
     with open(f'/configs/default/shared-data/{k}', 'r') as f:
@@ -99,6 +107,82 @@ def get_weather_data(url):
 
 
 
+def build_station_docs(all_obs):
+    """
+    One station catalog entry per WMO ID, taken from the station's latest observation.
+    Prefers the precise location from the stations index when available.
+    """
+    stations = {}
+    for obs in sorted(all_obs, key=lambda o: o.get("local_date_time_full") or ""):
+        wmo = obs.get("wmo")
+        if wmo is None:
+            continue
+        # precise locations come from the FWF stations table as strings
+        lat = obs.get("precise_lat", obs.get("lat"))
+        lon = obs.get("precise_lon", obs.get("lon"))
+        stations[int(wmo)] = {
+            "wmo": int(wmo),
+            "name": obs.get("name"),
+            "lat": float(lat) if lat is not None else None,
+            "lon": float(lon) if lon is not None else None,
+            LOCATION_FIELD: location(lat, lon),
+        }
+    return stations
+
+
+def location(lat, lon):
+    """
+    geo_point value for a position, or None if it's incomplete
+    """
+    if lat is None or lon is None:
+        return None
+    return {"lat": float(lat), "lon": float(lon)}
+
+
+def ensure_location_mapping(es, index):
+    """
+    Maps LOCATION_FIELD as a geo_point on an existing index, before any document could get it
+    mapped as a plain object
+    """
+    if es.indices.exists(index=index):
+        es.indices.put_mapping(index=index, properties={LOCATION_FIELD: {"type": "geo_point"}})
+
+
+def upsert_stations(es, stations):
+    """
+    Writes the station catalog entries, replacing any previous entry for the same WMO ID
+    """
+    if not es.indices.exists(index=STATIONS_CATALOG_INDEX):
+        es.indices.create(index=STATIONS_CATALOG_INDEX, mappings={
+            "properties": {
+                "wmo": {"type": "integer"},
+                "name": {"type": "keyword"},
+                "lat": {"type": "float"},
+                "lon": {"type": "float"},
+                LOCATION_FIELD: {"type": "geo_point"},
+            }
+        })
+    else:
+        ensure_location_mapping(es, STATIONS_CATALOG_INDEX)
+
+    actions = (
+        {"_index": STATIONS_CATALOG_INDEX, "_id": wmo, "_source": doc}
+        for wmo, doc in stations.items()
+    )
+    success, _ = helpers.bulk(es, actions)
+    return success
+
+
+def bump_watermark(es, index):
+    """
+    Records that new observations were written to index so cached API responses get refreshed
+    """
+    es.index(index=WATERMARK_INDEX, id=index, body={
+        "index": index,
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+    })
+
+
 def main():
     current_app.logger.info("Fetching weather data")
     urllib3.disable_warnings(category=InsecureRequestWarning)
@@ -132,6 +216,7 @@ def main():
             lon = station_locations[station_number]["Lon"]
             obs["precise_lat"] = lat
             obs["precise_lon"] = lon
+        obs[LOCATION_FIELD] = location(obs.get("precise_lat", obs.get("lat")), obs.get("precise_lon", obs.get("lon")))
             
     try:
         es = elasticsearch.Elasticsearch(
@@ -146,13 +231,23 @@ def main():
     
     # had to reindex because the index was created with the wrong mapping
     es_weather_index = "new_weather_data"
+    ensure_location_mapping(es, es_weather_index)
 
+    indexed = 0
     for obs in all_obs:
         obs_id = f'{obs["wmo"]}--{obs["aifstime_utc"]}'
         already_exists = es.exists(index=es_weather_index, id=obs_id).body
         if not already_exists:
             es.index(index=es_weather_index, id=obs_id, body=obs)
+            indexed += 1
             current_app.logger.info(f"Indexed observation {obs_id}")
+
+    if indexed:
+        bump_watermark(es, es_weather_index)
+
+    stations = build_station_docs(all_obs)
+    upserted = upsert_stations(es, stations)
+    current_app.logger.info(f"Upserted {upserted} stations into the station catalog")
             
     current_app.logger.info("Finished indexing weather observations")
             
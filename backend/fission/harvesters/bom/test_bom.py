@@ -87,5 +87,27 @@ class TestBomHarvester(unittest.TestCase):
         
         self.assertEqual(weather_data, expected_data)
 
+    def test_build_station_docs(self):
+        all_obs = [
+            {"wmo": 94839, "name": "Charlton", "local_date_time_full": "20240504150000", "lat": -36.3, "lon": 143.3},
+            {"wmo": 94839, "name": "Charlton Aero", "local_date_time_full": "20240504153000", "lat": -36.3, "lon": 143.3,
+             "precise_lat": "-36.2847", "precise_lon": "143.3341"},
+            {"wmo": 95936, "name": "Melbourne (Olympic Park)", "local_date_time_full": "20240504150000", "lat": -37.8, "lon": 145.0},
+        ]
+
+        stations = bom.build_station_docs(all_obs)
+
+        # duplicate WMO IDs collapse to the latest observation
+        self.assertEqual(stations, {
+            94839: {"wmo": 94839, "name": "Charlton Aero", "lat": -36.2847, "lon": 143.3341,
+                    "location": {"lat": -36.2847, "lon": 143.3341}},
+            95936: {"wmo": 95936, "name": "Melbourne (Olympic Park)", "lat": -37.8, "lon": 145.0,
+                    "location": {"lat": -37.8, "lon": 145.0}},
+        })
+
+    def test_location(self):
+        self.assertEqual(bom.location("-36.2847", "143.3341"), {"lat": -36.2847, "lon": 143.3341})
+        self.assertIsNone(bom.location(None, 143.3))
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,22 @@
+# script to add the location geo_point to existing records in the air_quality_data index
+import elasticsearch
+import epa
+
+es = elasticsearch.Elasticsearch(
+            'https://localhost:9200',
+            verify_certs=False,
+            http_auth=('elastic', 'elastic')
+)
+
+epa.ensure_location_mapping(es, "air_quality_data")
+
+es.update_by_query(
+    index="air_quality_data",
+    query={"bool": {"must_not": [{"exists": {"field": epa.LOCATION_FIELD}}], "filter": [{"exists": {"field": "latitude"}}]}},
+    script={
+        "source": "ctx._source.location = ['lat': ctx._source.latitude, 'lon': ctx._source.longitude]",
+        "lang": "painless"
+    },
+    conflicts="proceed",
+    wait_for_completion=False
+)
@@ -1,12 +1,20 @@
 import requests
 import time
+import datetime
 import elasticsearch
+from elasticsearch import helpers
 from flask import current_app
 import urllib3
 from urllib3.exceptions import InsecureRequestWarning
 import sys
 
 EPA_URL = "https://gateway.api.epa.vic.gov.au/environmentMonitoring/v1/"
+# the API caches results for open date windows until this is bumped
+WATERMARK_INDEX = "ingest_watermarks"
+# station catalog served by the air-quality-stations API, one document per site
+STATIONS_CATALOG_INDEX = "air_quality_stations"
+# geo_point on sites and observations, for the API's bbox/near queries
+LOCATION_FIELD = "location"
 
 def config(k):
     with open(f'/configs/default/shared-data/{k}', 'r') as f:
@@ -97,6 +105,7 @@ def get_pm2p5(site_id: str) -> float:
                             "site_name": site_name,
                             "latitude": lat,
                             "longitude": long,
+                            LOCATION_FIELD: {"lat": lat, "lon": long} if coords is not None else None,
                             "averageValue": reading["averageValue"],
                             "unit": reading["unit"],
                             "since": since,
@@ -111,6 +120,54 @@ def get_pm2p5(site_id: str) -> float:
     return result
 
 
+def ensure_location_mapping(es, index):
+    """
+    Maps LOCATION_FIELD as a geo_point on an existing index, before any document could get it
+    mapped as a plain object
+    """
+    if es.indices.exists(index=index):
+        es.indices.put_mapping(index=index, properties={LOCATION_FIELD: {"type": "geo_point"}})
+
+
+def upsert_stations(es, pm25_results):
+    """
+    Writes one station catalog entry per site that reported a reading, replacing any previous entry
+    """
+    if not es.indices.exists(index=STATIONS_CATALOG_INDEX):
+        es.indices.create(index=STATIONS_CATALOG_INDEX, mappings={
+            "properties": {
+                "site_id": {"type": "keyword"},
+                "site_name": {"type": "keyword"},
+                "latitude": {"type": "float"},
+                "longitude": {"type": "float"},
+                LOCATION_FIELD: {"type": "geo_point"},
+            }
+        })
+    else:
+        ensure_location_mapping(es, STATIONS_CATALOG_INDEX)
+
+    actions = (
+        {
+            "_index": STATIONS_CATALOG_INDEX,
+            "_id": result["site_id"],
+            "_source": {key: result[key] for key in ("site_id", "site_name", "latitude", "longitude", LOCATION_FIELD)},
+        }
+        for result in pm25_results
+    )
+    success, _ = helpers.bulk(es, actions)
+    return success
+
+
+def bump_watermark(es, index):
+    """
+    Records that new observations were written to index so cached API responses get refreshed
+    """
+    es.index(index=WATERMARK_INDEX, id=index, body={
+        "index": index,
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat()
+    })
+
+
 def main():
     current_app.logger.info("Starting EPA harvester")
     urllib3.disable_warnings(category=InsecureRequestWarning)
@@ -154,13 +211,26 @@ def main():
         return 'fail'
     
     air_quality_index = "air_quality_data"
+    if not es.indices.exists(index=air_quality_index):
+        # everything else is mapped dynamically, as before
+        es.indices.create(index=air_quality_index, mappings={"properties": {LOCATION_FIELD: {"type": "geo_point"}}})
+    else:
+        ensure_location_mapping(es, air_quality_index)
     
+    indexed = 0
     for result in pm25_results:
         exists = es.exists(index=air_quality_index, id=result["obs_id"]).body
         if not exists:
             es.index(index=air_quality_index, id=result["obs_id"], body=result)
+            indexed += 1
             current_app.logger.info(f'Indexed observation {result["obs_id"]}')
 
+    if indexed:
+        bump_watermark(es, air_quality_index)
+
+    upserted = upsert_stations(es, pm25_results)
+    current_app.logger.info(f"Upserted {upserted} sites into the station catalog")
+
     current_app.logger.info("Finished EPA harvester")
 
     return 'ok'
@@ -0,0 +1,79 @@
+# script to move segment geometries out of the existing records in the traffic-data index
+# into traffic-segments, where the harvester now stores them once per segment, and to give
+# the records the location the harvester now sets
+import elasticsearch
+import traffic_harvester
+
+es = elasticsearch.Elasticsearch(
+            'https://localhost:9200',
+            verify_certs=False,
+            http_auth=('elastic', 'elastic')
+)
+
+# one observation (with its geometry) of every segment, paged through with after_key
+query = {
+  "size": 0,
+  "query": {"exists": {"field": "geometry"}},
+  "aggs": {
+    "segments": {
+      "composite": {
+        "size": 500,
+        "sources": [
+          {"freeway": {"terms": {"field": "freewayName.keyword"}}},
+          {"segment": {"terms": {"field": "segmentName.keyword"}}}
+        ]
+      },
+      "aggs": {
+        "latest": {
+          "top_hits": {"size": 1, "sort": [{"publishedTime": "desc"}], "_source": ["obs_id", "geometry"]}
+        }
+      }
+    }
+  }
+}
+
+features = []
+while True:
+    res = es.search(index="traffic-data", body=query).body["aggregations"]["segments"]
+    for bucket in res["buckets"]:
+        source = bucket["latest"]["hits"]["hits"][0]["_source"]
+        # obs_id is '<segment id>---<publishedTime>'
+        features.append({
+            "properties": {
+                "id": source["obs_id"].split("---")[0],
+                "freewayName": bucket["key"]["freeway"],
+                "segmentName": bucket["key"]["segment"],
+            },
+            "geometry": source["geometry"],
+        })
+    if "after_key" not in res or not res["buckets"]:
+        break
+    query["aggs"]["segments"]["composite"]["after"] = res["after_key"]
+
+updated = traffic_harvester.upsert_segments(es, traffic_harvester.build_segment_docs(features))
+print(f"Stored {updated} of {len(features)} segments")
+
+# reference the segments from the old records, locate them at their segment's midpoint
+# and drop their copies of the geometry
+traffic_harvester.ensure_location_mapping(es, "traffic-data")
+midpoints = {
+    feature["properties"]["id"]: traffic_harvester.midpoint(feature["geometry"]) for feature in features
+}
+es.update_by_query(
+    index="traffic-data",
+    query={"bool": {"must_not": [{"exists": {"field": traffic_harvester.LOCATION_FIELD}}]}},
+    script={
+        "source": """
+            String id = ctx._source.obs_id.splitOnToken('---')[0];
+            ctx._source.segmentId = id;
+            if (params.midpoints.containsKey(id)) {
+                ctx._source.location = params.midpoints[id];
+            }
+            ctx._source.remove('geometry');
+        """,
+        "params": {"midpoints": {key: value for key, value in midpoints.items() if value is not None}},
+        "lang": "painless"
+    },
+    conflicts="proceed",
+    wait_for_completion=False
+)
@@ -0,0 +1,62 @@
+# script to pack the existing records in the traffic-data index into the per-segment
+# daily documents the harvester writes with TRAFFIC_STORAGE=daily, one day at a time
+# (see traffic_harvester.daily_doc). The traffic API keeps reading traffic-data until the
+# harvester runs with TRAFFIC_STORAGE=daily and marks traffic-daily as harvested, so run
+# this first. traffic-data is left as it is, delete it once the API reads the daily layout.
+import datetime
+import elasticsearch
+from elasticsearch import helpers
+import traffic_harvester
+
+es = elasticsearch.Elasticsearch(
+            'https://localhost:9200',
+            verify_certs=False,
+            http_auth=('elastic', 'elastic')
+)
+
+traffic_harvester.ensure_daily_index(es)
+
+# first and last day with observations
+bounds = es.search(index="traffic-data", body={
+    "size": 0,
+    "aggs": {"first": {"min": {"field": "publishedTime"}}, "last": {"max": {"field": "publishedTime"}}}
+}).body["aggregations"]
+if bounds["first"]["value"] is None:
+    print("No observations to compact")
+    raise SystemExit
+
+day = datetime.date.fromisoformat(bounds["first"]["value_as_string"][:10])
+last_day = datetime.date.fromisoformat(bounds["last"]["value_as_string"][:10])
+total = 0
+while day <= last_day:
+    next_day = day + datetime.timedelta(days=1)
+    query = {"range": {"publishedTime": {"gte": day.isoformat(), "lt": next_day.isoformat()}}}
+
+    docs = {}
+    for hit in helpers.scan(es, index="traffic-data", query={"query": query}):
+        source = hit["_source"]
+        # older records only carry the segment id in obs_id, '<segment id>---<publishedTime>'
+        source["id"] = source.get("segmentId") or source["obs_id"].split("---")[0]
+        time = traffic_harvester.local_time(source.get("publishedTime"))
+        doc_id = f"{source['id']}---{time[:10]}"
+        if doc_id not in docs:
+            docs[doc_id] = dict(traffic_harvester.daily_doc(source, None), times=[], count=0,
+                                **{field: [] for field in traffic_harvester.DAILY_METRICS})
+        doc = docs[doc_id]
+        if time in doc["times"]:
+            continue
+        doc["times"].append(time)
+        for field in traffic_harvester.DAILY_METRICS:
+            doc[field].append(source.get(field))
+        doc["count"] += 1
+        if doc[traffic_harvester.LOCATION_FIELD] is None:
+            doc[traffic_harvester.LOCATION_FIELD] = source.get(traffic_harvester.LOCATION_FIELD)
+
+    # a day already compacted is simply rewritten
+    actions = [{"_index": traffic_harvester.DAILY_INDEX, "_id": doc_id, "_source": doc} for doc_id, doc in docs.items()]
+    success, _ = helpers.bulk(es, actions)
+    total += success
+    print(f"{day}: packed {sum(doc['count'] for doc in docs.values())} observations into {success} documents")
+    day = next_day
+
+print(f"Wrote {total} daily documents")
@@ -1,13 +1,207 @@
+import os
+import json
+import hashlib
+import datetime
 import requests
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, helpers
 from flask import request, current_app, jsonify
 import urllib3
 from urllib3.exceptions import InsecureRequestWarning
 
+# segment geometries never change between polls, so they're stored once per segment
+# here (keyed by the VicRoads segment id) rather than on every observation
+SEGMENTS_INDEX = "traffic-segments"
+# geo_point on every observation, the middle vertex of its segment, for the API's map grids
+LOCATION_FIELD = "location"
+# "observations" stores one traffic-data document per segment per poll, "daily" packs each
+# segment's observations of a local day into one DAILY_INDEX document of parallel arrays.
+# While it writes the daily layout DAILY_INDEX is marked harvested in its mapping's _meta,
+# which switches every traffic API reader over to it (see traffic-api/daily.py).
+STORAGE = os.environ.get("TRAFFIC_STORAGE", "observations")
+DAILY_INDEX = "traffic-daily"
+DAILY_METRICS = ("actualTravelTime", "averageSpeed", "congestionIndex")
+DAILY_MAPPING = {
+    "properties": {
+        "segmentId": {"type": "keyword"},
+        "freewayName": {"type": "keyword"},
+        "segmentName": {"type": "keyword"},
+        "date": {"type": "date", "format": "yyyy-MM-dd"},
+        # local publishedTime of every observation, parallel to the metric arrays
+        "times": {"type": "date", "format": "yyyy-MM-dd'T'HH:mm:ss"},
+        "actualTravelTime": {"type": "float"},
+        "averageSpeed": {"type": "float"},
+        "congestionIndex": {"type": "float"},
+        "count": {"type": "integer"},
+        LOCATION_FIELD: {"type": "geo_point"},
+    }
+}
+# appends an observation to its day's arrays unless that publishedTime is already there
+APPEND_SCRIPT = """
+if (ctx._source.times.contains(params.time)) {
+    ctx.op = 'noop';
+    return;
+}
+ctx._source.times.add(params.time);
+for (field in params.metrics) {
+    ctx._source[field].add(params.values[field]);
+}
+ctx._source.count = ctx._source.times.size();
+"""
+
 def config(k):
     with open(f'/configs/default/shared-data/{k}', 'r') as f:
         return f.read().strip()
 
+def geometry_hash(geometry):
+    return hashlib.sha1(json.dumps(geometry, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def midpoint(geometry):
+    """
+    geo_point of the middle vertex of a LineString, or None for other geometries
+    """
+    if not geometry or geometry.get('type') != 'LineString' or not geometry.get('coordinates'):
+        return None
+    lon, lat = geometry['coordinates'][len(geometry['coordinates']) // 2][:2]
+    return {'lat': lat, 'lon': lon}
+
+
+def ensure_location_mapping(es, index):
+    """
+    Maps LOCATION_FIELD as a geo_point before any observation could get it mapped as a plain object
+    """
+    if es.indices.exists(index=index):
+        es.indices.put_mapping(index=index, properties={LOCATION_FIELD: {"type": "geo_point"}})
+    else:
+        # everything else is mapped dynamically, as before
+        es.indices.create(index=index, mappings={"properties": {LOCATION_FIELD: {"type": "geo_point"}}})
+
+
+def local_time(published_time):
+    """
+    publishedTime as a local yyyy-MM-ddTHH:mm:ss string, which sorts chronologically
+    """
+    return str(published_time)[:19]
+
+
+def daily_doc(properties, geometry):
+    """
+    The day document one observation starts, holding just that observation
+    """
+    time = local_time(properties.get('publishedTime'))
+    doc = {
+        'segmentId': str(properties.get('id')),
+        'freewayName': properties.get('freewayName'),
+        'segmentName': properties.get('segmentName'),
+        'date': time[:10],
+        'times': [time],
+        'count': 1,
+        LOCATION_FIELD: midpoint(geometry),
+    }
+    for field in DAILY_METRICS:
+        doc[field] = [properties.get(field)]
+    return doc
+
+
+def daily_actions(features):
+    """
+    Bulk scripted upserts adding each feature's observation to its segment's document for the day
+    """
+    actions = []
+    for feature in features:
+        properties = feature['properties']
+        if properties.get('id') is None or properties.get('publishedTime') is None:
+            continue
+        doc = daily_doc(properties, feature.get('geometry'))
+        actions.append({
+            "_op_type": "update",
+            "_index": DAILY_INDEX,
+            "_id": f"{doc['segmentId']}---{doc['date']}",
+            "scripted_upsert": True,
+            "script": {
+                "source": APPEND_SCRIPT,
+                "lang": "painless",
+                "params": {
+                    "time": doc['times'][0],
+                    "metrics": list(DAILY_METRICS),
+                    "values": {field: doc[field][0] for field in DAILY_METRICS},
+                },
+            },
+            "upsert": dict(doc, times=[], count=0, **{field: [] for field in DAILY_METRICS}),
+        })
+    return actions
+
+
+def ensure_daily_index(es, harvested=None):
+    """
+    Creates DAILY_INDEX if needed. harvested sets whether the harvester writes it, None leaves
+    the mark as it is.
+    """
+    if not es.indices.exists(index=DAILY_INDEX):
+        if harvested is False:
+            return
+        es.indices.create(index=DAILY_INDEX, mappings=dict(DAILY_MAPPING, _meta={"harvested": bool(harvested)}))
+    elif harvested is not None:
+        es.indices.put_mapping(index=DAILY_INDEX, meta={"harvested": harvested})
+
+
+def build_segment_docs(features):
+    """
+    One segment document per VicRoads segment id, holding its names and geometry
+    """
+    segments = {}
+    for feature in features:
+        properties = feature['properties']
+        if properties.get('id') is None or feature.get('geometry') is None:
+            continue
+        segment_id = str(properties.get('id'))
+        segments[segment_id] = {
+            'segmentId': segment_id,
+            'freewayName': properties.get('freewayName'),
+            'segmentName': properties.get('segmentName'),
+            'geometry': feature.get('geometry'),
+            'geometry_hash': geometry_hash(feature.get('geometry')),
+        }
+    return segments
+
+
+def upsert_segments(es, segments):
+    """
+    Writes the segment documents whose geometry or names changed since they were last stored
+    """
+    if not es.indices.exists(index=SEGMENTS_INDEX):
+        es.indices.create(index=SEGMENTS_INDEX, mappings={
+            "properties": {
+                "segmentId": {"type": "keyword"},
+                "freewayName": {"type": "keyword"},
+                "segmentName": {"type": "keyword"},
+                "geometry": {"type": "geo_shape"},
+                "geometry_hash": {"type": "keyword"},
+                "updated_at": {"type": "date"},
+            }
+        })
+
+    if not segments:
+        return 0
+
+    stored = es.mget(index=SEGMENTS_INDEX, ids=list(segments), source=["freewayName", "segmentName", "geometry_hash"])
+    unchanged = {
+        doc["_id"] for doc in stored["docs"]
+        if doc.get("found") and all(doc["_source"].get(k) == segments[doc["_id"]][k]
+                                    for k in ("freewayName", "segmentName", "geometry_hash"))
+    }
+
+    updated_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    actions = [
+        {"_index": SEGMENTS_INDEX, "_id": segment_id, "_source": dict(doc, updated_at=updated_at)}
+        for segment_id, doc in segments.items() if segment_id not in unchanged
+    ]
+    if not actions:
+        return 0
+    success, _ = helpers.bulk(es, actions)
+    return success
+
+
 def main():
     urllib3.disable_warnings(category=InsecureRequestWarning)
     current_app.logger.info("Fetching traffic data")
@@ -34,6 +228,19 @@ def main():
         http_auth=(config('ES_USERNAME'), config('ES_PASSWORD'))
     )
 
+    updated = upsert_segments(es, build_segment_docs(data['features']))
+    if updated:
+        current_app.logger.info(f"Updated {updated} segment geometries")
+
+    ensure_daily_index(es, harvested=STORAGE == "daily")
+    if STORAGE == "daily":
+        # every observation is appended to its segment's day in one request, repeated polls are no-ops
+        result = helpers.bulk(es, daily_actions(data['features']), stats_only=True, raise_on_error=False)
+        current_app.logger.info(f"Appended observations to {result[0]} daily documents, {result[1]} failed")
+        return jsonify({'message': f'Updated {result[0]} daily documents'}), 200
+
+    ensure_location_mapping(es, "traffic-data")
+
     # Process only the important features for analysis
     processed_data = []
     for feature in data['features']:
@@ -44,8 +251,10 @@ def main():
         if exists:
             continue
         # Removed id check, since id here is just freeway id.
+        # the geometry lives in SEGMENTS_INDEX under segmentId
         relevant_data = {
             'obs_id': obs_id,
+            'segmentId': str(properties.get('id')),
             'freewayName': properties.get('freewayName'),
             'segmentName': properties.get('segmentName'),
             'publishedTime': properties.get('publishedTime'),
@@ -53,7 +262,7 @@ def main():
             'actualTravelTime': properties.get('actualTravelTime'),
             'averageSpeed': properties.get('averageSpeed'),
             'congestionIndex': properties.get('congestionIndex'),
-            'geometry': feature.get('geometry')
+            LOCATION_FIELD: midpoint(feature.get('geometry')),
         }
         processed_data.append(relevant_data)
         es.index(index="traffic-data", id=obs_id, body=relevant_data)
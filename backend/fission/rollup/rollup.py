@@ -0,0 +1,350 @@
+import os
+import datetime
+import pytz
+import elasticsearch
+from elasticsearch import helpers
+from flask import current_app
+import urllib3
+from urllib3.exceptions import InsecureRequestWarning
+
+# Maintains hourly and daily summary documents (count, sum, min, max per metric)
+# for every station / freeway segment, so the API doesn't have to scan the raw
+# observations for long windows. Runs on a timer after the harvesters and only
+# recomputes the buckets touched since the last run. Observations that arrive later
+# than that (e.g. a harvester catching up after an outage) are found by comparing
+# each recent day's raw observation count with its daily rollups, and the days that
+# differ are rolled up again.
+#
+# Bucket times are Melbourne local time, matching the windows the API exposes.
+# Keep SOURCES in sync with the copies in api/rollups.py and traffic-api/rollups.py.
+
+SOURCES = {
+    "new_weather_data": {
+        "time_field": "local_date_time_full",
+        # already local time
+        "time_zone": None,
+        "group_fields": {"wmo": "wmo"},
+        "metric_fields": ["air_temp", "wind_spd_kmh"],
+    },
+    "air_quality_data": {
+        "time_field": "since",
+        # stored in UTC
+        "time_zone": "Australia/Melbourne",
+        "group_fields": {"site_id": "site_id.keyword"},
+        "metric_fields": ["averageValue"],
+    },
+    "traffic-data": {
+        "time_field": "publishedTime",
+        "time_zone": None,
+        "group_fields": {"freewayName": "freewayName.keyword", "segmentName": "segmentName.keyword"},
+        "metric_fields": ["congestionIndex", "actualTravelTime", "averageSpeed"],
+    },
+}
+
+# the daily traffic layout, which replaces traffic-data while the traffic harvester marks it as
+# harvested (see traffic-api/daily.py). Its readers don't use rollups.
+DAILY_TRAFFIC_INDEX = "traffic-daily"
+
+INTERVALS = ("hour", "day")
+CHECKPOINT_INDEX = "rollup_checkpoints"
+BUCKET_FORMAT = "yyyy-MM-dd HH:mm:ss"
+PY_BUCKET_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# hours are only rolled up once they ended at least this long ago, giving late observations time to arrive
+SETTLE_TIME = datetime.timedelta(hours=1)
+# each run recomputes from the start of the day this long before the last checkpoint, to pick up stragglers
+REFRESH_LAG = datetime.timedelta(hours=6)
+# how far back each run compares raw and rolled up observation counts
+RECONCILE_LOOKBACK = datetime.timedelta(days=int(os.environ.get("ROLLUP_RECONCILE_DAYS", 30)))
+COMPOSITE_PAGE_SIZE = 1000
+
+MELB_TZ = pytz.timezone('Australia/Melbourne')
+
+
+def config(k):
+    with open(f'/configs/default/shared-data/{k}', 'r') as f:
+        return f.read().strip()
+
+
+def rollup_index(source, interval):
+    return f"{source}-rollup-{interval}"
+
+
+def floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def floor_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def ensure_rollup_index(es, source, interval):
+    """
+    Creates the rollup index with an explicit mapping if it doesn't exist yet
+    """
+    properties = {
+        "bucket": {"type": "date", "format": BUCKET_FORMAT},
+        "doc_count": {"type": "long"},
+    }
+    for name in SOURCES[source]["group_fields"]:
+        properties[name] = {"type": "keyword"}
+    for field in SOURCES[source]["metric_fields"]:
+        properties[f"{field}_count"] = {"type": "long"}
+        for stat in ("sum", "min", "max"):
+            properties[f"{field}_{stat}"] = {"type": "double"}
+
+    try:
+        es.indices.create(index=rollup_index(source, interval), mappings={"dynamic": False, "properties": properties})
+    except elasticsearch.BadRequestError as e:
+        if e.error != "resource_already_exists_exception":
+            raise
+
+
+def time_range_filter(source, start, end):
+    """
+    Range filter on the source's time field for the local window [start, end)
+    """
+    time_range = {
+        "gte": start.strftime(PY_BUCKET_FORMAT),
+        "lt": end.strftime(PY_BUCKET_FORMAT),
+        "format": BUCKET_FORMAT,
+    }
+    if SOURCES[source]["time_zone"]:
+        time_range["time_zone"] = SOURCES[source]["time_zone"]
+    return {"range": {SOURCES[source]["time_field"]: time_range}}
+
+
+def merge_stats(doc, other):
+    # only needed for the repeated hour when daylight saving ends
+    for key, value in other.items():
+        if key.endswith("_count") or key.endswith("_sum") or key == "doc_count":
+            doc[key] = (doc.get(key) or 0) + (value or 0)
+        elif key.endswith("_min") and value is not None:
+            doc[key] = value if doc.get(key) is None else min(doc[key], value)
+        elif key.endswith("_max") and value is not None:
+            doc[key] = value if doc.get(key) is None else max(doc[key], value)
+
+
+def compute_rollups(es, source, interval, start, end):
+    """
+    Aggregates the raw observations in [start, end) into one document per group and interval bucket
+    """
+    settings = SOURCES[source]
+    histogram = {
+        "field": settings["time_field"],
+        "calendar_interval": interval,
+        "format": BUCKET_FORMAT,
+    }
+    if settings["time_zone"]:
+        histogram["time_zone"] = settings["time_zone"]
+
+    sources = [{name: {"terms": {"field": field}}} for name, field in settings["group_fields"].items()]
+    sources.append({"bucket": {"date_histogram": histogram}})
+
+    query = {
+        "size": 0,
+        "query": {"bool": {"filter": [time_range_filter(source, start, end)]}},
+        "aggs": {
+            "rollup": {
+                "composite": {"size": COMPOSITE_PAGE_SIZE, "sources": sources},
+                "aggs": {field: {"stats": {"field": field}} for field in settings["metric_fields"]},
+            }
+        },
+    }
+
+    docs = {}
+    while True:
+        res = es.search(index=source, body=query)["aggregations"]["rollup"]
+        for bucket in res["buckets"]:
+            key = {name: str(value) for name, value in bucket["key"].items()}
+            doc = dict(key, doc_count=bucket["doc_count"])
+            for field in settings["metric_fields"]:
+                stats = bucket[field]
+                doc[f"{field}_count"] = stats["count"]
+                doc[f"{field}_sum"] = stats["sum"]
+                doc[f"{field}_min"] = stats["min"]
+                doc[f"{field}_max"] = stats["max"]
+
+            doc_id = "--".join(key[name] for name in settings["group_fields"]) + "--" + key["bucket"]
+            if doc_id in docs:
+                merge_stats(docs[doc_id], doc)
+            else:
+                docs[doc_id] = doc
+
+        if "after_key" not in res or not res["buckets"]:
+            break
+        query["aggs"]["rollup"]["composite"]["after"] = res["after_key"]
+
+    return docs
+
+
+def daily_counts(es, index, time_field, start, end, time_zone=None, count_field=None, filters=()):
+    """
+    {local day: observations} for [start, end), counting documents or summing count_field
+    """
+    histogram = {"field": time_field, "calendar_interval": "day", "format": BUCKET_FORMAT, "min_doc_count": 1}
+    if time_zone:
+        histogram["time_zone"] = time_zone
+    time_range = {"gte": start.strftime(PY_BUCKET_FORMAT), "lt": end.strftime(PY_BUCKET_FORMAT), "format": BUCKET_FORMAT}
+    if time_zone:
+        time_range["time_zone"] = time_zone
+    query = {
+        "size": 0,
+        "query": {"bool": {"filter": [{"range": {time_field: time_range}}, *filters]}},
+        "aggs": {"days": {"date_histogram": histogram}},
+    }
+    if count_field:
+        query["aggs"]["days"]["aggs"] = {"observations": {"sum": {"field": count_field}}}
+
+    try:
+        buckets = es.search(index=index, body=query)["aggregations"]["days"]["buckets"]
+    except elasticsearch.NotFoundError:
+        return {}
+    return {
+        bucket["key_as_string"]: int(bucket["observations"]["value"]) if count_field else bucket["doc_count"]
+        for bucket in buckets
+    }
+
+
+def stale_days(es, source, start, end):
+    """
+    Local days in [start, end) whose raw observations don't add up to their daily rollups,
+    i.e. that gained observations after they were rolled up
+    """
+    settings = SOURCES[source]
+    # observations without a group field are never rolled up
+    grouped = [{"exists": {"field": field}} for field in settings["group_fields"].values()]
+    raw = daily_counts(es, source, settings["time_field"], start, end, settings["time_zone"], filters=grouped)
+    rolled = daily_counts(es, rollup_index(source, "day"), "bucket", start, end, count_field="doc_count")
+    return sorted(
+        datetime.datetime.strptime(day, PY_BUCKET_FORMAT)
+        for day in set(raw) | set(rolled) if raw.get(day, 0) != rolled.get(day, 0)
+    )
+
+
+def write_rollups(es, source, interval, start, end):
+    ensure_rollup_index(es, source, interval)
+    docs = compute_rollups(es, source, interval, start, end)
+    actions = (
+        {"_index": rollup_index(source, interval), "_id": doc_id, "_source": doc}
+        for doc_id, doc in docs.items()
+    )
+    success, _ = helpers.bulk(es, actions)
+    current_app.logger.info(f"Wrote {success} {interval} rollups for {source} between {start} and {end}")
+    return success
+
+
+def get_checkpoint(es, source):
+    try:
+        checkpoint = es.get(index=CHECKPOINT_INDEX, id=source)["_source"]["rolled_up_to"]
+    except elasticsearch.NotFoundError:
+        return None
+    return datetime.datetime.strptime(checkpoint, PY_BUCKET_FORMAT)
+
+
+def set_checkpoint(es, source, checkpoint):
+    es.index(index=CHECKPOINT_INDEX, id=source, body={
+        "source": source,
+        "rolled_up_to": checkpoint.strftime(PY_BUCKET_FORMAT),
+        "updated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    })
+
+
+def get_earliest(es, source):
+    """
+    Time of the first raw observation, used to backfill a source that has never been rolled up
+    """
+    query = {
+        "size": 0,
+        "aggs": {"first": {"min": {"field": SOURCES[source]["time_field"], "format": BUCKET_FORMAT}}},
+    }
+    res = es.search(index=source, body=query)["aggregations"]["first"]
+    if res.get("value") is None:
+        return None
+    # min reports UTC, step back a day so local midnight is always covered
+    return datetime.datetime.strptime(res["value_as_string"], PY_BUCKET_FORMAT) - datetime.timedelta(days=1)
+
+
+def daily_traffic(es):
+    """
+    Whether the traffic harvester writes DAILY_TRAFFIC_INDEX instead of traffic-data
+    """
+    try:
+        mapping = es.indices.get_mapping(index=DAILY_TRAFFIC_INDEX)
+    except elasticsearch.NotFoundError:
+        return False
+    return any(index.get("mappings", {}).get("_meta", {}).get("harvested") is True for index in mapping.values())
+
+
+def refresh_source(es, source, now):
+    """
+    Recomputes every hourly and daily bucket between the last checkpoint (less REFRESH_LAG) and now,
+    and the earlier days within RECONCILE_LOOKBACK that gained observations since they were rolled up
+    """
+    end = floor_hour(now - SETTLE_TIME)
+    checkpoint = get_checkpoint(es, source)
+
+    if checkpoint is None:
+        start = get_earliest(es, source)
+        if start is None:
+            current_app.logger.info(f"No observations in {source} to roll up")
+            return 0
+    else:
+        start = checkpoint - REFRESH_LAG
+    start = floor_day(start)
+
+    if start >= end:
+        return 0
+
+    # daily buckets are only written for days that are complete
+    windows = {"hour": (start, end), "day": (start, floor_day(end))}
+
+    written = 0
+    for interval in INTERVALS:
+        window_start, window_end = windows[interval]
+        if window_start >= window_end:
+            continue
+
+        written += write_rollups(es, source, interval, window_start, window_end)
+
+    if checkpoint is not None:
+        # days before this run's window that observations arrived for since they were rolled up
+        for day in stale_days(es, source, floor_day(start - RECONCILE_LOOKBACK), start):
+            current_app.logger.info(f"Rolling up {source} for {day:%Y-%m-%d} again, it gained late observations")
+            for interval in INTERVALS:
+                written += write_rollups(es, source, interval, day, day + datetime.timedelta(days=1))
+
+    set_checkpoint(es, source, end)
+    return written
+
+
+def main():
+    current_app.logger.info("Refreshing rollups")
+    urllib3.disable_warnings(category=InsecureRequestWarning)
+
+    try:
+        es = elasticsearch.Elasticsearch(
+            # url should also be in config
+            'https://elasticsearch-master.elastic.svc.cluster.local:9200',
+            verify_certs=False,
+            http_auth=(config('ES_USERNAME'), config('ES_PASSWORD'))
+        )
+    except Exception as e:
+        current_app.logger.fatal(f"Failed to connect to Elasticsearch: {e}")
+        return 'fail'
+
+    now = datetime.datetime.now(MELB_TZ).replace(tzinfo=None)
+
+    status = 'ok'
+    for source in SOURCES:
+        try:
+            if source == "traffic-data" and daily_traffic(es):
+                current_app.logger.info(f"Not rolling up {source}, traffic is stored in {DAILY_TRAFFIC_INDEX}")
+                continue
+            refresh_source(es, source, now)
+        except elasticsearch.ApiError as e:
+            current_app.logger.error(f"Failed to refresh rollups for {source}: {e}")
+            status = 'fail'
+
+    current_app.logger.info("Finished refreshing rollups")
+    return status
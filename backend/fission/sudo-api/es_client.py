@@ -0,0 +1,150 @@
+import os
+import time
+import logging
+import threading
+import elasticsearch
+import timing
+
+# Shared Elasticsearch client for every request served by a warm pod. The
+# client (and its keep-alive connection pool) is created lazily on first use
+# and only rebuilt when the shared-data config files change.
+
+ES_URL = "https://elasticsearch-master.elastic.svc.cluster.local:9200"
+CONFIG_DIR = "/configs/default/shared-data"
+CREDENTIAL_KEYS = ("ES_USERNAME", "ES_PASSWORD")
+
+CONNECTIONS_PER_NODE = int(os.environ.get("ES_CONNECTIONS_PER_NODE", 10))
+# how often (seconds) to stat the config files looking for credential changes
+CONFIG_CHECK_INTERVAL = float(os.environ.get("ES_CONFIG_CHECK_INTERVAL", 5))
+# log pool statistics every this many client acquisitions
+STATS_LOG_EVERY = int(os.environ.get("ES_STATS_LOG_EVERY", 100))
+
+_lock = threading.Lock()
+_client = None
+_client_stamp = None
+_last_check = 0.0
+_config_cache = {}
+_stats = {
+    "clients_created": 0,
+    "acquisitions": 0,
+    "created_at": None,
+}
+
+
+def _file_stamp(k):
+    # configmap updates swap the ..data symlink, so the target's mtime changes
+    try:
+        st = os.stat(os.path.join(CONFIG_DIR, k))
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def _credentials_stamp():
+    return tuple(_file_stamp(k) for k in CREDENTIAL_KEYS)
+
+
+def config(k):
+    """
+    Reads a value from the shared-data configmap, cached until the file changes
+    """
+    with timing.stage("config"):
+        stamp = _file_stamp(k)
+        cached = _config_cache.get(k)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+        with open(os.path.join(CONFIG_DIR, k), 'r') as f:
+            value = f.read().strip()
+        _config_cache[k] = (stamp, value)
+        return value
+
+
+def _create_client():
+    return elasticsearch.Elasticsearch(
+        ES_URL,
+        http_auth=(config('ES_USERNAME'), config('ES_PASSWORD')),
+        verify_certs=False,
+        ssl_show_warn=False,
+        connections_per_node=CONNECTIONS_PER_NODE,
+    )
+
+
+def get_client():
+    """
+    Returns the pod-wide Elasticsearch client, creating it on first use and
+    recreating it if the credential files have changed since it was built
+    """
+    global _client, _client_stamp, _last_check
+
+    stale = None
+    with _lock:
+        now = time.monotonic()
+        if _client is None or now - _last_check >= CONFIG_CHECK_INTERVAL:
+            _last_check = now
+            stamp = _credentials_stamp()
+            if _client is None or stamp != _client_stamp:
+                if _client is not None:
+                    logging.info("Elasticsearch credentials changed, reconnecting")
+                stale = _client
+                _client = _create_client()
+                _client_stamp = stamp
+                _stats["clients_created"] += 1
+                _stats["created_at"] = time.time()
+
+        _stats["acquisitions"] += 1
+        client = _client
+        log_stats = STATS_LOG_EVERY and _stats["acquisitions"] % STATS_LOG_EVERY == 0
+
+    if stale is not None:
+        stale.close()
+    if log_stats:
+        logging.info("Elasticsearch pool stats: %s", pool_stats())
+
+    return client
+
+
+def _idle_connections(pool):
+    # urllib3 pre-fills its queue with None placeholders up to maxsize
+    if pool.pool is None:
+        return 0
+    return sum(1 for conn in list(pool.pool.queue) if conn is not None)
+
+
+def pool_stats():
+    """
+    Summarises the client lifecycle and the per-node urllib3 connection pools
+    """
+    stats = dict(_stats)
+    stats["connections_per_node"] = CONNECTIONS_PER_NODE
+    stats["nodes"] = []
+
+    client = _client
+    if client is None:
+        return stats
+
+    for node in client.transport.node_pool.all():
+        pool = getattr(node, "pool", None)
+        if pool is None:
+            continue
+        stats["nodes"].append({
+            "node": node.base_url,
+            # connections opened over the pool's lifetime; a number that keeps
+            # growing relative to requests means keep-alive isn't being reused
+            "connections_opened": pool.num_connections,
+            "requests": pool.num_requests,
+            "idle_connections": _idle_connections(pool),
+        })
+
+    return stats
+
+
+def reset():
+    """
+    Closes and forgets the current client, e.g. after a fatal transport error
+    """
+    global _client, _client_stamp
+    with _lock:
+        stale, _client, _client_stamp = _client, None, None
+    if stale is not None:
+        stale.close()
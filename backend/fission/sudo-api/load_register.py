@@ -0,0 +1,137 @@
+"""
+Loads a SUDO vehicle register export (CSV or GeoJSON) into the sudo-vehicle-register index.
+
+Column names are normalised (stripped, lower case, underscores), SA2 and other codes and
+names are kept as strings and every other value is parsed as a number. The index is created
+with an explicit mapping: codes and names as keywords, measures as doubles. Each SA2 area
+is stored under its SA2 code, so loading the same export again replaces it.
+
+    python load_register.py data/sudo_vehicles.csv
+    python load_register.py data/sudo_vehicles.json --recreate
+"""
+import re
+import csv
+import json
+import argparse
+import logging
+import elasticsearch
+from elasticsearch import helpers
+import register
+
+# columns whose values are identifiers or labels rather than measures
+TEXT_COLUMN = re.compile(r"(^|_)(code|name)(_|$)")
+REGISTER_MAPPING = {
+    "dynamic_templates": [
+        {"labels": {"match_mapping_type": "string", "mapping": {"type": "keyword"}}},
+        {"counts": {"match_mapping_type": "long", "mapping": {"type": "double"}}},
+        {"measures": {"match_mapping_type": "double", "mapping": {"type": "double"}}},
+    ],
+    "properties": {
+        register.SA2_FIELD: {"type": "keyword"},
+        "sa2_name_2021": {"type": "keyword"},
+    },
+}
+THREADS = 4
+CHUNK_SIZE = 500
+
+
+def column_name(name):
+    return re.sub(r"[^0-9a-z]+", "_", name.strip().lower()).strip("_")
+
+
+def parse_value(column, value):
+    """
+    value as its column's type: a string for codes and names, a number (or None) otherwise
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value == "":
+            return None
+    if TEXT_COLUMN.search(column):
+        return str(value)
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        logging.warning("Keeping non-numeric value %r of %s as text", value, column)
+        return value
+
+
+def normalise(row):
+    return {column_name(key): parse_value(column_name(key), value) for key, value in row.items() if key is not None}
+
+
+def read_rows(path):
+    """
+    Yields the export's rows as dicts of raw values. CSV files are streamed row by row,
+    GeoJSON files are read whole and only their features' properties are kept.
+    """
+    if path.lower().endswith((".json", ".geojson")):
+        with open(path, encoding="utf-8") as f:
+            for feature in json.load(f)["features"]:
+                yield feature["properties"]
+    else:
+        # SUDO CSV exports can start with a byte order mark
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.DictReader(f)
+
+
+def actions(rows):
+    for row in rows:
+        doc = normalise(row)
+        if doc.get(register.SA2_FIELD) is None:
+            logging.warning("Skipping a row without an SA2 code: %s", doc)
+            continue
+        yield {"_index": register.REGISTER_INDEX, "_id": doc[register.SA2_FIELD], "_source": doc}
+
+
+def ensure_index(es, recreate=False):
+    if recreate and es.indices.exists(index=register.REGISTER_INDEX):
+        es.indices.delete(index=register.REGISTER_INDEX)
+    if not es.indices.exists(index=register.REGISTER_INDEX):
+        es.indices.create(index=register.REGISTER_INDEX, mappings=REGISTER_MAPPING)
+
+
+def load(es, path, recreate=False, threads=THREADS, chunk_size=CHUNK_SIZE):
+    """
+    Writes every row of the export at path, returning the number of areas stored and failed
+    """
+    ensure_index(es, recreate)
+    stored = failed = 0
+    for ok, item in helpers.parallel_bulk(es, actions(read_rows(path)), thread_count=threads,
+                                          chunk_size=chunk_size, raise_on_error=False):
+        if ok:
+            stored += 1
+        else:
+            failed += 1
+            logging.error("Failed to store %s", item)
+    es.indices.refresh(index=register.REGISTER_INDEX)
+    return stored, failed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Load a SUDO vehicle register export into Elasticsearch")
+    parser.add_argument("path", help="CSV or GeoJSON export")
+    parser.add_argument("--recreate", action="store_true",
+                        help="delete the index first, e.g. to replace one loaded with dynamic mapping")
+    parser.add_argument("--url", default="https://localhost:9200")
+    parser.add_argument("--user", default="elastic")
+    parser.add_argument("--password", default="elastic")
+    parser.add_argument("--threads", type=int, default=THREADS)
+    args = parser.parse_args()
+
+    es = elasticsearch.Elasticsearch(args.url, verify_certs=False, basic_auth=(args.user, args.password))
+    stored, failed = load(es, args.path, args.recreate, args.threads)
+    print(f"Stored {stored} SA2 areas, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
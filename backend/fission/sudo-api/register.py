@@ -0,0 +1,243 @@
+import os
+import time
+import logging
+import threading
+import elasticsearch
+
+# The SUDO vehicle register: census measures for every SA2 area, loaded once into
+# REGISTER_INDEX and never written to again. Each pod keeps the whole dataset in
+# memory keyed by SA2 code. Every CHECK_INTERVAL seconds the index's document count
+# and version (the highest sequence number of each of its shards) are read, and the
+# copy is only reloaded when one of them changed. A pod that hasn't loaded it yet answers requests for a
+# few SA2 codes with a terms lookup instead, once it has seen SA2_FIELD mapped as a
+# keyword, and loads the register if that lookup doesn't find every code.
+#
+# load_register.py writes the index with SA2_FIELD as a keyword, older copies loaded
+# straight from the CSV only work once loaded into memory.
+
+REGISTER_INDEX = "sudo-vehicle-register"
+CHECK_INTERVAL = float(os.environ.get("API_SUDO_CHECK_INTERVAL", 60))
+SA2_FIELD = "sa2_code_2021"
+# the fields served when none are asked for, by the names the route has always used
+DEFAULT_FIELDS = {"Total_Dwellings": "total_dwellings", "num_mot_veh_per_dwg_tot_dwgs": "num_mot_veh_per_dwg_tot_dwgs"}
+LOAD_PAGE_SIZE = 1000
+PIT_KEEP_ALIVE = "1m"
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+# SA2 codes accepted in a single ?sa2= list
+MAX_CODES = 1000
+
+# {"register": (checked_at, stamp, {sa2 code: record}, sorted sa2 codes, column names)}
+_store = {}
+_lock = threading.Lock()
+
+
+def normalise(source):
+    """
+    A register document with its column names stripped, the register was loaded from a CSV
+    whose header has spaces after the commas
+    """
+    return {key.strip(): value for key, value in source.items()}
+
+
+def stamp(es):
+    """
+    (document count, highest sequence number of every shard) of the register index, which
+    changes whenever a document is added, updated or deleted. Sequence numbers count per
+    shard, so on an index of several shards each shard's is read with its own search.
+    Like the point in time the register is read from, only refreshed writes count.
+    """
+    body = {
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": {"version": {"max": {"field": "_seq_no"}}},
+    }
+    res = es.search(index=REGISTER_INDEX, body=body)
+    count, shards = res["hits"]["total"]["value"], res["_shards"]["total"]
+    if shards <= 1:
+        return count, (res["aggregations"]["version"]["value"],)
+
+    searches = []
+    for shard in range(shards):
+        searches.extend([{"index": REGISTER_INDEX, "preference": f"_shards:{shard}"}, body])
+    versions = []
+    for shard_res in es.msearch(searches=searches)["responses"]:
+        if "error" in shard_res:
+            raise RuntimeError(f"Could not read the vehicle register version: {shard_res['error']}")
+        versions.append(shard_res["aggregations"]["version"]["value"])
+    return count, tuple(versions)
+
+
+def keyword_mapped(es):
+    """
+    Whether SA2_FIELD is mapped as a keyword, i.e. the index was written by load_register.py.
+    The answer is kept for the life of the pod once Elasticsearch gave one.
+    """
+    if "keyword" not in _store:
+        try:
+            res = es.indices.get_field_mapping(index=REGISTER_INDEX, fields=SA2_FIELD)
+        except Exception as e:
+            logging.warning("Could not read the vehicle register mapping: %s", e)
+            return False
+        types = [
+            field.get("mapping", {}).get(SA2_FIELD, {}).get("type")
+            for index in res.values() for field in index.get("mappings", {}).values()
+        ]
+        _store["keyword"] = bool(types) and all(kind == "keyword" for kind in types)
+    return _store["keyword"]
+
+
+def fetch(es, codes):
+    """
+    The register records of the given SA2 codes by code, from an exact match on the keyword SA2 field
+    """
+    query = {
+        "size": len(codes),
+        "query": {"bool": {"filter": [{"terms": {SA2_FIELD: codes}}]}},
+    }
+    hits = es.search(index=REGISTER_INDEX, body=query)["hits"]["hits"]
+    records = (normalise(hit["_source"]) for hit in hits)
+    return {str(record[SA2_FIELD]): record for record in records if record.get(SA2_FIELD) is not None}
+
+
+def read_all(es):
+    """
+    Every register record by SA2 code, paged through with a point in time
+    """
+    records = {}
+    pit = es.open_point_in_time(index=REGISTER_INDEX, keep_alive=PIT_KEEP_ALIVE)["id"]
+    try:
+        search_after = None
+        while True:
+            body = {
+                "size": LOAD_PAGE_SIZE,
+                "pit": {"id": pit, "keep_alive": PIT_KEEP_ALIVE},
+                "sort": [{"_shard_doc": "asc"}],
+                "track_total_hits": False,
+            }
+            if search_after is not None:
+                body["search_after"] = search_after
+            res = es.search(body=body)
+            hits = res["hits"]["hits"]
+            for hit in hits:
+                record = normalise(hit["_source"])
+                if record.get(SA2_FIELD) is not None:
+                    records[str(record[SA2_FIELD])] = record
+            if len(hits) < LOAD_PAGE_SIZE:
+                break
+            pit = res.get("pit_id", pit)
+            search_after = hits[-1]["sort"]
+    finally:
+        try:
+            es.close_point_in_time(id=pit)
+        except elasticsearch.ApiError:
+            pass
+    return records
+
+
+def load(es):
+    """
+    The register records by SA2 code, the sorted SA2 codes and every column name, reloaded
+    when the index changed
+    """
+    now = time.monotonic()
+    cached = _store.get("register")
+    if cached is not None and now - cached[0] < CHECK_INTERVAL:
+        return cached[2:]
+
+    # one pod-wide reload, concurrent requests wait for it instead of repeating it
+    with _lock:
+        cached = _store.get("register")
+        if cached is not None and now - cached[0] < CHECK_INTERVAL:
+            return cached[2:]
+        try:
+            current = stamp(es)
+            if cached is not None and current == cached[1]:
+                _store["register"] = (now,) + cached[1:]
+                return cached[2:]
+            records = read_all(es)
+        except Exception:
+            # keep serving the previous copy while Elasticsearch is unavailable
+            if cached is not None:
+                logging.warning("Serving the previously loaded vehicle register")
+                return cached[2:]
+            raise
+        codes = sorted(records)
+        columns = set().union(*records.values())
+        logging.info("Loaded %d SA2 areas of the vehicle register", len(records))
+        _store["register"] = (now, current, records, codes, columns)
+        return records, codes, columns
+
+
+def reset():
+    _store.clear()
+
+
+def parse_args(sa2=None, fields=None, size=None, after=None):
+    """
+    Validates the query parameters. Raises ValueError with a message for the caller.
+    """
+    codes = None
+    if sa2:
+        codes = sorted({code.strip() for code in sa2.split(",") if code.strip()})
+        if len(codes) > MAX_CODES:
+            raise ValueError(f"at most {MAX_CODES} SA2 codes can be requested at once")
+    if fields:
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    if size:
+        try:
+            size = int(size)
+        except ValueError:
+            raise ValueError("size must be an integer")
+        if not 0 < size <= MAX_PAGE_SIZE:
+            raise ValueError(f"size must be between 1 and {MAX_PAGE_SIZE}")
+    return codes, fields or None, size or None, after or None
+
+
+def project(record, fields):
+    if fields is None:
+        return {name: record.get(field) for name, field in DEFAULT_FIELDS.items()}
+    return {field: record.get(field) for field in fields}
+
+
+def lookup(es, sa2=None, fields=None, size=None, after=None):
+    """
+    Register records keyed by SA2 code, only the listed sa2 codes if given. fields selects the
+    columns returned (the dwelling and vehicle counts by default). With size or after the codes
+    are paged through in order, returning {"areas": {...}, "next": cursor} while more remain.
+    """
+    try:
+        codes, fields, size, after = parse_args(sa2, fields, size, after)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    records = None
+    if codes is not None and "register" not in _store and keyword_mapped(es):
+        # cheaper than loading the whole register for a pod that may only serve this request
+        records = fetch(es, codes)
+        columns = set().union(*records.values())
+        if len(records) < len(codes):
+            # unknown codes, or codes stored differently, are settled by the loaded register
+            records = None
+    if records is None:
+        records, all_codes, columns = load(es)
+        if codes is None:
+            codes = all_codes
+    if fields is not None and records:
+        unknown = [field for field in fields if field not in columns]
+        if unknown:
+            return {"error": f"unknown fields: {', '.join(unknown)}"}
+
+    codes = [code for code in codes if code in records]
+
+    if size is None and after is None:
+        return {code: project(records[code], fields) for code in codes}
+
+    size = size or DEFAULT_PAGE_SIZE
+    if after is not None:
+        codes = [code for code in codes if code > after]
+    page = codes[:size]
+    res = {"areas": {code: project(records[code], fields) for code in page}}
+    if len(codes) > size:
+        res["next"] = page[-1]
+    return res
@@ -1,67 +1,45 @@
 # import weather
 import logging
-import json
+import es_client
+import responses
+import resilience
+import timing
+import register
 from flask import request
-import elasticsearch
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# seconds the vehicle query may take, see resilience.py
+DEADLINE = 10
 
-def config(k):
-    with open(f'/configs/default/shared-data/{k}', 'r') as f:
-        value = f.read().strip()
-        logging.debug("Read value for config key '%s': %s", k, value)
-        return value
-    
-def connect_elasticsearch():
-    logging.debug("Connecting to Elasticsearch...")
-    try:
-        es = elasticsearch.Elasticsearch(
-            f"https://elasticsearch-master.elastic.svc.cluster.local:9200",
-            http_auth=(config('ES_USERNAME'), config('ES_PASSWORD')),
-            verify_certs=False
-        )
-        logging.debug("Connected to Elasticsearch successfully.")
-        return es
-    except Exception as e:
-        logging.error("Failed to connect to Elasticsearch: %s", e)
-        raise
-
-def get_simplified_response(res):
-    # Process the results to build the desired dictionary
-    result_dict = {}
-    for hit in res['hits']['hits']:
-        source = hit['_source']
-        sa2_code = source[' sa2_code_2021']
-        result_dict[sa2_code] = {
-            "Total_Dwellings": source[' total_dwellings'],
-            "num_mot_veh_per_dwg_tot_dwgs": source['num_mot_veh_per_dwg_tot_dwgs']
-        }
-
-    return result_dict
 
+@timing.timed("sudo-vehicle")
+@resilience.serves_unavailable
 def get_vehicles():
-    logging.info("Retrieving freeways from Elasticsearch...")
+    """
+    Vehicle register records by SA2 code, see register.lookup for ?sa2=, ?fields=, ?size= and ?after=
+    """
+    logging.info("Retrieving the vehicle register...")
     try:
-        es = connect_elasticsearch()
-
-        # Define the query
-        query = {
-            "query": {
-                "match_all": {}
-            },
-            "size": 1000  # Adjust the size if needed
-        }
-        # Execute the query
-        res = es.search(index="sudo-vehicle-register", body=query)
-
-        vehicle_data = get_simplified_response(res)
-
-        logging.info("Successfully retrieved freeways.")
-        return json.dumps(vehicle_data)
+        with timing.stage("client"):
+            es = resilience.with_deadline(es_client.get_client(), DEADLINE)
+
+        try:
+            vehicle_data = register.lookup(es, request.args.get("sa2"), request.args.get("fields"),
+                                           request.args.get("size"), request.args.get("after"))
+        except Exception as e:
+            # the pod's copy of the register is served while Elasticsearch is degraded,
+            # this is only reached before it was ever loaded
+            if resilience.is_degraded(e):
+                raise resilience.Unavailable(str(e) or type(e).__name__) from e
+            raise
+
+        logging.info("Successfully retrieved the vehicle register.")
+        return responses.json_response(vehicle_data)
+    except resilience.Unavailable:
+        raise
     except Exception as e:
-        logging.error("Failed to retrieve freeways: %s", e)
-        return json.dumps({"error": str(e)})
-
+        logging.error("Failed to retrieve the vehicle register: %s", e)
+        return responses.json_response({"error": str(e)})
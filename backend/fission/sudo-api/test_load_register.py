@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+import load_register
+
+
+class TestLoadRegister(unittest.TestCase):
+    def test_normalises_columns_and_types(self):
+        row = {" sa2_code_2021": "206041122", " SA2 Name 2021": "Melbourne", " total_dwellings": "4521",
+               "num_mot_veh_per_dwg_tot_dwgs": "1.42", " num_mot_veh_per_dwg_none_dwgs": ""}
+
+        self.assertEqual(load_register.normalise(row), {
+            "sa2_code_2021": "206041122", "sa2_name_2021": "Melbourne", "total_dwellings": 4521,
+            "num_mot_veh_per_dwg_tot_dwgs": 1.42, "num_mot_veh_per_dwg_none_dwgs": None,
+        })
+
+    def test_codes_stay_strings(self):
+        # GeoJSON properties can hold the SA2 code as a number
+        self.assertEqual(load_register.parse_value("sa2_code_2021", 206041122), "206041122")
+
+    def test_actions_from_csv(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8-sig") as f:
+            f.write("sa2_code_2021, total_dwellings\n206041122, 4521\n, 7\n")
+        self.addCleanup(os.remove, f.name)
+
+        actions = list(load_register.actions(load_register.read_rows(f.name)))
+
+        self.assertEqual(actions, [{
+            "_index": "sudo-vehicle-register", "_id": "206041122",
+            "_source": {"sa2_code_2021": "206041122", "total_dwellings": 4521},
+        }])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import register
+
+
+def register_es(sources, count=None, version=7):
+    """
+    A client whose register index holds sources, in a single point-in-time page
+    """
+    es = MagicMock()
+    stamp = {"hits": {"total": {"value": len(sources) if count is None else count}},
+             "aggregations": {"version": {"value": version}}, "_shards": {"total": 1}}
+    page = {"hits": {"hits": [{"_source": source, "sort": [i]} for i, source in enumerate(sources)]}}
+    es.search.side_effect = lambda body=None, index=None: stamp if "aggs" in body else page
+    es.open_point_in_time.return_value = {"id": "pit"}
+    return es
+
+
+def field_mapping(kind=None):
+    # indices.get_field_mapping's answer for sa2_code_2021, which has no mapping in an index loaded from the raw CSV
+    fields = {"sa2_code_2021": {"full_name": "sa2_code_2021", "mapping": {"sa2_code_2021": {"type": kind}}}} if kind else {}
+    return {"sudo-vehicle-register": {"mappings": fields}}
+
+
+def area(code, dwellings):
+    # column names as the raw CSV load left them
+    return {" sa2_code_2021": code, " total_dwellings": dwellings, "num_mot_veh_per_dwg_tot_dwgs": 1.5}
+
+
+class TestRegister(unittest.TestCase):
+    def setUp(self):
+        register.reset()
+        self.addCleanup(register.reset)
+
+    def test_default_response(self):
+        es = register_es([area("206041122", 4521), area(206041123, 100)])
+
+        res = register.lookup(es)
+
+        self.assertEqual(res, {
+            "206041122": {"Total_Dwellings": 4521, "num_mot_veh_per_dwg_tot_dwgs": 1.5},
+            "206041123": {"Total_Dwellings": 100, "num_mot_veh_per_dwg_tot_dwgs": 1.5},
+        })
+        es.close_point_in_time.assert_called_once_with(id="pit")
+
+    def test_sa2_filter_and_fields(self):
+        es = register_es([area("206041122", 4521), area("206041123", 100)])
+
+        res = register.lookup(es, sa2="206041123,999999999", fields="total_dwellings")
+
+        self.assertEqual(res, {"206041123": {"total_dwellings": 100}})
+        self.assertIn("error", register.lookup(es, fields="no_such_column"))
+
+    def test_terms_lookup_before_loading(self):
+        es = register_es([{"sa2_code_2021": "206041123", "total_dwellings": 100, "num_mot_veh_per_dwg_tot_dwgs": 1.5}])
+        es.indices.get_field_mapping.return_value = field_mapping("keyword")
+
+        res = register.lookup(es, sa2="206041123")
+
+        query = es.search.call_args.kwargs["body"]["query"]
+        self.assertEqual(query["bool"]["filter"], [{"terms": {"sa2_code_2021": ["206041123"]}}])
+        es.open_point_in_time.assert_not_called()
+        self.assertEqual(res, {"206041123": {"Total_Dwellings": 100, "num_mot_veh_per_dwg_tot_dwgs": 1.5}})
+
+    def test_loads_register_when_sa2_code_is_text(self):
+        # the index as loaded straight from the CSV, where a terms lookup matches nothing
+        es = register_es([area("206041123", 100)])
+        es.indices.get_field_mapping.return_value = field_mapping()
+
+        res = register.lookup(es, sa2="206041123")
+
+        es.open_point_in_time.assert_called_once()
+        self.assertEqual(res, {"206041123": {"Total_Dwellings": 100, "num_mot_veh_per_dwg_tot_dwgs": 1.5}})
+
+    def test_loads_register_when_terms_lookup_misses_codes(self):
+        es = register_es([area("206041123", 100)])
+        es.indices.get_field_mapping.return_value = field_mapping("keyword")
+        es.search.side_effect = lambda body=None, index=None: (
+            {"hits": {"hits": []}} if "query" in body else register_es([area("206041123", 100)]).search(body=body))
+
+        res = register.lookup(es, sa2="206041123")
+
+        es.open_point_in_time.assert_called_once()
+        self.assertEqual(list(res), ["206041123"])
+
+    def test_pages(self):
+        es = register_es([area(str(code), code) for code in range(100, 105)])
+
+        first = register.lookup(es, size="2")
+        self.assertEqual(list(first["areas"]), ["100", "101"])
+        self.assertEqual(first["next"], "101")
+
+        last = register.lookup(es, size="2", after="102")
+        self.assertEqual(list(last["areas"]), ["103", "104"])
+        self.assertNotIn("next", last)
+
+    def test_reloads_only_when_the_index_changed(self):
+        es = register_es([area("206041122", 4521)])
+        with patch.object(register, "CHECK_INTERVAL", 0):
+            register.lookup(es)
+            register.lookup(es)
+            self.assertEqual(es.open_point_in_time.call_count, 1)
+
+            es.search.side_effect = register_es([area("206041122", 4521), area("206041123", 100)]).search.side_effect
+            res = register.lookup(es)
+
+        self.assertEqual(es.open_point_in_time.call_count, 2)
+        self.assertEqual(len(res), 2)
+
+    def test_version_of_every_shard(self):
+        def shard_versions(*versions):
+            return {"responses": [{"aggregations": {"version": {"value": version}}} for version in versions]}
+
+        es = register_es([area("206041122", 4521)], version=9)
+        search = es.search.side_effect
+
+        def two_shards(body=None, index=None):
+            res = search(body=body, index=index)
+            return dict(res, _shards={"total": 2}) if "aggs" in body else res
+
+        es.search.side_effect = two_shards
+        es.msearch.return_value = shard_versions(9, 4)
+
+        with patch.object(register, "CHECK_INTERVAL", 0):
+            register.lookup(es)
+            register.lookup(es)
+            self.assertEqual(es.open_point_in_time.call_count, 1)
+
+            # an update on the shard whose sequence numbers are behind leaves the index-wide max as it was
+            es.msearch.return_value = shard_versions(9, 5)
+            register.lookup(es)
+
+        self.assertEqual(es.open_point_in_time.call_count, 2)
+        headers = es.msearch.call_args.kwargs["searches"][::2]
+        self.assertEqual([header["preference"] for header in headers], ["_shards:0", "_shards:1"])
+
+    def test_serves_loaded_copy_when_elasticsearch_fails(self):
+        es = register_es([area("206041122", 4521)])
+        register.lookup(es)
+
+        es.search.side_effect = ConnectionError("down")
+        with patch.object(register, "CHECK_INTERVAL", 0):
+            res = register.lookup(es, sa2="206041122")
+
+        self.assertEqual(res["206041122"]["Total_Dwellings"], 4521)
+
+    def test_rejects_bad_args(self):
+        es = register_es([])
+        self.assertIn("error", register.lookup(es, size="many"))
+        self.assertIn("error", register.lookup(es, size="0"))
+        es.search.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
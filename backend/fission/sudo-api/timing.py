@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import socket
+import random
+import logging
+import datetime
+import functools
+import threading
+import elasticsearch
+from flask import request, has_request_context
+
+# Per-request stage timings for the API handlers.
+#
+# Each request's wall time is split into stages: client acquisition (including any
+# config reads, also recorded on their own), query building (up to the first
+# Elasticsearch call), Elasticsearch (wall time, with the server's own `took`
+# recorded alongside), response processing and serialisation.
+# The stages feed per-route histograms. Every Fission function runs in its own pods,
+# so each pod periodically writes its histograms to METRICS_INDEX and the /metrics
+# route adds them up in Prometheus' text format.
+#
+# A sample of requests (and every slow one) is logged as a single JSON line.
+#
+# Keep in sync with the copies in api/ and the other API packages.
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGES = ("config", "client", "query_build", "es_wall", "es_took", "processing", "serialization", "total")
+
+METRICS_INDEX = "api_metrics"
+FLUSH_INTERVAL = float(os.environ.get("API_METRICS_FLUSH_INTERVAL", 30))
+# seconds a flush may take, it runs in the background so this only bounds a stuck thread
+FLUSH_TIMEOUT = float(os.environ.get("API_METRICS_FLUSH_TIMEOUT", 2))
+# pods that haven't reported for this long are left out of /metrics
+METRICS_RETENTION = datetime.timedelta(hours=float(os.environ.get("API_METRICS_RETENTION_HOURS", 24)))
+LOG_SAMPLE_RATE = float(os.environ.get("API_LOG_SAMPLE_RATE", 0.01))
+SLOW_REQUEST = float(os.environ.get("API_SLOW_REQUEST_SECONDS", 2))
+
+POD_ID = f"{socket.gethostname()}-{os.getpid()}"
+ENVIRON_KEY = "api.timing"
+
+_lock = threading.Lock()
+_histograms = {}
+_requests = {}
+_last_flush = time.monotonic()
+_index_ready = False
+_flushing = False
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return request.environ.get(ENVIRON_KEY)
+
+
+def add(stage, seconds, started=None):
+    """
+    Adds seconds to a stage of the current request, if there is one being timed
+    """
+    timings = _current()
+    if timings is not None:
+        with _lock:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+            if started is not None:
+                timings.setdefault(f"{stage}_started", started)
+
+
+class stage:
+    """
+    Context manager timing a block as the given stage of the current request
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        add(self.name, time.perf_counter() - self.started, self.started)
+        return False
+
+
+def record_es(started, finished, took_ms=None):
+    """
+    Records one Elasticsearch call that ran from started to finished (perf_counter times),
+    with the server-side took if the response had one
+    """
+    timings = _current()
+    if timings is None:
+        return
+    with _lock:
+        timings["es_wall"] += finished - started
+        timings["es_calls"] += 1
+        if took_ms is not None:
+            timings["es_took"] += took_ms / 1000
+        if timings["first_es"] is None:
+            timings["first_es"] = started
+        timings["last_es"] = finished
+
+
+def _observe(route, name, seconds):
+    key = (route, name)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram["buckets"][i] += 1
+    histogram["sum"] += seconds
+    histogram["count"] += 1
+
+
+def _stages(timings, finished):
+    """
+    Splits a request's wall time into its stages
+    """
+    started = timings["started"]
+    serialised_at = timings.get("serialization_started", finished)
+    first_es = timings["first_es"]
+    # config reads happen while acquiring the client
+    before = timings.get("client", 0.0)
+
+    if first_es is None:
+        query_build = 0.0
+        processing = max(0.0, serialised_at - started - before)
+    else:
+        query_build = max(0.0, first_es - started - before)
+        # includes any work between Elasticsearch calls
+        processing = max(0.0, serialised_at - started - before - query_build - timings["es_wall"])
+
+    return {
+        "config": timings.get("config", 0.0),
+        "client": timings.get("client", 0.0),
+        "query_build": query_build,
+        "es_wall": timings["es_wall"],
+        "es_took": timings["es_took"],
+        "processing": processing,
+        "serialization": timings.get("serialization", 0.0),
+        "total": finished - started,
+    }
+
+
+def _log(route, status, stages, timings):
+    if stages["total"] < SLOW_REQUEST and random.random() >= LOG_SAMPLE_RATE:
+        return
+    logging.info(json.dumps({
+        "event": "request",
+        "route": route,
+        "status": status,
+        "args": request.args.to_dict(flat=False),
+        "es_calls": timings["es_calls"],
+        "ms": {name: round(seconds * 1000, 2) for name, seconds in stages.items()},
+    }))
+
+
+def timed(route):
+    """
+    Decorator recording the stage timings of every request to a handler under route
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            timings = {
+                "started": time.perf_counter(), "es_wall": 0.0, "es_took": 0.0, "es_calls": 0,
+                "first_es": None, "last_es": None,
+            }
+            request.environ[ENVIRON_KEY] = timings
+            status = 500
+            try:
+                response = handler(*args, **kwargs)
+                status = response[1] if isinstance(response, tuple) else getattr(response, "status_code", 200)
+                return response
+            finally:
+                finished = time.perf_counter()
+                stages = _stages(timings, finished)
+                with _lock:
+                    for name, seconds in stages.items():
+                        _observe(route, name, seconds)
+                    _requests[(route, status)] = _requests.get((route, status), 0) + 1
+                _log(route, status, stages, timings)
+                _maybe_flush()
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    with _lock:
+        return {
+            "histograms": {
+                f"{route}|{name}": dict(histogram, buckets=list(histogram["buckets"]))
+                for (route, name), histogram in _histograms.items()
+            },
+            "requests": {f"{route}|{status}": count for (route, status), count in _requests.items()},
+        }
+
+
+def _ensure_index(es):
+    global _index_ready
+    if _index_ready:
+        return
+    try:
+        es.indices.create(index=METRICS_INDEX, mappings={
+            "dynamic": False,
+            "properties": {"updated_at": {"type": "date"}}
+        })
+    except elasticsearch.BadRequestError as e:
+        if e.error != "resource_already_exists_exception":
+            raise
+    _index_ready = True
+
+
+def flush(es):
+    """
+    Writes this pod's cumulative histograms to METRICS_INDEX
+    """
+    global _last_flush
+    _last_flush = time.monotonic()
+    _ensure_index(es)
+    doc = snapshot()
+    doc["pod"] = POD_ID
+    doc["updated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    # stored as a string so the per-route keys don't grow the index mapping
+    es.index(index=METRICS_INDEX, id=POD_ID, document={
+        "pod": POD_ID, "updated_at": doc["updated_at"], "metrics": json.dumps(doc)
+    })
+
+
+def _maybe_flush():
+    """
+    Starts a background flush once FLUSH_INTERVAL has passed, so no request waits on Elasticsearch for it
+    """
+    global _last_flush, _flushing
+    with _lock:
+        if _flushing or time.monotonic() - _last_flush < FLUSH_INTERVAL:
+            return
+        _last_flush = time.monotonic()
+        _flushing = True
+    threading.Thread(target=_flush_in_background, name="metrics-flush", daemon=True).start()
+
+
+def _flush_in_background():
+    global _flushing
+    # imported here, es_client times its own config reads through this module
+    import es_client
+    try:
+        flush(es_client.get_client().options(request_timeout=FLUSH_TIMEOUT))
+    except Exception as e:
+        logging.warning("Failed to write request metrics: %s", e)
+    finally:
+        with _lock:
+            _flushing = False
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render(snapshots):
+    """
+    Adds up pod snapshots and renders them in the Prometheus text exposition format
+    """
+    histograms = {}
+    requests_total = {}
+    for snap in snapshots:
+        for key, histogram in snap["histograms"].items():
+            total = histograms.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            for i, count in enumerate(histogram["buckets"][:len(BUCKETS)]):
+                total["buckets"][i] += count
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+        for key, count in snap["requests"].items():
+            requests_total[key] = requests_total.get(key, 0) + count
+
+    lines = [
+        "# HELP api_request_stage_seconds Time spent in each stage of a request",
+        "# TYPE api_request_stage_seconds histogram",
+    ]
+    for key in sorted(histograms):
+        route, name = key.split("|", 1)
+        histogram = histograms[key]
+        labels = f'route="{_label(route)}",stage="{_label(name)}"'
+        for bound, count in zip(BUCKETS, histogram["buckets"]):
+            lines.append(f'api_request_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'api_request_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+        lines.append(f"api_request_stage_seconds_sum{{{labels}}} {histogram['sum']:.6f}")
+        lines.append(f"api_request_stage_seconds_count{{{labels}}} {histogram['count']}")
+
+    lines.append("# HELP api_requests_total Requests handled, by route and status")
+    lines.append("# TYPE api_requests_total counter")
+    for key in sorted(requests_total):
+        route, status = key.split("|", 1)
+        lines.append(f'api_requests_total{{route="{_label(route)}",status="{_label(status)}"}} {requests_total[key]}')
+
+    return "\n".join(lines) + "\n"
+
+
+def collect(es):
+    """
+    Snapshots of every pod that reported within METRICS_RETENTION, this one included
+    """
+    flush(es)
+    since = (datetime.datetime.now(datetime.timezone.utc) - METRICS_RETENTION).isoformat()
+    res = es.search(index=METRICS_INDEX, body={
+        "size": 1000,
+        "query": {"range": {"updated_at": {"gte": since}}},
+    })
+    return [json.loads(hit["_source"]["metrics"]) for hit in res["hits"]["hits"]]
@@ -0,0 +1,128 @@
+import os
+import logging
+import functools
+import threading
+from flask import Response
+
+# Protects Elasticsearch from bursts of traffic hitting one pod.
+#
+# single_flight coalesces identical requests that arrive while the first one is
+# still running, so a dashboard loaded by many clients at once costs one query.
+# admitted caps the queries a pod runs at once; callers beyond the limit queue
+# briefly and, once the queue is full or the wait too long, are turned away with
+# 503 and Retry-After instead of piling more load onto the cluster.
+#
+# Keep in sync with api/admission.py.
+
+# the query functions take requestsPerPod: 20 (see specs/), so by default a pod runs 8 of
+# them at once and queues the other 12. Fission sends requests beyond that to other pods.
+MAX_CONCURRENT = int(os.environ.get("API_MAX_CONCURRENT", 8))
+MAX_QUEUED = int(os.environ.get("API_MAX_QUEUED", 12))
+# seconds a queued request waits for a free slot before being shed
+QUEUE_TIMEOUT = float(os.environ.get("API_QUEUE_TIMEOUT", 5))
+RETRY_AFTER = int(os.environ.get("API_RETRY_AFTER", 2))
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT)
+_queued = 0
+_in_flight = {}
+stats = {"admitted": 0, "queued": 0, "shed": 0, "coalesced": 0}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def single_flight(key, compute):
+    """
+    Returns compute()'s result. Callers arriving with the same key while it runs wait for
+    and share that result (or exception) instead of computing it again.
+    """
+    with _lock:
+        call = _in_flight.get(key)
+        leader = call is None
+        if leader:
+            call = _in_flight[key] = _Call()
+        else:
+            stats["coalesced"] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = compute()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _lock:
+            del _in_flight[key]
+        call.done.set()
+
+
+def _acquire():
+    global _queued
+    if _slots.acquire(blocking=False):
+        return
+
+    with _lock:
+        if _queued >= MAX_QUEUED:
+            stats["shed"] += 1
+            raise Overloaded()
+        _queued += 1
+        stats["queued"] += 1
+    try:
+        acquired = _slots.acquire(timeout=QUEUE_TIMEOUT)
+    finally:
+        with _lock:
+            _queued -= 1
+
+    if not acquired:
+        with _lock:
+            stats["shed"] += 1
+        raise Overloaded()
+
+
+def admitted(compute):
+    """
+    Runs compute() once a concurrency slot is free. Raises Overloaded if the request
+    had to be shed.
+    """
+    _acquire()
+    stats["admitted"] += 1
+    try:
+        return compute()
+    finally:
+        _slots.release()
+
+
+def overloaded_response():
+    return Response(
+        "Error: too many requests in progress, retry shortly", status=503,
+        headers={"Retry-After": str(RETRY_AFTER)}
+    )
+
+
+def sheds_load(handler):
+    """
+    Decorator for handlers turning Overloaded into a 503 response with Retry-After
+    """
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        except Overloaded:
+            logging.warning("Shedding %s, %d requests queued", handler.__name__, _queued)
+            return overloaded_response()
+    return wrapper
@@ -0,0 +1,342 @@
+import os
+import time
+import logging
+import datetime
+import elasticsearch
+import rollups
+
+# Reads the compact traffic layout, written by the traffic harvester when
+# TRAFFIC_STORAGE=daily: one document per segment per (local) day in DAILY_INDEX,
+# holding that day's observations as parallel arrays (times, actualTravelTime,
+# averageSpeed, congestionIndex) next to the segment's keyword fields.
+#
+# The harvester marks DAILY_INDEX as harvested in its mapping's _meta while it writes
+# there instead of traffic-data, and every traffic reader follows that mark (see
+# enabled), so the layout is only configured on the harvester.
+#
+# Statistics over whole days are aggregated straight from the arrays' doc values.
+# Days only partly inside a window are aggregated through runtime fields that
+# shadow the metric arrays with just their in-window values, so every statistic
+# stays exact and is still computed by Elasticsearch.
+#
+# Keep DAILY_INDEX and the document layout in sync with harvesters/traffic/traffic_harvester.py.
+
+DAILY_INDEX = "traffic-daily"
+# seconds between reads of the harvested mark
+CHECK_INTERVAL = float(os.environ.get("API_TRAFFIC_LAYOUT_CHECK_INTERVAL", 60))
+METRIC_FIELDS = ("congestionIndex", "actualTravelTime", "averageSpeed")
+TIMES_FIELD = "times"
+PY_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+PY_DATE_FORMAT = "%Y-%m-%d"
+# upper bound on the groups (segments, freeways) of one aggregation
+MAX_GROUPS = 1000
+# documents read per page when looking for the worst observation
+WORST_PAGE_SIZE = 20
+# documents read per page when reading single observations
+OBSERVATIONS_PAGE_SIZE = 500
+
+# {"layout": (checked_at, harvested)}
+_store = {}
+
+# emits the values of params.field observed in [params.start, params.end), either bound may be null.
+# times are stored as local yyyy-MM-ddTHH:mm:ss strings, which sort chronologically.
+IN_WINDOW_SCRIPT = """
+def times = params._source.times;
+def values = params._source[params.field];
+if (times == null || values == null) { return; }
+for (int i = 0; i < times.size() && i < values.size(); i++) {
+    String time = times[i];
+    if (values[i] == null) { continue; }
+    if (params.start != null && time.compareTo(params.start) < 0) { continue; }
+    if (params.end != null && time.compareTo(params.end) >= 0) { continue; }
+    emit(((Number) values[i]).doubleValue());
+}
+"""
+
+
+def enabled(es):
+    """
+    Whether the harvester writes this layout, i.e. DAILY_INDEX exists and is marked harvested.
+    Checked at most every CHECK_INTERVAL seconds, the last answer is kept while Elasticsearch
+    is unavailable.
+    """
+    now = time.monotonic()
+    cached = _store.get("layout")
+    if cached is not None and now - cached[0] < CHECK_INTERVAL:
+        return cached[1]
+    try:
+        mapping = es.indices.get_mapping(index=DAILY_INDEX)
+        harvested = any(index.get("mappings", {}).get("_meta", {}).get("harvested") is True
+                        for index in mapping.values())
+    except elasticsearch.NotFoundError:
+        harvested = False
+    except Exception:
+        if cached is not None:
+            return cached[1]
+        raise
+    if cached is None or cached[1] != harvested:
+        logging.info("Reading traffic observations from %s", DAILY_INDEX if harvested else "traffic-data")
+    _store["layout"] = (now, harvested)
+    return harvested
+
+
+def reset():
+    _store.clear()
+
+
+def _floor_day(dt):
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_day(dt):
+    floored = _floor_day(dt)
+    return dt if floored == dt else floored + datetime.timedelta(days=1)
+
+
+def plan(start, end):
+    """
+    Splits the local window [start, end) into (first_day, last_day, start, end) pieces: documents
+    dated [first_day, last_day) and, for days only partly in the window, the time bounds their
+    values are filtered on (None for whole days). Any bound may be None for an open window.
+    """
+    first_full = None if start is None else _ceil_day(start)
+    last_full = None if end is None else _floor_day(end)
+    if first_full is not None and last_full is not None and first_full > last_full:
+        # the window lies within a single day
+        day = _floor_day(start)
+        return [(day, day + datetime.timedelta(days=1), start, end)]
+
+    pieces = []
+    if start is not None and start < first_full:
+        pieces.append((_floor_day(start), first_full, start, None))
+    if first_full is None or last_full is None or first_full < last_full:
+        pieces.append((first_full, last_full, None, None))
+    if end is not None and last_full < end:
+        pieces.append((last_full, last_full + datetime.timedelta(days=1), None, end))
+    return pieces
+
+
+def _format(dt, fmt):
+    return dt.strftime(fmt) if dt is not None else None
+
+
+def _filter(field, value):
+    if isinstance(value, (list, tuple, set)):
+        return {"terms": {field: list(value)}}
+    return {"term": {field: value}}
+
+
+def window_fields(start, end):
+    """
+    Runtime fields shadowing every metric array with its values in [start, end)
+    """
+    return {
+        field: {
+            "type": "double",
+            "script": {
+                "source": IN_WINDOW_SCRIPT,
+                "params": {"field": field, "start": _format(start, PY_TIME_FORMAT), "end": _format(end, PY_TIME_FORMAT)},
+            },
+        }
+        for field in METRIC_FIELDS
+    }
+
+
+def search_body(filters, piece, aggs=None, size=0):
+    """
+    Search over the documents of one plan piece, with the metric fields limited to the piece's window
+    """
+    first_day, last_day, start, end = piece
+    conditions = [_filter(field, value) for field, value in filters.items()]
+    if first_day is not None or last_day is not None:
+        days = {"format": "yyyy-MM-dd"}
+        if first_day is not None:
+            days["gte"] = _format(first_day, PY_DATE_FORMAT)
+        if last_day is not None:
+            days["lt"] = _format(last_day, PY_DATE_FORMAT)
+        conditions.append({"range": {"date": days}})
+
+    body = {"size": size, "query": {"bool": {"filter": conditions}}}
+    if aggs:
+        body["aggs"] = aggs
+    if start is not None or end is not None:
+        body["runtime_mappings"] = window_fields(start, end)
+    return body
+
+
+def _group_agg(group_by, metrics):
+    if isinstance(group_by, (list, tuple)):
+        return {"multi_terms": {"terms": [{"field": field} for field in group_by], "size": MAX_GROUPS}, "aggs": metrics}
+    return {"terms": {"field": group_by, "size": MAX_GROUPS}, "aggs": metrics}
+
+
+def _group_key(group_by, bucket):
+    return tuple(bucket["key"]) if isinstance(group_by, (list, tuple)) else str(bucket["key"])
+
+
+def merge(total, stats):
+    """
+    Adds one piece's count/sum/min/max per field into total, as rollups does
+    """
+    for field, s in stats.items():
+        t = total.setdefault(field, {"count": 0, "sum": 0, "min": None, "max": None})
+        t["count"] += s["count"]
+        t["sum"] += s["sum"] or 0
+        if s["min"] is not None:
+            t["min"] = s["min"] if t["min"] is None else min(t["min"], s["min"])
+        if s["max"] is not None:
+            t["max"] = s["max"] if t["max"] is None else max(t["max"], s["max"])
+
+
+def summarise(es, filters, start=None, end=None, group_by=None):
+    """
+    count/sum/min/max of every metric field over the observations matching filters in the local
+    window [start, end), in the shape rollups.summarise returns. filters maps keyword fields
+    (freewayName, segmentName, segmentId) to a value or list of values. group_by is a field, or
+    a tuple of fields whose groups are keyed by tuples of their values.
+    """
+    metrics = {field: {"stats": {"field": field}} for field in METRIC_FIELDS}
+    aggs = {"groups": _group_agg(group_by, metrics)} if group_by else metrics
+
+    pieces = plan(start, end)
+    searches = []
+    for piece in pieces:
+        searches.extend([{"index": DAILY_INDEX}, search_body(filters, piece, aggs)])
+
+    groups = {}
+    for res in es.msearch(searches=searches)["responses"]:
+        if "error" in res:
+            raise rollups.SearchError(res)
+        if group_by:
+            for bucket in res["aggregations"]["groups"]["buckets"]:
+                merge(groups.setdefault(_group_key(group_by, bucket), {}), _stats(bucket))
+        else:
+            merge(groups.setdefault(None, {}), _stats(res["aggregations"]))
+    return groups
+
+
+def _stats(aggs):
+    return {
+        field: {key: aggs[field][key] for key in ("count", "sum", "min", "max")}
+        for field in METRIC_FIELDS
+    }
+
+
+def field_values(es, filters, start, end, aggs):
+    """
+    Results of arbitrary metric aggregations (e.g. field_stats.build_aggs) over the observations
+    matching filters in [start, end), in one search over every day the window touches
+    """
+    first_day = None if start is None else _floor_day(start)
+    last_day = None if end is None else _ceil_day(end)
+    body = search_body(filters, (first_day, last_day, start, end), aggs)
+    return es.search(index=DAILY_INDEX, body=body).body["aggregations"]
+
+
+def observations(es, filters, start, end, fields):
+    """
+    Yields (document, time, values) for every observation matching filters in the local window
+    [start, end), values mapping each of the metric fields to its value. For reads that need
+    single observations, e.g. time buckets finer than a day, documents are paged through by
+    segment and day.
+    """
+    first_day = None if start is None else _floor_day(start)
+    last_day = None if end is None else _ceil_day(end)
+    body = search_body(filters, (first_day, last_day, None, None), size=OBSERVATIONS_PAGE_SIZE)
+    body["sort"] = [{"segmentId": "asc"}, {"date": "asc"}]
+    body["_source"] = ["segmentId", "freewayName", "segmentName", TIMES_FIELD] + list(fields)
+    start, end = _format(start, PY_TIME_FORMAT), _format(end, PY_TIME_FORMAT)
+
+    while True:
+        hits = es.search(index=DAILY_INDEX, body=body)["hits"]["hits"]
+        for hit in hits:
+            source = hit["_source"]
+            arrays = [source.get(field) or [] for field in fields]
+            for i, published in enumerate(source.get(TIMES_FIELD) or []):
+                if (start and published < start) or (end and published >= end):
+                    continue
+                yield source, published, {field: values[i] if i < len(values) else None
+                                     for field, values in zip(fields, arrays)}
+        if len(hits) < OBSERVATIONS_PAGE_SIZE:
+            break
+        body["search_after"] = hits[-1]["sort"]
+
+
+def _worst_in(source, start, end):
+    # (congestionIndex, index) of the most congested in-window observation of a daily document
+    start, end = _format(start, PY_TIME_FORMAT), _format(end, PY_TIME_FORMAT)
+    best = None
+    for i, (time, value) in enumerate(zip(source.get(TIMES_FIELD) or [], source.get("congestionIndex") or [])):
+        if value is None or (start and time < start) or (end and time >= end):
+            continue
+        if best is None or value > best[0]:
+            best = (value, i)
+    return best
+
+
+def worst_observations(es, segment_filters, start=None, end=None):
+    """
+    The most congested observation in [start, end) for each of segment_filters (filters as for
+    summarise, usually one segment each), as dicts like a traffic-data _source, or None.
+    Documents are read most congested day first, until no remaining day can beat the best
+    in-window observation found.
+    """
+    first_day = None if start is None else _floor_day(start)
+    last_day = None if end is None else _ceil_day(end)
+
+    results = [None] * len(segment_filters)
+    pending = list(range(len(segment_filters)))
+    offset = 0
+    while pending:
+        searches = []
+        for i in pending:
+            body = search_body(segment_filters[i], (first_day, last_day, None, None), size=WORST_PAGE_SIZE)
+            body["from"] = offset
+            body["sort"] = [{"congestionIndex": {"order": "desc", "mode": "max"}}]
+            body["_source"] = ["segmentId", "freewayName", "segmentName", TIMES_FIELD,
+                               "congestionIndex", "actualTravelTime"]
+            searches.extend([{"index": DAILY_INDEX}, body])
+
+        still_pending = []
+        for i, res in zip(pending, es.msearch(searches=searches)["responses"]):
+            if "error" in res:
+                raise rollups.SearchError(res)
+            hits = res["hits"]["hits"]
+            done = len(hits) < WORST_PAGE_SIZE
+            for hit in hits:
+                best = results[i]
+                if best is not None and hit["sort"][0] is not None and hit["sort"][0] <= best["congestionIndex"]:
+                    # no later day can beat it
+                    done = True
+                    break
+                found = _worst_in(hit["_source"], start, end)
+                if found is not None and (best is None or found[0] > best["congestionIndex"]):
+                    source = hit["_source"]
+                    results[i] = {
+                        "segmentId": source.get("segmentId"),
+                        "freewayName": source.get("freewayName"),
+                        "segmentName": source.get("segmentName"),
+                        "publishedTime": source[TIMES_FIELD][found[1]],
+                        "congestionIndex": found[0],
+                        "actualTravelTime": (source.get("actualTravelTime") or [None] * (found[1] + 1))[found[1]],
+                    }
+            if not done:
+                still_pending.append(i)
+        pending = still_pending
+        offset += WORST_PAGE_SIZE
+    return results
+
+
+def observation_counts(es, field, filters=None, size=MAX_GROUPS):
+    """
+    Number of observations per value of field, as terms buckets ({"key", "doc_count"}) like a
+    terms aggregation over the per-observation layout gives
+    """
+    query = {
+        "size": 0,
+        "aggs": {"groups": {"terms": {"field": field, "size": size}, "aggs": {"observations": {"sum": {"field": "count"}}}}}
+    }
+    if filters:
+        query["query"] = {"bool": {"filter": [_filter(name, value) for name, value in filters.items()]}}
+    buckets = es.search(index=DAILY_INDEX, body=query).body["aggregations"]["groups"]["buckets"]
+    return [{"key": bucket["key"], "doc_count": int(bucket["observations"]["value"] or 0)} for bucket in buckets]
@@ -1,47 +1,98 @@
 import logging
 import utils
+import rollups
+import daily
+import geometries
+import geo
+import field_stats
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 
-def create_simplified_response(res):
+# numeric observation fields callers can request statistics for with ?fields=&stats=
+METRIC_FIELDS = ("congestionIndex", "actualTravelTime", "averageSpeed")
+
+# per-segment statistics, evaluated by Elasticsearch or from the rollups (see rollups.metric_values)
+SEGMENT_AGGS = {
+    "max_congestion_index": {"max": {"field": "congestionIndex"}},
+    "avg_congestion_index": {"avg": {"field": "congestionIndex"}},
+    "avg_travel_time": {"avg": {"field": "actualTravelTime"}},
+    "max_travel_time": {"max": {"field": "actualTravelTime"}},
+    "avg_speed": {"avg": {"field": "averageSpeed"}},
+    "min_speed": {"min": {"field": "averageSpeed"}},
+}
+
+# upper bound on the segments of one freeway, far above the largest VicRoads freeway
+MAX_SEGMENTS = 500
+# upper bound on the freeways listed, VicRoads publishes a few dozen
+MAX_FREEWAYS = 200
+# length of the worst segments ranking in the network summary
+DEFAULT_TOP_SEGMENTS = 10
+MAX_TOP_SEGMENTS = 100
+
+# the most congested observation in a bucket, see worst_fields
+WORST_OBSERVATION_AGG = {
+    "top_hits": {
+        "size": 1,
+        "sort": [{"congestionIndex": "desc"}],
+        "_source": ["segmentId", "segmentName", "actualTravelTime"]
+    }
+}
+
+def worst_fields(es, freeway_name, worst):
     '''
-    Function that helps create a simplified response for the api to output
+    Travel time and segment id of the most congested observation, given its _source (or None).
+    The segment's geometry is served by /traffic-segments, see geometries.py.
     '''
-    try:
-        max_congestion = res['max_congestion']['value']
-    except (KeyError, TypeError):
-        max_congestion = None
+    worst = worst or {}
+    segment_id = worst.get('segmentId', None)
+    if segment_id is None and worst.get('segmentName') is not None:
+        # observations harvested before segment ids were stored
+        segment_id = geometries.segment_id(es, freeway_name, worst['segmentName'])
 
-    try:
-        segment = res['top_segments']['buckets'][0]
-        segment_name = segment['top_hit']['hits']['hits'][0]['_source']['segmentName']
-        actual_travel_time = segment['top_hit']['hits']['hits'][0]['_source']['actualTravelTime']
-        geometry = segment['top_hit']['hits']['hits'][0]['_source'].get('geometry', None)
-        if geometry is not None:
-            geometry_type = geometry.get('type', 'None')
-            coordinates = geometry.get('coordinates', [])
-        else:
-            geometry_type = 'None'
-            coordinates = []
-    except (IndexError, KeyError, TypeError):
-        segment_name = None
-        actual_travel_time = None
-        geometry_type = 'None'
-        coordinates = []
+    return {
+        "actual_travel_time": worst.get('actualTravelTime', None),
+        "segment_id": segment_id,
+    }
+
+
+def with_segment_ids(es, freeway_name, segments):
+    for segment in segments:
+        segment["segment_id"] = geometries.segment_id(es, freeway_name, segment["segment_name"])
+    return segments
+
+
+def create_simplified_response(es, freeway_name, segments, worst):
+    '''
+    Function that helps create a simplified response for the api to output. segments are
+    the per-segment statistics, most congested first, and worst the _source of the most
+    congested observation (or None).
+    '''
+    segments = with_segment_ids(es, freeway_name, segments)
+    fields = worst_fields(es, freeway_name, worst)
+    if fields["segment_id"] is None and segments:
+        # the worst observation is on the most congested segment
+        fields["segment_id"] = segments[0]["segment_id"]
 
     simplified_response = {
-        "max_congestion_index": max_congestion,
-        "segment_name": segment_name,
-        "actual_travel_time": actual_travel_time,
-        "geometry_type": geometry_type,
-        "coordinates": coordinates
+        "max_congestion_index": segments[0]["max_congestion_index"] if segments else None,
+        "segment_name": segments[0]["segment_name"] if segments else None,
+        **fields,
+        "segments": segments,
     }
 
     return simplified_response
 
-def get_freeways(es):
-    
+def get_freeways(es, bbox=None, near=None, radius=None):
+    '''
+    Every freeway with its observation count, or only those crossing the area given by bbox or
+    near/radius (see geo.parse)
+    '''
+    try:
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+
     # distinct stations
     query = {
         "size": 0,  # We do not want any documents, just aggregations
@@ -49,18 +100,25 @@ def get_freeways(es):
             "unique_freewayNames": {
                 "terms": {
                     "field": "freewayName.keyword",
-                    "size": 10  
+                    "size": MAX_FREEWAYS
                 }
             }
         }
     }
 
+    if area:
+        names = sorted({segment["freewayName"] for segment in geometries.in_area(es, area)})
+        if not names:
+            return {"freeways": [], "area": geo.describe(area)}
+        query["query"] = {"bool": {"filter": [{"terms": {"freewayName.keyword": names}}]}}
+
     logging.info("Executing Elasticsearch query...")
-    res = es.search(index="traffic-data", body=query)
-    logging.debug("Elasticsearch response: %s", res)
-    
-    results = res["aggregations"]["unique_freewayNames"]["buckets"]
-    logging.debug("Aggregation results: %s", results)
+    if daily.enabled(es):
+        results = daily.observation_counts(es, "freewayName", {"freewayName": names} if area else None,
+                                           size=MAX_FREEWAYS)
+    else:
+        res = es.search(index="traffic-data", body=query)
+        results = res["aggregations"]["unique_freewayNames"]["buckets"]
 
     for item in results:
         # Modify the "key" field by replacing spaces with underscores
@@ -70,110 +128,410 @@ def get_freeways(es):
     # freeways = [result["key"] for result in results]
     # logging.info("Found freeways: %s", freeways)
 
+    if area:
+        return {"freeways": results, "area": geo.describe(area)}
     return {"freeways": results}
 
     
 
 
-def aggregate_observations(es, freeway, year=None, month=None, day=None, hour=None):
-    
-    # freeway will be in the format of 'Monash_Fwy' change back to 'Monash Fwy'
-    freeway = freeway.split('_')
-    print("FreewayName is", freeway[0])
-    
-    # Define the query
-    
+def freeway_metrics(es, freeway_name, selection, start, end, segment_names=None):
+    '''
+    Caller-selected statistics (see field_stats) over every observation of the freeway in the window
+    '''
+    if daily.enabled(es):
+        if field_stats.from_rollups(selection, "traffic-data"):
+            stats = daily.summarise(es, rollup_filters(freeway_name, segment_names), start, end)
+            return field_stats.summary_values(stats.get(None), selection)
+        res = daily.field_values(es, rollup_filters(freeway_name, segment_names), start, end,
+                                 field_stats.build_aggs(selection))
+        return field_stats.values(res, selection)
+
+    if field_stats.from_rollups(selection, "traffic-data"):
+        stats = rollups.summarise(es, "traffic-data", rollup_filters(freeway_name, segment_names), start, end)
+        return field_stats.summary_values(stats.get(None), selection)
+
+    # deviations and percentiles can't be rebuilt from the rollups, read the raw observations
+    query = {
+        "size": 0,
+        "query": {"bool": {"filter": freeway_filters(freeway_name, start, end, segment_names)}},
+        "aggs": field_stats.build_aggs(selection)
+    }
+
+    res = es.search(index="traffic-data", body=query).body['aggregations']
+    return field_stats.values(res, selection)
+
+
+def freeway_filters(freeway_name, start, end, segment_names=None):
+    # exact, unscored match on the whole freeway name
+    filters = [{"term": {"freewayName.keyword": freeway_name}}]
+    if segment_names is not None:
+        # only the segments inside the requested area
+        filters.append({"terms": {"segmentName.keyword": segment_names}})
+    if start is not None or end is not None:
+        # publishedTime holds Melbourne local time
+        filters.append(utils.range_filter("publishedTime", start, end))
+    return filters
+
+
+def rollup_filters(freeway_name, segment_names=None):
+    # keyword filters of the rollups and the daily documents
+    filters = {"freewayName": freeway_name}
+    if segment_names is not None:
+        filters["segmentName"] = segment_names
+    return filters
+
+
+def worst_search(freeway_name, start, end, segment_names=None):
+    '''
+    Search for the most congested observation of the freeway in the window, see worst_source
+    '''
+    return {
+        "size": 1,
+        # lets Elasticsearch skip the documents that can't be the top hit
+        "track_total_hits": False,
+        "query": {"bool": {"filter": freeway_filters(freeway_name, start, end, segment_names)}},
+        "sort": [{"congestionIndex": "desc"}],
+        "_source": ["segmentId", "segmentName", "actualTravelTime"],
+    }
+
+
+def worst_source(res):
+    '''
+    _source of the hit of a worst_search response from a multi-search, or None
+    '''
+    if "error" in res:
+        raise rollups.SearchError(res)
+    hits = res["hits"]["hits"]
+    return hits[0]["_source"] if hits else None
+
+
+def sort_segments(segments):
+    # most congested first, segments without observations last
+    return sorted(segments, key=lambda segment: (segment["max_congestion_index"] is None,
+                                                 -(segment["max_congestion_index"] or 0)))
+
+
+def aggregate_from_rollups(es, freeway_name, start, end, segment_names=None):
+    '''
+    Per-segment statistics from the hourly/daily rollups, plus the worst observation of the most
+    congested segment, in one multi-search. Returns the same as aggregate_segments.
+    '''
+    filters = rollup_filters(freeway_name, segment_names)
+    pieces, searches = rollups.summary_searches(es, "traffic-data", filters, start, end, group_by="segmentName")
+    # the freeway's most congested observation is on its most congested segment
+    searches.extend([{"index": "traffic-data"}, worst_search(freeway_name, start, end, segment_names)])
+    responses = es.msearch(searches=searches)["responses"]
+
+    stats = rollups.summary_groups(es, "traffic-data", filters, pieces, responses[:-1], group_by="segmentName")
+    segments = sort_segments([
+        dict(segment_name=name, observations=summary["congestionIndex"]["count"],
+             **rollups.metric_values(SEGMENT_AGGS, summary))
+        for name, summary in stats.items()
+    ])
+    if not segments or segments[0]["max_congestion_index"] is None:
+        return segments, None
+
+    return segments, worst_source(responses[-1])
+
+
+def aggregate_from_daily(es, freeway_name, start, end, segment_names=None):
+    '''
+    Per-segment statistics from the per-segment daily documents (see daily.py), plus the worst
+    observation of the most congested segment. Returns the same as aggregate_segments.
+    '''
+    filters = rollup_filters(freeway_name, segment_names)
+    stats = daily.summarise(es, filters, start, end, group_by="segmentName")
+    segments = sort_segments([
+        dict(segment_name=name, observations=summary["congestionIndex"]["count"],
+             **rollups.metric_values(SEGMENT_AGGS, summary))
+        for name, summary in stats.items()
+    ])
+    if not segments or segments[0]["max_congestion_index"] is None:
+        return segments, None
+
+    worst_filter = dict(filters, segmentName=segments[0]["segment_name"])
+    return segments, daily.worst_observations(es, [worst_filter], start, end)[0]
+
+
+def aggregate_segments(es, freeway_name, start, end, segment_names=None):
+    '''
+    Every segment of the freeway with its statistics, most congested first, and the _source of
+    the worst observation on the most congested one, in a single search
+    '''
     query = {
         "size": 0,  # We don't need any documents outside of our aggregations
-        "query": {
-            "bool": {
-                "must": [
-                    {"match": {"freewayName": freeway[0]}}
-                ]
-            }
-        },
+        "query": {"bool": {"filter": freeway_filters(freeway_name, start, end, segment_names)}},
         "aggs": {
-            "max_congestion": {
-                "max": {
-                    "field": "congestionIndex"
-                }
-            },
-            "top_segments": {
+            "segments": {
                 "terms": {
-                    "field": "congestionIndex",
-                    "size": 1,
-                    "order": {
-                        "max_congestion": "desc"
-                    }
+                    "field": "segmentName.keyword",
+                    "size": MAX_SEGMENTS,
+                    "order": {"max_congestion_index": "desc"}
                 },
-                "aggs": {
-                    "max_congestion": {
-                        "max": {
-                            "field": "congestionIndex"
-                        }
-                    },
-                    "top_hit": {
-                        "top_hits": {
-                            "size": 1,
-                            "_source": {
-                                "includes": ["segmentName", "actualTravelTime", "geometry"]
-                            }
-                        }
-                    }
-                }
+                "aggs": dict(SEGMENT_AGGS, worst=WORST_OBSERVATION_AGG)
             }
         }
     }
 
-        
-    if month:
-        try:
-            month = int(month)
-        except ValueError:
-            return {"error": "month must be an integer"}
-        
-    if day:
-        try:
-            day = int(day)
-        except ValueError:
-            return {"error": "day must be an integer"}
-    
-    if hour:
-        try:
-            hour = int(hour)
-        except ValueError:
-            return {"error": "hour must be an integer"}
-        
-    if year:
-        try:
-            year = int(year)
-            start_date, end_date = utils.get_date_limits(year, month, day, hour)
-            query["query"]["bool"]["must"].append({
-                "range": {
-                    "publishedTime": {
-                        "gte": start_date,
-                        "lte": end_date,
-                        "format": "yyyy-MM-dd'T'HH:mm:ss"
-                    }
-                }
-            })
-        except ValueError:
-            return {"error": "year must be an integer"}
-    
+    logging.info("Executing Elasticsearch query...")
+    buckets = es.search(index="traffic-data", body=query).body['aggregations']['segments']['buckets']
 
+    segments = sort_segments([
+        dict(segment_name=bucket["key"], observations=bucket["doc_count"],
+             **{name: bucket[name]["value"] for name in SEGMENT_AGGS})
+        for bucket in buckets
+    ])
+    worst = None
+    if segments:
+        worst_bucket = next(bucket for bucket in buckets if bucket["key"] == segments[0]["segment_name"])
+        hits = worst_bucket["worst"]["hits"]["hits"]
+        worst = hits[0]["_source"] if hits else None
+    return segments, worst
 
-    print(query)
 
-    logging.info("Executing Elasticsearch query...")
-    # Execute the query
-    res = es.search(index="traffic-data", body=query).body['aggregations']
+def aggregate_observations(es, freeway, year=None, month=None, day=None, hour=None, fields=None, stats=None,
+                           start=None, end=None, last=None, bbox=None, near=None, radius=None):
+    '''
+    Statistics for every segment of the freeway in the window, most congested first, along with
+    the most congested segment's worst observation. The window is a calendar period, start/end
+    or last (see utils.resolve_window). fields and stats additionally return the selected
+    statistics over the whole freeway under "metrics". bbox or near/radius (see geo.parse)
+    restrict all of it to the segments crossing that area.
+    '''
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        selection = field_stats.parse(fields, stats, METRIC_FIELDS, METRIC_FIELDS)
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
 
-    # print(res)
+    # freeway will be in the format of 'Monash_Fwy' change back to 'Monash Fwy'
+    freeway_name = freeway.replace('_', ' ')
+    start, end = utils.window_bounds(window)
+
+    segment_names = None
+    if area:
+        segment_names = sorted(segment["segmentName"] for segment in geometries.in_area(es, area)
+                               if segment["freewayName"] == freeway_name)
 
-    logging.info("Query executed successfully")
+    if segment_names == []:
+        segments, worst = [], None
+    elif daily.enabled(es):
+        segments, worst = aggregate_from_daily(es, freeway_name, start, end, segment_names)
+    elif rollups.ENABLED:
+        segments, worst = aggregate_from_rollups(es, freeway_name, start, end, segment_names)
+    else:
+        segments, worst = aggregate_segments(es, freeway_name, start, end, segment_names)
 
-    simplified_response = create_simplified_response(res)
+    simplified_response = create_simplified_response(es, freeway_name, segments, worst)
+    if selection:
+        simplified_response["metrics"] = freeway_metrics(es, freeway_name, selection, start, end, segment_names)
+    if area:
+        simplified_response["area"] = geo.describe(area)
 
     logging.info("Response generated successfully")
 
-    return simplified_response
\ No newline at end of file
+    return simplified_response
+
+
+def bucket_stats(bucket):
+    return {name: bucket[name]["value"] for name in SEGMENT_AGGS}
+
+
+def network_from_stats(es, stats, top, inside, worst_observations):
+    '''
+    The freeways and worst segments of network_summary from per-segment stats keyed by
+    (freewayName, segmentName), limited to the segments inside (as geometries.in_area gives them)
+    if not None. worst_observations(filters) gives the worst observation of each freeway filter.
+    '''
+    if inside is not None:
+        # segment names are only unique within a freeway
+        pairs = {(segment["freewayName"], segment["segmentName"]) for segment in inside}
+        stats = {key: summary for key, summary in stats.items() if key in pairs}
+
+    # freeway statistics are the sum of their segments'
+    totals, segment_counts = {}, {}
+    for (freeway_name, _), summary in stats.items():
+        daily.merge(totals.setdefault(freeway_name, {}), summary)
+        segment_counts[freeway_name] = segment_counts.get(freeway_name, 0) + 1
+
+    # the same order as the terms aggregation, busiest freeway first
+    names = sorted(totals, key=lambda name: (-totals[name]["congestionIndex"]["count"], name))[:MAX_FREEWAYS]
+    worst_filters = []
+    for name in names:
+        worst_filter = {"freewayName": name}
+        if inside is not None:
+            worst_filter["segmentName"] = sorted(segment for freeway_name, segment in stats if freeway_name == name)
+        worst_filters.append(worst_filter)
+    worsts = worst_observations(worst_filters) if names else []
+
+    freeways = [
+        {
+            "key": name.replace(' ', '_'),
+            "doc_count": totals[name]["congestionIndex"]["count"],
+            "segments": segment_counts[name],
+            **rollups.metric_values(SEGMENT_AGGS, totals[name]),
+            "segment_name": worst.get("segmentName") if worst else None,
+            **worst_fields(es, name, worst),
+        }
+        for name, worst in zip(names, worsts)
+    ]
+
+    ranked = sort_segments([
+        dict(key=key, observations=summary["congestionIndex"]["count"],
+             **rollups.metric_values(SEGMENT_AGGS, summary))
+        for key, summary in stats.items()
+    ])[:top]
+    worst_segments = [
+        {
+            "freeway": segment["key"][0].replace(' ', '_'),
+            "segment_name": segment["key"][1],
+            "segment_id": geometries.segment_id(es, segment["key"][0], segment["key"][1]),
+            "observations": segment["observations"],
+            **{name: segment[name] for name in SEGMENT_AGGS},
+        }
+        for segment in ranked
+    ]
+    return freeways, worst_segments
+
+
+def network_filters(inside):
+    # keyword filters of the rollups and the daily documents covering the segments inside, or all of them
+    if inside is None:
+        return {}
+    return {"freewayName": sorted({segment["freewayName"] for segment in inside}),
+            "segmentName": sorted({segment["segmentName"] for segment in inside})}
+
+
+def network_from_daily(es, top, start, end, inside=None):
+    '''
+    The freeways and worst segments of network_summary from the per-segment daily documents (see daily.py)
+    '''
+    stats = daily.summarise(es, network_filters(inside), start, end, group_by=("freewayName", "segmentName"))
+    return network_from_stats(es, stats, top, inside, lambda filters: daily.worst_observations(es, filters, start, end))
+
+
+def network_from_rollups(es, top, start, end, inside=None):
+    '''
+    The freeways and worst segments of network_summary from the hourly/daily rollups, with the
+    worst observation of every freeway read in one multi-search
+    '''
+    stats = rollups.summarise(es, "traffic-data", network_filters(inside), start, end,
+                              group_by=("freewayName", "segmentName"))
+
+    def worst_observations(filters):
+        searches = []
+        for worst_filter in filters:
+            searches.extend([{"index": "traffic-data"},
+                             worst_search(worst_filter["freewayName"], start, end, worst_filter.get("segmentName"))])
+        return [worst_source(res) for res in es.msearch(searches=searches)["responses"]]
+
+    return network_from_stats(es, stats, top, inside, worst_observations)
+
+
+def network_from_search(es, top, start, end, inside=None):
+    '''
+    The freeways and worst segments of network_summary from a single search of the raw observations
+    '''
+    query = {
+        "size": 0,
+        "aggs": {
+            "freeways": {
+                "terms": {"field": "freewayName.keyword", "size": MAX_FREEWAYS},
+                "aggs": dict(
+                    SEGMENT_AGGS,
+                    segments={"cardinality": {"field": "segmentName.keyword"}},
+                    worst=WORST_OBSERVATION_AGG,
+                )
+            },
+            "worst_segments": {
+                "multi_terms": {
+                    "terms": [{"field": "freewayName.keyword"}, {"field": "segmentName.keyword"}],
+                    "size": top,
+                    "order": {"max_congestion_index": "desc"}
+                },
+                "aggs": SEGMENT_AGGS
+            }
+        }
+    }
+    filters = []
+    if start is not None or end is not None:
+        filters.append(utils.range_filter("publishedTime", start, end))
+    if inside is not None:
+        # segment names are only unique within a freeway
+        filters.append({"bool": {"minimum_should_match": 1, "should": [
+            {"bool": {"filter": [{"term": {"freewayName.keyword": segment["freewayName"]}},
+                                 {"term": {"segmentName.keyword": segment["segmentName"]}}]}}
+            for segment in inside
+        ]}})
+    if filters:
+        query["query"] = {"bool": {"filter": filters}}
+
+    logging.info("Executing network summary query...")
+    res = es.search(index="traffic-data", body=query).body['aggregations']
+
+    freeways = []
+    for bucket in res["freeways"]["buckets"]:
+        hits = bucket["worst"]["hits"]["hits"]
+        worst = hits[0]["_source"] if hits else None
+        freeways.append({
+            # same key as get_freeways, usable in /traffic-freeway/{freewayName}
+            "key": bucket["key"].replace(' ', '_'),
+            "doc_count": bucket["doc_count"],
+            "segments": bucket["segments"]["value"],
+            **bucket_stats(bucket),
+            "segment_name": worst.get("segmentName") if worst else None,
+            **worst_fields(es, bucket["key"], worst),
+        })
+
+    worst_segments = [
+        {
+            "freeway": bucket["key"][0].replace(' ', '_'),
+            "segment_name": bucket["key"][1],
+            "segment_id": geometries.segment_id(es, bucket["key"][0], bucket["key"][1]),
+            "observations": bucket["doc_count"],
+            **bucket_stats(bucket),
+        }
+        for bucket in res["worst_segments"]["buckets"]
+    ]
+    return freeways, worst_segments
+
+
+def network_summary(es, top=None, year=None, month=None, day=None, hour=None, start=None, end=None, last=None,
+                    bbox=None, near=None, radius=None):
+    '''
+    Every freeway with its statistics and most congested observation (the same fields as
+    aggregate_observations gives for one freeway), plus the top most congested segments across
+    the network. Whole hours and days are read from the rollups (or the daily layout), otherwise
+    it all comes from a single search. bbox or near/radius (see geo.parse) restrict it to the
+    segments crossing that area.
+    '''
+    try:
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        top = int(top) if top else DEFAULT_TOP_SEGMENTS
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+    if not 1 <= top <= MAX_TOP_SEGMENTS:
+        return {"error": f"top must be between 1 and {MAX_TOP_SEGMENTS}"}
+
+    start, end = utils.window_bounds(window)
+    inside = None
+    if area:
+        inside = geometries.in_area(es, area)
+        if not inside:
+            return {"freeways": [], "worst_segments": [], "area": geo.describe(area)}
+
+    if daily.enabled(es):
+        network = network_from_daily
+    elif rollups.ENABLED:
+        network = network_from_rollups
+    else:
+        network = network_from_search
+    freeways, worst_segments = network(es, top, start, end, inside)
+
+    result = {"freeways": freeways, "worst_segments": worst_segments}
+    if area:
+        result["area"] = geo.describe(area)
+    return result
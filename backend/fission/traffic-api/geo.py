@@ -0,0 +1,102 @@
+import re
+
+# Parses the spatial parameters shared by the station, observation and freeway
+# routes and turns them into Elasticsearch geo queries:
+#
+#   bbox=min_lon,min_lat,max_lon,max_lat   everything inside the box (the viewport)
+#   near=lat,lon&radius=5km                everything within radius of a point
+#
+# Keep in sync with the copy in api/.
+
+DEFAULT_RADIUS = "5km"
+# larger areas are better served by the unfiltered routes
+MAX_RADIUS_KM = 1000
+RADIUS_UNITS = {"m": 0.001, "km": 1}
+_RADIUS = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(m|km)?\s*$")
+
+
+def _numbers(value, count, name):
+    try:
+        numbers = [float(part) for part in value.split(",")]
+    except ValueError:
+        numbers = []
+    if len(numbers) != count:
+        raise ValueError(f"{name} must be {count} comma separated numbers")
+    return numbers
+
+
+def _check(lat, lon, name):
+    if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        raise ValueError(f"{name} is outside the valid latitude/longitude range")
+
+
+def parse(bbox=None, near=None, radius=None):
+    """
+    The area selected by the bbox or near/radius parameters, or None if neither is given.
+    Raises ValueError with a message for the caller.
+    """
+    if bbox and near:
+        raise ValueError("use either bbox or near, not both")
+    if radius and not near:
+        raise ValueError("radius needs a near=lat,lon point")
+
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = _numbers(bbox, 4, "bbox")
+        _check(min_lat, min_lon, "bbox")
+        _check(max_lat, max_lon, "bbox")
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("bbox must be min_lon,min_lat,max_lon,max_lat")
+        return {"bbox": [min_lon, min_lat, max_lon, max_lat]}
+
+    if near:
+        lat, lon = _numbers(near, 2, "near")
+        _check(lat, lon, "near")
+        match = _RADIUS.match(radius or DEFAULT_RADIUS)
+        if match is None:
+            raise ValueError("radius must be a distance in m or km, e.g. 500m or 5km")
+        km = float(match.group(1)) * RADIUS_UNITS[match.group(2) or "m"]
+        if not 0 < km <= MAX_RADIUS_KM:
+            raise ValueError(f"radius must be more than 0 and at most {MAX_RADIUS_KM}km")
+        return {"near": [lat, lon], "radius_km": km}
+
+    return None
+
+
+def _distance(field, area):
+    lat, lon = area["near"]
+    return {"geo_distance": {"distance": f"{area['radius_km']}km", field: {"lat": lat, "lon": lon}}}
+
+
+def point_filter(field, area):
+    """
+    Filter matching documents whose geo_point field lies inside area
+    """
+    if "bbox" in area:
+        min_lon, min_lat, max_lon, max_lat = area["bbox"]
+        return {"geo_bounding_box": {field: {
+            "top_left": {"lat": max_lat, "lon": min_lon},
+            "bottom_right": {"lat": min_lat, "lon": max_lon},
+        }}}
+    return _distance(field, area)
+
+
+def shape_filter(field, area):
+    """
+    Filter matching documents whose geo_shape field intersects area
+    """
+    if "bbox" in area:
+        min_lon, min_lat, max_lon, max_lat = area["bbox"]
+        return {"geo_shape": {field: {
+            "shape": {"type": "envelope", "coordinates": [[min_lon, max_lat], [max_lon, min_lat]]},
+            "relation": "intersects",
+        }}}
+    return _distance(field, area)
+
+
+def describe(area):
+    """
+    The area as returned to the caller alongside the results
+    """
+    if "bbox" in area:
+        return {"bbox": area["bbox"]}
+    return {"near": area["near"], "radius_km": area["radius_km"]}
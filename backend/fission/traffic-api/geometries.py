@@ -0,0 +1,229 @@
+import os
+import math
+import time
+import logging
+import functools
+import elasticsearch
+import geo
+
+# Segment geometries, stored once per segment in SEGMENTS_INDEX by the traffic
+# harvester instead of on every traffic-data observation.
+#
+# The index is small (a few hundred LineStrings), so each pod keeps it in memory,
+# rereading it every REFRESH_INTERVAL seconds. Responses refer to segments by
+# segment_id, and /traffic-segments serves the geometries, reduced for a map zoom
+# level with Douglas-Peucker simplification and coordinate rounding.
+
+SEGMENTS_INDEX = "traffic-segments"
+REFRESH_INTERVAL = float(os.environ.get("API_SEGMENTS_REFRESH_INTERVAL", 600))
+MAX_SEGMENTS = 10000
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+# coordinates are never rounded past this many decimals (~1cm)
+MAX_DIGITS = 7
+# ids accepted in a single ?ids= list
+MAX_IDS = 1000
+
+# (loaded_at, {segment_id: segment document}, {(freewayName, segmentName): segment_id})
+_store = {}
+
+
+def load(es):
+    """
+    The segment documents by id and the ids by (freewayName, segmentName), reread when stale
+    """
+    now = time.monotonic()
+    cached = _store.get("segments")
+    if cached is not None and now - cached[0] < REFRESH_INTERVAL:
+        return cached[1], cached[2]
+
+    try:
+        hits = es.search(index=SEGMENTS_INDEX, body={"size": MAX_SEGMENTS, "query": {"match_all": {}}})["hits"]["hits"]
+    except elasticsearch.NotFoundError:
+        # the harvester hasn't stored any segments yet
+        hits = []
+    except Exception:
+        # keep serving the previous copy while Elasticsearch is unavailable
+        if cached is not None:
+            return cached[1], cached[2]
+        raise
+    by_id = {hit["_id"]: hit["_source"] for hit in hits}
+    by_name = {(doc.get("freewayName"), doc.get("segmentName")): segment_id for segment_id, doc in by_id.items()}
+    logging.info("Loaded %d segment geometries", len(by_id))
+
+    _store["segments"] = (now, by_id, by_name)
+    return by_id, by_name
+
+
+def segment_id(es, freeway_name, segment_name):
+    """
+    Id of the segment of freeway_name called segment_name, or None if it isn't stored (yet)
+    """
+    try:
+        _, by_name = load(es)
+    except Exception as e:
+        # responses still work without ids, just without a way to draw them
+        logging.warning("Segment geometries unavailable: %s", e)
+        return None
+    return by_name.get((freeway_name, segment_name))
+
+
+def in_area(es, area):
+    """
+    Segments whose geometry intersects area (see geo.parse), as dicts of segment_id, freewayName
+    and segmentName. Answered by Elasticsearch from the geo_shape index rather than the in-memory copy.
+    """
+    query = {
+        "size": MAX_SEGMENTS,
+        "_source": ["freewayName", "segmentName"],
+        "query": {"bool": {"filter": [geo.shape_filter("geometry", area)]}},
+    }
+    try:
+        hits = es.search(index=SEGMENTS_INDEX, body=query)["hits"]["hits"]
+    except elasticsearch.NotFoundError:
+        hits = []
+    return [dict(hit["_source"], segment_id=hit["_id"]) for hit in hits]
+
+
+def tolerance(zoom):
+    """
+    Width of one pixel of a 256px web map tile at zoom, in degrees of longitude
+    """
+    return 360 / (256 * 2 ** zoom)
+
+
+def digits(zoom):
+    """
+    Decimals needed to keep coordinates within a pixel at zoom
+    """
+    return min(MAX_DIGITS, max(0, math.ceil(-math.log10(tolerance(zoom)))))
+
+
+def _distance(point, start, end):
+    # distance of point from the line through start and end, in degrees
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    if dx == 0 and dy == 0:
+        return math.hypot(point[0] - start[0], point[1] - start[1])
+    return abs(dy * point[0] - dx * point[1] + end[0] * start[1] - end[1] * start[0]) / math.hypot(dx, dy)
+
+
+def simplify(coordinates, epsilon):
+    """
+    Douglas-Peucker simplification of a line: the fewest of its points that keep it within
+    epsilon of the original. Iterative, so long lines can't exhaust the recursion limit.
+    """
+    if len(coordinates) < 3:
+        return list(coordinates)
+
+    keep = [False] * len(coordinates)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coordinates) - 1)]
+    while stack:
+        first, last = stack.pop()
+        furthest, furthest_distance = None, epsilon
+        for i in range(first + 1, last):
+            distance = _distance(coordinates[i], coordinates[first], coordinates[last])
+            if distance > furthest_distance:
+                furthest, furthest_distance = i, distance
+        if furthest is not None:
+            keep[furthest] = True
+            stack.append((first, furthest))
+            stack.append((furthest, last))
+
+    return [point for point, kept in zip(coordinates, keep) if kept]
+
+
+def reduce_geometry(geometry, zoom):
+    """
+    geometry simplified and rounded for zoom, or as stored if zoom is None
+    """
+    if geometry is None or zoom is None:
+        return geometry
+    return _reduce(geometry["type"], _freeze(geometry["coordinates"]), zoom)
+
+
+def _freeze(coordinates):
+    # hashable copy of nested coordinate lists, for the lru_cache
+    if isinstance(coordinates, list):
+        return tuple(_freeze(c) for c in coordinates)
+    return coordinates
+
+
+@functools.lru_cache(maxsize=MAX_SEGMENTS)
+def _reduce(geometry_type, coordinates, zoom):
+    epsilon, ndigits = tolerance(zoom), digits(zoom)
+
+    def line(points):
+        simplified = simplify(points, epsilon)
+        rounded = [[round(x, ndigits), round(y, ndigits)] for x, y, *_ in simplified]
+        # rounding can collapse neighbouring points into one
+        return [point for i, point in enumerate(rounded) if i == 0 or point != rounded[i - 1]]
+
+    if geometry_type == "LineString":
+        coordinates = line(coordinates)
+    elif geometry_type == "MultiLineString":
+        coordinates = [line(part) for part in coordinates]
+    elif geometry_type == "Point":
+        coordinates = [round(coordinates[0], ndigits), round(coordinates[1], ndigits)]
+    else:
+        coordinates = _thaw(coordinates)
+    return {"type": geometry_type, "coordinates": coordinates}
+
+
+def _thaw(coordinates):
+    if isinstance(coordinates, tuple):
+        return [_thaw(c) for c in coordinates]
+    return coordinates
+
+
+def get_segments(es, ids=None, freeway=None, zoom=None, bbox=None, near=None, radius=None):
+    """
+    Geometries of the segments listed in ids (comma separated), of every segment of freeway,
+    or of every segment, simplified for the map zoom level if one is given. bbox or near/radius
+    (see geo.parse) keep only the segments crossing that area.
+    """
+    try:
+        zoom = int(zoom) if zoom is not None else None
+    except ValueError:
+        return {"error": "zoom must be a whole number"}
+    try:
+        area = geo.parse(bbox, near, radius)
+    except ValueError as e:
+        return {"error": str(e)}
+    if zoom is not None and not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        return {"error": f"zoom must be between {MIN_ZOOM} and {MAX_ZOOM}"}
+
+    by_id, _ = load(es)
+    if ids:
+        ids = [segment_id.strip() for segment_id in ids.split(",") if segment_id.strip()]
+        if len(ids) > MAX_IDS:
+            return {"error": f"at most {MAX_IDS} ids can be requested at once"}
+    elif freeway:
+        # freeway will be in the format of 'Monash_Fwy' change back to 'Monash Fwy'
+        freeway_name = freeway.replace('_', ' ')
+        ids = sorted(segment_id for segment_id, doc in by_id.items() if doc.get("freewayName") == freeway_name)
+    else:
+        ids = sorted(by_id)
+    if area:
+        inside = {segment["segment_id"] for segment in in_area(es, area)}
+        ids = [segment_id for segment_id in ids if segment_id in inside]
+
+    segments = []
+    for segment_id in ids:
+        doc = by_id.get(segment_id)
+        if doc is None:
+            continue
+        segments.append({
+            "segment_id": segment_id,
+            "freeway": (doc.get("freewayName") or "").replace(' ', '_'),
+            "segment_name": doc.get("segmentName"),
+            "geometry": reduce_geometry(doc.get("geometry"), zoom),
+        })
+
+    result = {"zoom": zoom, "segments": segments}
+    if area:
+        result["area"] = geo.describe(area)
+    missing = [segment_id for segment_id in ids if segment_id not in by_id]
+    if missing:
+        result["missing"] = missing
+    return result
@@ -0,0 +1,210 @@
+import datetime
+import logging
+import utils
+import daily
+import geometries
+
+# Segment x time matrices of one traffic measure, for heatmaps.
+#
+# Every (segment, time bucket) cell comes from one composite aggregation, paged
+# with after_key, and the matrix is returned as columns: the row labels
+# (segments), the column labels (bucket start times) and one flat row-major
+# array of values, with null for cells without observations.
+#
+# The daily layout keeps a day's observations in arrays, whose values can't be
+# bucketed by time in Elasticsearch, so its cells are computed from the in-window
+# observations instead (see daily.observations).
+
+# measures a heatmap can show, by the names used in the API and in traffic-data
+METRICS = {
+    "congestion": "congestionIndex",
+    "speed": "averageSpeed",
+    "travel_time": "actualTravelTime",
+}
+STATS = ("avg", "max", "min")
+
+# bucket widths, publishedTime holds Melbourne local time so fixed intervals follow the local clock
+INTERVALS = {
+    "15m": ({"fixed_interval": "15m"}, datetime.timedelta(minutes=15)),
+    "30m": ({"fixed_interval": "30m"}, datetime.timedelta(minutes=30)),
+    "hour": ({"fixed_interval": "1h"}, datetime.timedelta(hours=1)),
+    "day": ({"fixed_interval": "1d"}, datetime.timedelta(days=1)),
+}
+DEFAULT_WINDOW = "24h"
+BUCKET_FORMAT = "yyyy-MM-dd'T'HH:mm:ss"
+PY_BUCKET_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# refuse matrices larger than this many cells (time buckets x segments)
+MAX_CELLS = 250000
+# composite buckets per page
+PAGE_SIZE = 10000
+# an upper bound on segments used to check the size before querying, the network has a few hundred
+EXPECTED_SEGMENTS = 1000
+
+
+def _floor(dt, step):
+    midnight = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight + ((dt - midnight) // step) * step
+
+
+def parse_args(metric=None, stat=None, interval=None):
+    metric = metric or "congestion"
+    stat = stat or "avg"
+    interval = interval or "hour"
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+    if stat not in STATS:
+        raise ValueError(f"stat must be one of {', '.join(STATS)}")
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+    return metric, stat, interval
+
+
+def timestamps(start, end, step):
+    """
+    Start of every bucket of width step covering [start, end)
+    """
+    current = _floor(start, step)
+    columns = []
+    while current < end:
+        columns.append(current)
+        current += step
+    return columns
+
+
+def _bucket_key(time, step):
+    # start of the bucket of width step holding the local yyyy-MM-ddTHH:mm:ss time, in the same format
+    minutes = step // datetime.timedelta(minutes=1)
+    if minutes >= 24 * 60:
+        return f"{time[:10]}T00:00:00"
+    minute = int(time[11:13]) * 60 + int(time[14:16])
+    minute -= minute % minutes
+    return f"{time[:10]}T{minute // 60:02d}:{minute % 60:02d}:00"
+
+
+def daily_cells(es, freeway_name, field, stat, start, end, step):
+    """
+    {(freeway name or None, segment name): {bucket start: value}} of the stat of field, from the
+    daily layout's observations in [start, end)
+    """
+    filters = {"freewayName": freeway_name} if freeway_name else {}
+    # (row, bucket) -> [count, sum, min, max]
+    stats = {}
+    for source, time, values in daily.observations(es, filters, start, end, [field]):
+        value = values[field]
+        if value is None:
+            continue
+        row = (None if freeway_name else source.get("freewayName"), source.get("segmentName"))
+        cell = stats.setdefault((row, _bucket_key(time, step)), [0, 0, value, value])
+        cell[0] += 1
+        cell[1] += value
+        cell[2] = min(cell[2], value)
+        cell[3] = max(cell[3], value)
+
+    cells = {}
+    for (row, key), (count, total, low, high) in stats.items():
+        cells.setdefault(row, {})[key] = {"avg": total / count, "min": low, "max": high}[stat]
+    return cells
+
+
+def get_heatmap(es, freeway=None, metric=None, stat=None, interval=None,
+                year=None, month=None, day=None, hour=None, start=None, end=None, last=None):
+    """
+    Matrix of the stat (avg, max or min) of metric for every segment of freeway, or of the whole
+    network if freeway is None, and every interval-wide bucket of the window (24 hours by default)
+    """
+    try:
+        metric, stat, interval = parse_args(metric, stat, interval)
+        window = utils.resolve_window(year, month, day, hour, start, end, last)
+        if window is None:
+            window = utils.resolve_window(last=DEFAULT_WINDOW)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    start, end = utils.window_bounds(window)
+    if start is None:
+        return {"error": "a heatmap needs a start, e.g. start=2024-05-01 or last=24h"}
+    histogram, step = INTERVALS[interval]
+    end = end or _floor(utils.local_now(), step) + step
+
+    columns = timestamps(start, end, step)
+    if len(columns) * (1 if freeway else EXPECTED_SEGMENTS) > MAX_CELLS:
+        return {"error": f"too many {interval} buckets in the window, use a shorter window or a longer interval"}
+
+    filters = [utils.range_filter("publishedTime", start, end)]
+    sources = []
+    freeway_name = freeway.replace('_', ' ') if freeway else None
+    if freeway:
+        # freeway will be in the format of 'Monash_Fwy' change back to 'Monash Fwy'
+        filters.append({"term": {"freewayName.keyword": freeway_name}})
+    else:
+        sources.append({"freeway": {"terms": {"field": "freewayName.keyword"}}})
+    sources.append({"segment": {"terms": {"field": "segmentName.keyword"}}})
+    sources.append({"time": {"date_histogram": dict(histogram, field="publishedTime", format=BUCKET_FORMAT)}})
+
+    query = {
+        "size": 0,
+        "query": {"bool": {"filter": filters}},
+        "aggs": {
+            "cells": {
+                "composite": {"size": PAGE_SIZE, "sources": sources},
+                "aggs": {"value": {stat: {"field": METRICS[metric]}}}
+            }
+        }
+    }
+
+    column_index = {column.strftime(PY_BUCKET_FORMAT): i for i, column in enumerate(columns)}
+    rows = {}
+    values = []
+    pages = 0
+    if daily.enabled(es):
+        cells = daily_cells(es, freeway_name, METRICS[metric], stat, start, end, step)
+        if len(cells) * len(columns) > MAX_CELLS:
+            return {"error": "too many segments in the window, ask for a single freeway"}
+        for row_key in sorted(cells, key=lambda key: (key[0] or "", key[1] or "")):
+            rows[row_key] = len(rows)
+            row = [None] * len(columns)
+            for key, value in cells[row_key].items():
+                if key in column_index:
+                    row[column_index[key]] = round(value, 3)
+            values.extend(row)
+    else:
+        while True:
+            res = es.search(index="traffic-data", body=query).body["aggregations"]["cells"]
+            pages += 1
+            for bucket in res["buckets"]:
+                key = bucket["key"]
+                row_key = (key.get("freeway"), key["segment"])
+                row = rows.get(row_key)
+                if row is None:
+                    row = rows[row_key] = len(rows)
+                    values.extend([None] * len(columns))
+                column = column_index.get(key["time"])
+                value = bucket["value"]["value"]
+                if column is not None and value is not None:
+                    values[row * len(columns) + column] = round(value, 3)
+            if len(rows) * len(columns) > MAX_CELLS:
+                return {"error": "too many segments in the window, ask for a single freeway"}
+            if "after_key" not in res or not res["buckets"]:
+                break
+            query["aggs"]["cells"]["composite"]["after"] = res["after_key"]
+
+    logging.info("Heatmap of %d segments x %d buckets from %d pages", len(rows), len(columns), pages)
+
+    result = {
+        "metric": metric,
+        "stat": stat,
+        "interval": interval,
+        "shape": [len(rows), len(columns)],
+        "segments": [segment for _, segment in rows],
+        # geometries are served by /traffic-segments
+        "segment_ids": [geometries.segment_id(es, name or freeway_name, segment) for name, segment in rows],
+        "timestamps": list(column_index),
+        "values": values,
+        "date_filter": utils.describe_window({"start": start, "end": end}),
+    }
+    if freeway:
+        result["freeway"] = freeway
+    else:
+        result["freeways"] = [name.replace(' ', '_') for name, _ in rows]
+    return result
@@ -0,0 +1,132 @@
+import os
+import json
+import logging
+from flask import request, has_request_context
+
+# Diagnostics for the searches the API handlers run.
+#
+# Searches that take longer than SLOW_QUERY_MS (server-side took, or wall time) are
+# logged with their body, took, hit count and shard counts. A request with
+# ?profile=true runs its searches with Elasticsearch's profiler, bypassing the
+# caches, and gets a condensed per-shard breakdown back under "profile". That lets
+# any caller force expensive uncached searches, so it is off unless API_ALLOW_PROFILE=1.
+#
+# Keep in sync with the copies in api/ and the other API packages.
+
+SLOW_QUERY_MS = float(os.environ.get("API_SLOW_QUERY_MS", 500))
+PROFILE_ENABLED = os.environ.get("API_ALLOW_PROFILE", "0") == "1"
+# query descriptions can quote whole filters, long ones are cut to this many characters
+MAX_DESCRIPTION = 200
+# how deep the profiled query and aggregation trees are kept
+MAX_DEPTH = 4
+
+ENVIRON_KEY = "api.profile"
+
+
+def profiling():
+    """
+    Whether the current request asked for its searches to be profiled
+    """
+    if not PROFILE_ENABLED or not has_request_context():
+        return False
+    return request.args.get("profile", "").lower() in ("1", "true", "yes")
+
+
+def prepare(body):
+    """
+    The search body to send, with profiling switched on if the request asked for it
+    """
+    if body is not None and profiling():
+        return dict(body, profile=True)
+    return body
+
+
+def _ms(nanos):
+    return round(nanos / 1e6, 3)
+
+
+def _describe(description):
+    if len(description) > MAX_DESCRIPTION:
+        return description[:MAX_DESCRIPTION] + "..."
+    return description
+
+
+def _tree(nodes, depth=0):
+    condensed = []
+    for node in nodes:
+        item = {
+            "type": node.get("type"),
+            "description": _describe(node.get("description", "")),
+            "ms": _ms(node.get("time_in_nanos", 0)),
+        }
+        if node.get("children") and depth + 1 < MAX_DEPTH:
+            item["children"] = _tree(node["children"], depth + 1)
+        condensed.append(item)
+    return condensed
+
+
+def _collectors(nodes):
+    condensed = []
+    for node in nodes:
+        condensed.append({"name": node.get("name"), "reason": node.get("reason"), "ms": _ms(node.get("time_in_nanos", 0))})
+        condensed.extend(_collectors(node.get("children", [])))
+    return condensed
+
+
+def condense(profile):
+    """
+    Per-shard summary of a search response's "profile": time spent in each query and
+    aggregation (and their children), query rewriting and collectors, in milliseconds
+    """
+    shards = []
+    for shard in profile.get("shards", []):
+        searches = shard.get("searches", [])
+        shards.append({
+            "shard": shard.get("id"),
+            "query": [item for search in searches for item in _tree(search.get("query", []))],
+            "rewrite_ms": _ms(sum(search.get("rewrite_time", 0) for search in searches)),
+            "collectors": [item for search in searches for item in _collectors(search.get("collector", []))],
+            "aggregations": _tree(shard.get("aggregations", [])),
+        })
+    return shards
+
+
+def _summary(index, body, res, wall_ms):
+    hits = res.get("hits", {}).get("total")
+    shards = res.get("_shards", {})
+    return {
+        "event": "slow_query",
+        "index": index,
+        "took_ms": res.get("took"),
+        "wall_ms": round(wall_ms, 1),
+        "hits": hits.get("value") if isinstance(hits, dict) else hits,
+        "shards": {key: shards.get(key) for key in ("total", "successful", "skipped", "failed")},
+        "timed_out": res.get("timed_out"),
+        "route": request.path if has_request_context() else None,
+        "query": body,
+    }
+
+
+def observe(index, body, res, wall_ms):
+    """
+    Logs a slow search and keeps the profile of a profiled one for the response
+    """
+    took = res.get("took") or 0
+    if max(took, wall_ms) >= SLOW_QUERY_MS:
+        logging.warning(json.dumps(_summary(index, body, res, wall_ms), default=str))
+
+    if res.get("profile") is not None and has_request_context():
+        request.environ.setdefault(ENVIRON_KEY, []).append({
+            "index": index,
+            "took_ms": took,
+            "shards": condense(res["profile"]),
+        })
+
+
+def collected():
+    """
+    Profiles of the current request's searches, in the order they ran
+    """
+    if not has_request_context():
+        return []
+    return request.environ.get(ENVIRON_KEY, [])
@@ -0,0 +1,212 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+import elasticsearch
+
+import daily
+import freeway
+
+# (freewayName, segmentName) -> segment id, as loaded from the traffic-segments index
+SEGMENT_IDS = {("Monash Fwy", "Segment A"): "101", ("Monash Fwy", "Segment B"): "102"}
+
+
+def stats(count, total, low, high):
+    return {"count": count, "sum": total, "min": low, "max": high, "avg": total / count if count else None}
+
+
+def piece_response(congestion, travel_time, speed):
+    return {"aggregations": {"congestionIndex": congestion, "actualTravelTime": travel_time, "averageSpeed": speed}}
+
+
+def day_doc(times, congestion, travel_times):
+    return {"_source": {"segmentId": "101", "freewayName": "Monash Fwy", "segmentName": "Segment A",
+                        "times": times, "congestionIndex": congestion, "actualTravelTime": travel_times},
+            "sort": [max(congestion)]}
+
+
+class TestEnabled(unittest.TestCase):
+    def setUp(self):
+        daily.reset()
+        self.addCleanup(daily.reset)
+
+    def test_follows_the_harvested_mark(self):
+        es = MagicMock()
+        es.indices.get_mapping.return_value = {"traffic-daily": {"mappings": {"_meta": {"harvested": True}}}}
+        self.assertTrue(daily.enabled(es))
+
+        with patch.object(daily, "CHECK_INTERVAL", 0):
+            es.indices.get_mapping.return_value = {"traffic-daily": {"mappings": {"_meta": {"harvested": False}}}}
+            self.assertFalse(daily.enabled(es))
+
+            # the last answer is kept while Elasticsearch is unavailable
+            es.indices.get_mapping.side_effect = ConnectionError("down")
+            self.assertFalse(daily.enabled(es))
+
+    def test_missing_index(self):
+        es = MagicMock()
+        es.indices.get_mapping.side_effect = elasticsearch.NotFoundError("not found", MagicMock(), {})
+        self.assertFalse(daily.enabled(es))
+
+
+class TestPlan(unittest.TestCase):
+    def test_whole_days_and_edges(self):
+        start = datetime.datetime(2024, 5, 1, 8)
+        end = datetime.datetime(2024, 5, 4, 12)
+        self.assertEqual(daily.plan(start, end), [
+            (datetime.datetime(2024, 5, 1), datetime.datetime(2024, 5, 2), start, None),
+            (datetime.datetime(2024, 5, 2), datetime.datetime(2024, 5, 4), None, None),
+            (datetime.datetime(2024, 5, 4), datetime.datetime(2024, 5, 5), None, end),
+        ])
+
+    def test_within_one_day(self):
+        start = datetime.datetime(2024, 5, 1, 8)
+        end = datetime.datetime(2024, 5, 1, 9)
+        self.assertEqual(daily.plan(start, end),
+                         [(datetime.datetime(2024, 5, 1), datetime.datetime(2024, 5, 2), start, end)])
+
+    def test_open_window(self):
+        self.assertEqual(daily.plan(None, None), [(None, None, None, None)])
+        midnight = datetime.datetime(2024, 5, 1)
+        self.assertEqual(daily.plan(midnight, None), [(midnight, None, None, None)])
+
+
+class TestSummarise(unittest.TestCase):
+    def test_edges_are_limited_to_the_window(self):
+        es = MagicMock()
+        es.msearch.return_value = {"responses": [
+            piece_response(stats(2, 3.0, 1.0, 2.0), stats(2, 100, 40, 60), stats(2, 150, 70, 80)),
+            piece_response(stats(4, 4.0, 0.5, 1.5), stats(4, 200, 40, 60), stats(4, 320, 70, 90)),
+        ]}
+
+        res = daily.summarise(es, {"freewayName": "Monash Fwy"},
+                              datetime.datetime(2024, 5, 1, 8), datetime.datetime(2024, 5, 3))
+
+        searches = es.msearch.call_args.kwargs["searches"]
+        edge, whole = searches[1], searches[3]
+        self.assertEqual(searches[0], {"index": daily.DAILY_INDEX})
+        self.assertEqual(edge["runtime_mappings"]["congestionIndex"]["script"]["params"]["start"], "2024-05-01T08:00:00")
+        self.assertNotIn("runtime_mappings", whole)
+        self.assertIn({"range": {"date": {"format": "yyyy-MM-dd", "gte": "2024-05-02", "lt": "2024-05-03"}}},
+                      whole["query"]["bool"]["filter"])
+
+        self.assertEqual(res[None]["congestionIndex"], {"count": 6, "sum": 7.0, "min": 0.5, "max": 2.0})
+
+    def test_groups_by_several_fields(self):
+        es = MagicMock()
+        bucket = dict(piece_response(stats(1, 2.0, 2.0, 2.0), stats(1, 50, 50, 50), stats(1, 80, 80, 80))["aggregations"],
+                      key=["Monash Fwy", "Segment A"])
+        es.msearch.return_value = {"responses": [{"aggregations": {"groups": {"buckets": [bucket]}}}]}
+
+        res = daily.summarise(es, {}, group_by=("freewayName", "segmentName"))
+
+        body = es.msearch.call_args.kwargs["searches"][1]
+        self.assertEqual(body["aggs"]["groups"]["multi_terms"]["terms"],
+                         [{"field": "freewayName"}, {"field": "segmentName"}])
+        self.assertEqual(res[("Monash Fwy", "Segment A")]["congestionIndex"]["max"], 2.0)
+
+    def test_failed_piece_raises(self):
+        es = MagicMock()
+        es.msearch.return_value = {"responses": [
+            {"error": {"type": "index_not_found_exception", "reason": "no such index [traffic-daily]"}, "status": 404},
+        ]}
+
+        with self.assertRaises(daily.rollups.SearchError) as raised:
+            daily.summarise(es, {"freewayName": "Monash Fwy"})
+
+        self.assertEqual(raised.exception.status, 404)
+        self.assertIn("traffic-daily", str(raised.exception))
+
+
+class TestObservations(unittest.TestCase):
+    def test_in_window_observations_by_page(self):
+        es = MagicMock()
+        doc = day_doc(["2024-05-01T07:00:00", "2024-05-01T09:00:00"], [3.0, 1.5], [300, 150])
+        es.search.side_effect = [{"hits": {"hits": [dict(doc, sort=["101", 1])]}}, {"hits": {"hits": []}}]
+
+        with patch.object(daily, "OBSERVATIONS_PAGE_SIZE", 1):
+            found = list(daily.observations(es, {"freewayName": "Monash Fwy"}, datetime.datetime(2024, 5, 1, 8),
+                                            None, ["congestionIndex"]))
+
+        self.assertEqual([(time, values) for _, time, values in found],
+                         [("2024-05-01T09:00:00", {"congestionIndex": 1.5})])
+        second = es.search.call_args_list[1].kwargs["body"]
+        self.assertEqual(second["search_after"], ["101", 1])
+
+
+class TestWorstObservation(unittest.TestCase):
+    def test_only_observations_in_the_window(self):
+        es = MagicMock()
+        es.msearch.return_value = {"responses": [{"hits": {"hits": [
+            # the day's worst observation is before the window
+            day_doc(["2024-05-01T07:00:00", "2024-05-01T09:00:00"], [3.0, 1.5], [300, 150]),
+        ]}}]}
+
+        worst = daily.worst_observations(es, [{"segmentName": "Segment A"}], datetime.datetime(2024, 5, 1, 8))[0]
+
+        self.assertEqual(worst["publishedTime"], "2024-05-01T09:00:00")
+        self.assertEqual(worst["congestionIndex"], 1.5)
+        self.assertEqual(worst["actualTravelTime"], 150)
+        self.assertEqual(worst["segmentId"], "101")
+
+
+class TestFreewayFromDaily(unittest.TestCase):
+    def setUp(self):
+        for patcher in (patch.object(freeway.geometries, "load", return_value=({}, SEGMENT_IDS)),
+                        patch.object(freeway.daily, "enabled", return_value=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_segments(self):
+        summary = {
+            "Segment A": {"congestionIndex": stats(4, 4.0, 0.5, 1.5), "actualTravelTime": stats(4, 200, 40, 60),
+                          "averageSpeed": stats(4, 320, 70, 90)},
+            "Segment B": {"congestionIndex": stats(2, 5.0, 2.0, 3.0), "actualTravelTime": stats(2, 300, 100, 200),
+                          "averageSpeed": stats(2, 60, 20, 40)},
+        }
+        worst = {"segmentId": "102", "segmentName": "Segment B", "actualTravelTime": 200}
+        es = MagicMock()
+
+        with patch.object(freeway.daily, "summarise", return_value=summary) as summarise, \
+                patch.object(freeway.daily, "worst_observations", return_value=[worst]) as worst_observations:
+            res = freeway.aggregate_observations(es, "Monash_Fwy", last="24h")
+
+        self.assertEqual(summarise.call_args.args[1], {"freewayName": "Monash Fwy"})
+        self.assertEqual(worst_observations.call_args.args[1], [{"freewayName": "Monash Fwy", "segmentName": "Segment B"}])
+        es.search.assert_not_called()
+        self.assertEqual([segment["segment_name"] for segment in res["segments"]], ["Segment B", "Segment A"])
+        self.assertEqual(res["max_congestion_index"], 3.0)
+        self.assertEqual(res["actual_travel_time"], 200)
+        self.assertEqual(res["segment_id"], "102")
+
+    def test_network_summary(self):
+        summary = {
+            ("Monash Fwy", "Segment A"): {"congestionIndex": stats(4, 4.0, 0.5, 1.5),
+                                          "actualTravelTime": stats(4, 200, 40, 60), "averageSpeed": stats(4, 320, 70, 90)},
+            ("Monash Fwy", "Segment B"): {"congestionIndex": stats(2, 5.0, 2.0, 3.0),
+                                          "actualTravelTime": stats(2, 300, 100, 200), "averageSpeed": stats(2, 60, 20, 40)},
+        }
+        worst = {"segmentId": "102", "segmentName": "Segment B", "actualTravelTime": 200}
+        es = MagicMock()
+
+        with patch.object(freeway.daily, "summarise", return_value=summary), \
+                patch.object(freeway.daily, "worst_observations", return_value=[worst]):
+            res = freeway.network_summary(es, top=1)
+
+        self.assertEqual(len(res["freeways"]), 1)
+        monash = res["freeways"][0]
+        self.assertEqual(monash["key"], "Monash_Fwy")
+        self.assertEqual(monash["doc_count"], 6)
+        self.assertEqual(monash["segments"], 2)
+        self.assertEqual(monash["max_congestion_index"], 3.0)
+        self.assertEqual(monash["avg_congestion_index"], 1.5)
+        self.assertEqual(monash["segment_name"], "Segment B")
+        self.assertEqual(res["worst_segments"], [{
+            "freeway": "Monash_Fwy", "segment_name": "Segment B", "segment_id": "102", "observations": 2,
+            "max_congestion_index": 3.0, "avg_congestion_index": 2.5, "avg_travel_time": 150.0,
+            "max_travel_time": 200, "avg_speed": 30.0, "min_speed": 20,
+        }])
+
+
+if __name__ == "__main__":
+    unittest.main()
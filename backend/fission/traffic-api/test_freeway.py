@@ -0,0 +1,193 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import freeway
+
+# (freewayName, segmentName) -> segment id, as loaded from the traffic-segments index
+SEGMENT_IDS = {("Monash Fwy", "Warrigal Rd to Huntingdale Rd"): "101", ("Monash Fwy", "Segment B"): "102"}
+
+
+def segment_bucket(name, max_congestion, travel_time):
+    bucket = {"key": name, "doc_count": 12}
+    for agg in freeway.SEGMENT_AGGS:
+        bucket[agg] = {"value": 1.0}
+    bucket["max_congestion_index"] = {"value": max_congestion}
+    bucket["worst"] = {"hits": {"hits": [{"_source": {
+        "actualTravelTime": travel_time,
+    }}]}}
+    return bucket
+
+
+class TestFreeway(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(freeway.geometries, "load", return_value=({}, SEGMENT_IDS))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_every_segment_in_one_search(self):
+        es = MagicMock()
+        es.search.return_value.body = {"aggregations": {"segments": {"buckets": [
+            segment_bucket("Warrigal Rd to Huntingdale Rd", 2.5, 140),
+            segment_bucket("Huntingdale Rd to Forster Rd", 1.1, 60),
+        ]}}}
+
+        with patch.object(freeway.rollups, "ENABLED", False):
+            res = freeway.aggregate_observations(es, "Monash_Fwy", last="24h")
+
+        es.search.assert_called_once()
+        query = es.search.call_args.kwargs["body"]
+        self.assertIn({"term": {"freewayName.keyword": "Monash Fwy"}}, query["query"]["bool"]["filter"])
+        self.assertEqual(query["aggs"]["segments"]["terms"]["field"], "segmentName.keyword")
+
+        self.assertEqual(len(res["segments"]), 2)
+        self.assertEqual(res["segment_name"], "Warrigal Rd to Huntingdale Rd")
+        self.assertEqual(res["max_congestion_index"], 2.5)
+        self.assertEqual(res["actual_travel_time"], 140)
+        # geometries are referenced by segment id
+        self.assertNotIn("coordinates", res)
+        self.assertEqual(res["segment_id"], "101")
+        self.assertEqual(res["segments"][0]["segment_id"], "101")
+        self.assertIsNone(res["segments"][1]["segment_id"])
+
+    def test_segments_from_rollups(self):
+        def summary(count, total, low, high):
+            return {"count": count, "sum": total, "min": low, "max": high}
+
+        stats = {
+            "Segment A": {"congestionIndex": summary(4, 4.0, 0.5, 1.5), "actualTravelTime": summary(4, 200, 40, 60),
+                          "averageSpeed": summary(4, 320, 70, 90)},
+            "Segment B": {"congestionIndex": summary(2, 5.0, 2.0, 3.0), "actualTravelTime": summary(2, 300, 100, 200),
+                          "averageSpeed": summary(2, 60, 20, 40)},
+        }
+        es = MagicMock()
+        es.msearch.return_value = {"responses": [
+            {"aggregations": {}},
+            {"hits": {"hits": [{"_source": {"actualTravelTime": 200, "segmentId": "102"}}]}},
+        ]}
+
+        with patch.object(freeway.rollups, "ENABLED", True), \
+                patch.object(freeway.rollups, "summary_searches",
+                             return_value=([("raw", None, None)], [{"index": "traffic-data"}, {}])), \
+                patch.object(freeway.rollups, "summary_groups", return_value=stats) as summary_groups:
+            res = freeway.aggregate_observations(es, "Monash_Fwy")
+
+        # the rollup pieces and the worst observation in one round trip
+        es.msearch.assert_called_once()
+        es.search.assert_not_called()
+        self.assertEqual(summary_groups.call_args.args[4], [{"aggregations": {}}])
+        worst = es.msearch.call_args.kwargs["searches"][3]
+        self.assertEqual(worst["sort"], [{"congestionIndex": "desc"}])
+        self.assertEqual([segment["segment_name"] for segment in res["segments"]], ["Segment B", "Segment A"])
+        self.assertEqual(res["segments"][0]["avg_congestion_index"], 2.5)
+        self.assertEqual(res["segments"][0]["observations"], 2)
+        self.assertEqual(res["actual_travel_time"], 200)
+        self.assertEqual(res["segment_id"], "102")
+
+    def test_no_observations(self):
+        es = MagicMock()
+        es.search.return_value.body = {"aggregations": {"segments": {"buckets": []}}}
+
+        with patch.object(freeway.rollups, "ENABLED", False):
+            res = freeway.aggregate_observations(es, "Monash_Fwy")
+
+        self.assertEqual(res["segments"], [])
+        self.assertIsNone(res["segment_name"])
+        self.assertIsNone(res["segment_id"])
+
+    def test_network_summary(self):
+        freeway_bucket = segment_bucket("Monash Fwy", 2.5, 140)
+        freeway_bucket["segments"] = {"value": 14}
+        freeway_bucket["worst"]["hits"]["hits"][0]["_source"]["segmentName"] = "Warrigal Rd to Huntingdale Rd"
+        worst_segment = segment_bucket(["Monash Fwy", "Warrigal Rd to Huntingdale Rd"], 2.5, 140)
+
+        es = MagicMock()
+        es.search.return_value.body = {"aggregations": {
+            "freeways": {"buckets": [freeway_bucket]},
+            "worst_segments": {"buckets": [worst_segment]},
+        }}
+
+        with patch.object(freeway.rollups, "ENABLED", False):
+            res = freeway.network_summary(es, top="5", last="7d")
+
+        es.search.assert_called_once()
+        query = es.search.call_args.kwargs["body"]
+        self.assertEqual(query["aggs"]["worst_segments"]["multi_terms"]["size"], 5)
+        self.assertEqual(res["freeways"][0]["key"], "Monash_Fwy")
+        self.assertEqual(res["freeways"][0]["segments"], 14)
+        self.assertEqual(res["freeways"][0]["segment_name"], "Warrigal Rd to Huntingdale Rd")
+        self.assertEqual(res["freeways"][0]["actual_travel_time"], 140)
+        self.assertEqual(res["worst_segments"][0]["freeway"], "Monash_Fwy")
+        self.assertEqual(res["freeways"][0]["segment_id"], "101")
+        self.assertEqual(res["worst_segments"][0]["max_congestion_index"], 2.5)
+        self.assertEqual(res["worst_segments"][0]["segment_id"], "101")
+
+    def test_network_summary_from_rollups(self):
+        def summary(count, total, low, high):
+            return {"count": count, "sum": total, "min": low, "max": high}
+
+        stats = {
+            ("Monash Fwy", "Warrigal Rd to Huntingdale Rd"): {
+                "congestionIndex": summary(4, 4.0, 0.5, 1.5), "actualTravelTime": summary(4, 200, 40, 60),
+                "averageSpeed": summary(4, 320, 70, 90)},
+            ("Monash Fwy", "Segment B"): {
+                "congestionIndex": summary(2, 5.0, 2.0, 3.0), "actualTravelTime": summary(2, 300, 100, 200),
+                "averageSpeed": summary(2, 60, 20, 40)},
+        }
+        es = MagicMock()
+        es.msearch.return_value = {"responses": [{"hits": {"hits": [{"_source": {
+            "segmentId": "102", "segmentName": "Segment B", "actualTravelTime": 200}}]}}]}
+
+        with patch.object(freeway.rollups, "ENABLED", True), \
+                patch.object(freeway.rollups, "summarise", return_value=stats) as summarise:
+            res = freeway.network_summary(es, top="1", last="30d")
+
+        self.assertEqual(summarise.call_args.kwargs["group_by"], ("freewayName", "segmentName"))
+        es.search.assert_not_called()
+        worst = es.msearch.call_args.kwargs["searches"][1]
+        self.assertEqual(worst["sort"], [{"congestionIndex": "desc"}])
+        self.assertIn({"term": {"freewayName.keyword": "Monash Fwy"}}, worst["query"]["bool"]["filter"])
+        monash = res["freeways"][0]
+        self.assertEqual(monash["doc_count"], 6)
+        self.assertEqual(monash["max_congestion_index"], 3.0)
+        self.assertEqual(monash["segment_name"], "Segment B")
+        self.assertEqual(monash["segment_id"], "102")
+        self.assertEqual([segment["segment_name"] for segment in res["worst_segments"]], ["Segment B"])
+
+    def test_segments_in_area(self):
+        es = MagicMock()
+        es.search.side_effect = [
+            {"hits": {"hits": [
+                {"_id": "101", "_source": {"freewayName": "Monash Fwy", "segmentName": "Warrigal Rd to Huntingdale Rd"}},
+                {"_id": "301", "_source": {"freewayName": "Eastern Fwy", "segmentName": "Bulleen Rd to Doncaster Rd"}},
+            ]}},
+            MagicMock(body={"aggregations": {"segments": {"buckets": [
+                segment_bucket("Warrigal Rd to Huntingdale Rd", 2.5, 140),
+            ]}}}),
+        ]
+
+        with patch.object(freeway.rollups, "ENABLED", False):
+            res = freeway.aggregate_observations(es, "Monash_Fwy", near="-37.88,145.09", radius="2km")
+
+        shape_query = es.search.call_args_list[0].kwargs
+        self.assertEqual(shape_query["index"], "traffic-segments")
+        self.assertIn("geo_distance", shape_query["body"]["query"]["bool"]["filter"][0])
+        filters = es.search.call_args_list[1].kwargs["body"]["query"]["bool"]["filter"]
+        self.assertIn({"terms": {"segmentName.keyword": ["Warrigal Rd to Huntingdale Rd"]}}, filters)
+        self.assertEqual(res["area"], {"near": [-37.88, 145.09], "radius_km": 2})
+
+    def test_nothing_in_area(self):
+        es = MagicMock()
+        es.search.return_value = {"hits": {"hits": []}}
+
+        res = freeway.network_summary(es, bbox="140,-30,140.1,-29.9")
+
+        es.search.assert_called_once()
+        self.assertEqual(res["freeways"], [])
+
+    def test_network_summary_rejects_bad_top(self):
+        self.assertIn("error", freeway.network_summary(MagicMock(), top="1000"))
+        self.assertIn("error", freeway.network_summary(MagicMock(), top="many"))
+
+
+if __name__ == "__main__":
+    unittest.main()
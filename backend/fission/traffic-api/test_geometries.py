@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import MagicMock
+
+import geometries
+
+
+def stored(segment_id, freeway, name, coordinates):
+    return {"_id": segment_id, "_source": {
+        "segmentId": segment_id, "freewayName": freeway, "segmentName": name,
+        "geometry": {"type": "LineString", "coordinates": coordinates},
+    }}
+
+
+# a gentle curve sampled every ~1m, as VicRoads publishes them
+CURVE = [[145.0 + i * 0.00001, -37.8 + (i * 0.00001) ** 2] for i in range(500)]
+
+
+class TestGeometries(unittest.TestCase):
+    def setUp(self):
+        geometries._store.clear()
+        self.es = MagicMock()
+        self.es.search.return_value = {"hits": {"hits": [
+            stored("1", "Monash Fwy", "A", CURVE),
+            stored("2", "Monash Fwy", "B", [[145.1, -37.9], [145.2, -37.9]]),
+            stored("3", "Eastern Fwy", "C", [[145.3, -37.7], [145.4, -37.7]]),
+        ]}}
+
+    def test_simplify_keeps_the_shape(self):
+        line = [[0, 0], [1, 0.1], [2, -0.1], [3, 5], [4, 6], [5, 7], [6, 8.1], [7, 9], [8, 9], [9, 9]]
+        self.assertEqual(geometries.simplify(line, 0.5), [[0, 0], [2, -0.1], [3, 5], [7, 9], [9, 9]])
+        self.assertEqual(geometries.simplify(line[:2], 0.5), line[:2])
+
+    def test_lower_zooms_are_coarser(self):
+        self.assertGreater(geometries.digits(16), geometries.digits(8))
+        counts = [len(geometries.get_segments(self.es, ids="1", zoom=zoom)["segments"][0]["geometry"]["coordinates"])
+                  for zoom in (6, 12, 18)]
+        self.assertLessEqual(counts[0], counts[1])
+        self.assertLessEqual(counts[1], counts[2])
+        self.assertLess(counts[0], len(CURVE))
+
+        full = geometries.get_segments(self.es, ids="1")["segments"][0]["geometry"]
+        self.assertEqual(full["coordinates"], CURVE)
+
+    def test_selection(self):
+        res = geometries.get_segments(self.es, freeway="Monash_Fwy", zoom="10")
+        self.assertEqual([segment["segment_id"] for segment in res["segments"]], ["1", "2"])
+        self.assertEqual(res["segments"][1]["geometry"]["coordinates"], [[145.1, -37.9], [145.2, -37.9]])
+
+        res = geometries.get_segments(self.es, ids="3,9")
+        self.assertEqual(res["segments"][0]["freeway"], "Eastern_Fwy")
+        self.assertEqual(res["missing"], ["9"])
+        # the store is read once and kept in memory
+        self.es.search.assert_called_once()
+
+    def test_segment_id(self):
+        self.assertEqual(geometries.segment_id(self.es, "Monash Fwy", "B"), "2")
+        self.assertIsNone(geometries.segment_id(self.es, "Monash Fwy", "Z"))
+
+    def test_rejects_bad_zoom(self):
+        self.assertIn("error", geometries.get_segments(self.es, zoom="30"))
+        self.assertIn("error", geometries.get_segments(self.es, zoom="far"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+import heatmap
+
+
+def page(buckets, after_key=None):
+    res = MagicMock()
+    cells = {"buckets": buckets}
+    if after_key:
+        cells["after_key"] = after_key
+    res.body = {"aggregations": {"cells": cells}}
+    return res
+
+
+def cell(segment, time, value, freeway=None):
+    key = {"segment": segment, "time": time}
+    if freeway:
+        key["freeway"] = freeway
+    return {"key": key, "doc_count": 4, "value": {"value": value}}
+
+
+class TestHeatmap(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(heatmap.geometries, "load", return_value=({}, {("Monash Fwy", "A"): "7"}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_dense_columnar_matrix(self):
+        es = MagicMock()
+        es.search.side_effect = [
+            page([cell("A", "2024-05-01T00:00:00", 1.25), cell("A", "2024-05-01T02:00:00", 2.0)], {"segment": "A"}),
+            page([cell("B", "2024-05-01T01:00:00", 0.5)], {"segment": "B"}),
+            page([]),
+        ]
+
+        res = heatmap.get_heatmap(es, "Monash_Fwy", start="2024-05-01T00:00", end="2024-05-01T03:00")
+
+        self.assertEqual(es.search.call_count, 3)
+        self.assertEqual(res["shape"], [2, 3])
+        self.assertEqual(res["segments"], ["A", "B"])
+        self.assertEqual(res["segment_ids"], ["7", None])
+        self.assertEqual(res["timestamps"], ["2024-05-01T00:00:00", "2024-05-01T01:00:00", "2024-05-01T02:00:00"])
+        self.assertEqual(res["values"], [1.25, None, 2.0, None, 0.5, None])
+
+        query = es.search.call_args_list[0].kwargs["body"]
+        self.assertIn({"term": {"freewayName.keyword": "Monash Fwy"}}, query["query"]["bool"]["filter"])
+        self.assertEqual(query["aggs"]["cells"]["aggs"], {"value": {"avg": {"field": "congestionIndex"}}})
+        # paged with the after_key of the previous page
+        self.assertEqual(query["aggs"]["cells"]["composite"]["after"], {"segment": "B"})
+
+    def test_whole_network(self):
+        es = MagicMock()
+        es.search.return_value = page([cell("A", "2024-05-01T00:00:00", 60, freeway="Monash Fwy")])
+
+        res = heatmap.get_heatmap(es, metric="speed", stat="min", interval="day",
+                                  start="2024-05-01", end="2024-05-03")
+
+        self.assertEqual(res["freeways"], ["Monash_Fwy"])
+        self.assertEqual(res["segment_ids"], ["7"])
+        self.assertEqual(res["values"], [60, None])
+        sources = es.search.call_args.kwargs["body"]["aggs"]["cells"]["composite"]["sources"]
+        self.assertEqual([next(iter(source)) for source in sources], ["freeway", "segment", "time"])
+
+    def test_daily_layout(self):
+        es = MagicMock()
+        observations = [
+            ({"freewayName": "Monash Fwy", "segmentName": "B"}, "2024-05-01T00:10:00", {"congestionIndex": 1.0}),
+            ({"freewayName": "Monash Fwy", "segmentName": "A"}, "2024-05-01T01:05:00", {"congestionIndex": 1.0}),
+            ({"freewayName": "Monash Fwy", "segmentName": "A"}, "2024-05-01T01:55:00", {"congestionIndex": 2.0}),
+            ({"freewayName": "Monash Fwy", "segmentName": "A"}, "2024-05-01T02:00:00", {"congestionIndex": None}),
+        ]
+
+        with patch.object(heatmap.daily, "enabled", return_value=True), \
+                patch.object(heatmap.daily, "observations", return_value=observations) as read:
+            res = heatmap.get_heatmap(es, "Monash_Fwy", start="2024-05-01T00:00", end="2024-05-01T03:00")
+
+        es.search.assert_not_called()
+        self.assertEqual(read.call_args.args[1], {"freewayName": "Monash Fwy"})
+        self.assertEqual(res["segments"], ["A", "B"])
+        self.assertEqual(res["values"], [None, 1.5, None, 1.0, None, None])
+
+    def test_bucket_key(self):
+        self.assertEqual(heatmap._bucket_key("2024-05-01T13:44:10", datetime.timedelta(minutes=15)), "2024-05-01T13:30:00")
+        self.assertEqual(heatmap._bucket_key("2024-05-01T13:44:10", datetime.timedelta(days=1)), "2024-05-01T00:00:00")
+
+    def test_rejects_oversized_and_invalid_requests(self):
+        self.assertIn("error", heatmap.get_heatmap(MagicMock(), metric="rain"))
+        self.assertIn("error", heatmap.get_heatmap(MagicMock(), interval="15m", last="52w"))
+
+    def test_timestamps_floor_to_interval(self):
+        columns = heatmap.timestamps(datetime.datetime(2024, 5, 1, 0, 20), datetime.datetime(2024, 5, 1, 1, 0),
+                                     datetime.timedelta(minutes=15))
+        self.assertEqual([c.minute for c in columns], [15, 30, 45])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,33 @@
 # import weather
 import logging
 import freeway
+import heatmap
+import grid
+import daily
+import geometries
 import json
+import es_client
+import responses
+import admission
+import resilience
+import timing
+import query_log
 from flask import request
-import elasticsearch
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# seconds each route's Elasticsearch calls may take, see resilience.py
+DEADLINES = {
+    "freeways": 5,
+    "observations": 10,
+    "summary": 10,
+    "heatmap": 15,
+    "segments": 5,
+    "grid": 10,
+}
+
 # def config(k):
 #     with open(f'/configs/default/shared-data/{k}', 'r') as f:
 #         return f.read().strip()
@@ -24,49 +43,48 @@ logger = logging.getLogger(__name__)
 #     es = connect_elasticsearch()
 #     return json.dumps(freeway.get_freeways(es))
 
-def config(k):
-    with open(f'/configs/default/shared-data/{k}', 'r') as f:
-        value = f.read().strip()
-        logging.debug("Read value for config key '%s': %s", k, value)
-        return value
-    
-def connect_elasticsearch():
-    logging.debug("Connecting to Elasticsearch...")
-    try:
-        es = elasticsearch.Elasticsearch(
-            f"https://elasticsearch-master.elastic.svc.cluster.local:9200",
-            http_auth=(config('ES_USERNAME'), config('ES_PASSWORD')),
-            verify_certs=False
-        )
-        logging.debug("Connected to Elasticsearch successfully.")
-        return es
-    except Exception as e:
-        logging.error("Failed to connect to Elasticsearch: %s", e)
-        raise
+def area_args():
+    # the spatial parameters accepted by the freeway and segment routes, see geo.parse
+    return {name: request.args.get(name, None) for name in ("bbox", "near", "radius")}
+
+def shared_result(key, compute):
+    # concurrent requests share one query, which waits for a free query slot, and the last
+    # good result is served while Elasticsearch is degraded. Profiled requests run uncached
+    # so the profile describes their own queries.
+    if query_log.profiling():
+        result = admission.admitted(compute)
+        if isinstance(result, dict):
+            result = dict(result, profile=query_log.collected())
+        return result
+    return resilience.call(key, lambda: admission.single_flight(key, lambda: admission.admitted(compute)))
 
+@timing.timed("traffic-freeway")
+@admission.sheds_load
+@resilience.serves_unavailable
 def get_freeways():
     logging.info("Retrieving freeways from Elasticsearch...")
     try:
-        es = connect_elasticsearch()
-        freeways_data = freeway.get_freeways(es)
+        with timing.stage("client"):
+            es = resilience.with_deadline(es_client.get_client(), DEADLINES["freeways"])
+        area = area_args()
+        freeways_data = shared_result(("freeways",) + tuple(area.values()), lambda: freeway.get_freeways(es, **area))
         logging.info("Successfully retrieved freeways.")
-        return json.dumps(freeways_data)
+        return responses.json_response(freeways_data)
+    except (admission.Overloaded, resilience.Unavailable):
+        raise
     except Exception as e:
         logging.error("Failed to retrieve freeways: %s", e)
-        return json.dumps({"error": str(e)})
+        return responses.json_response({"error": str(e)})
 
+@timing.timed("traffic-observations")
+@admission.sheds_load
+@resilience.serves_unavailable
 def aggregate_observations():
     logger.info("Retrieving freeways from Elasticsearch...")
-    es = connect_elasticsearch()
+    with timing.stage("client"):
+        es = resilience.with_deadline(es_client.get_client(), DEADLINES["observations"])
 
-    print(request.headers)
-
-    print(request.args)
-
-    logging.info("Request headers: %s", request.headers)
-
-    logging.info("Request arguments: %s", request.args)
-    
+    # a sample of requests is logged with their arguments and timings, see timing.py
     try:
         freewayName = request.headers["X-Fission-Params-FreewayName"]
         logging.info("Freeway name: %s", freewayName)
@@ -78,11 +96,96 @@ def aggregate_observations():
     month = request.args.get("month", None)
     day = request.args.get("day", None)
     hour = request.args.get("hour", None)
-    
+    start = request.args.get("start", None)
+    end = request.args.get("end", None)
+    last = request.args.get("last", None)
+    fields = request.args.get("fields", None)
+    stats = request.args.get("stats", None)
 
-    logging.info("Year: %s", year)
+    area = area_args()
+    params = (freewayName, year, month, day, hour, fields, stats, start, end, last)
+    result = shared_result(("freeway",) + params + tuple(area.values()),
+                           lambda: freeway.aggregate_observations(es, *params, **area))
 
-    result = freeway.aggregate_observations(es, freewayName, year, month, day, hour)
-    logger.info("Aggregation result: %s", result)
-    
-    return json.dumps(result)
+    return responses.json_response(result)
+
+@timing.timed("traffic-summary")
+@admission.sheds_load
+@resilience.serves_unavailable
+def get_summary():
+    """
+    Every freeway's statistics and the most congested segments of the network in one call
+    """
+    with timing.stage("client"):
+        es = resilience.with_deadline(es_client.get_client(), DEADLINES["summary"])
+
+    params = {name: request.args.get(name, None) for name in ("top", "year", "month", "day", "hour", "start", "end", "last")}
+    params.update(area_args())
+    result = shared_result(("summary",) + tuple(params.values()), lambda: freeway.network_summary(es, **params))
+
+    return responses.json_response(result)
+
+@timing.timed("traffic-heatmap")
+@admission.sheds_load
+@resilience.serves_unavailable
+def get_heatmap():
+    """
+    Segment x time matrix for one freeway (/traffic-heatmap/{freewayName}) or the whole network
+    """
+    with timing.stage("client"):
+        es = resilience.with_deadline(es_client.get_client(), DEADLINES["heatmap"])
+
+    freewayName = request.headers.get("X-Fission-Params-FreewayName", None)
+    params = {
+        name: request.args.get(name, None)
+        for name in ("metric", "stat", "interval", "year", "month", "day", "hour", "start", "end", "last")
+    }
+    result = shared_result(("heatmap", freewayName) + tuple(params.values()),
+                           lambda: heatmap.get_heatmap(es, freewayName, **params))
+
+    return responses.json_response(result)
+
+@timing.timed("traffic-segments")
+@admission.sheds_load
+@resilience.serves_unavailable
+def get_segments():
+    """
+    Segment geometries by id (?ids=), of one freeway (/traffic-segments/{freewayName}) or of
+    every segment, simplified for ?zoom= if given and limited to ?bbox= or ?near=&radius=
+    """
+    with timing.stage("client"):
+        es = resilience.with_deadline(es_client.get_client(), DEADLINES["segments"])
+
+    freewayName = request.headers.get("X-Fission-Params-FreewayName", None)
+    ids = request.args.get("ids", None)
+    zoom = request.args.get("zoom", None)
+    area = area_args()
+    result = shared_result(("segments", freewayName, ids, zoom) + tuple(area.values()),
+                           lambda: geometries.get_segments(es, ids, freewayName, zoom, **area))
+
+    return responses.json_response(result)
+
+@timing.timed("traffic-grid")
+@admission.sheds_load
+@resilience.serves_unavailable
+def get_grid():
+    """
+    Traffic observations aggregated into map grid cells, see grid.py
+    """
+    with timing.stage("client"):
+        es = resilience.with_deadline(es_client.get_client(), DEADLINES["grid"])
+
+    params = {
+        name: request.args.get(name, None)
+        for name in ("metric", "grid", "zoom", "bbox", "near", "radius",
+                     "year", "month", "day", "hour", "start", "end", "last")
+    }
+
+    def compute():
+        if daily.enabled(es):
+            return grid.get_grid(es, "traffic_daily", **params, window_fields=daily.window_fields)
+        return grid.get_grid(es, "traffic", **params)
+
+    result = shared_result(("grid",) + tuple(params.values()), compute)
+
+    return responses.json_response(result)
@@ -1,5 +1,7 @@
+import re
 import datetime
 import calendar
+import pytz
 
 def get_date_limits(year=None, month=None, day=None, hour=None, minute=None):
     """
@@ -27,4 +29,182 @@ def get_date_limits(year=None, month=None, day=None, hour=None, minute=None):
     start_date_iso = start_date.isoformat()
     end_date_iso = end_date.isoformat()
 
-    return start_date_iso, end_date_iso
\ No newline at end of file
+    return start_date_iso, end_date_iso
+
+
+def get_window(year=None, month=None, day=None, hour=None):
+    """
+    Same window as get_date_limits but as datetimes [start, end) with an exclusive end, or (None, None) without a year
+    """
+    if not year:
+        return None, None
+    start_date, end_date = get_date_limits(year, month, day, hour)
+    start_date = datetime.datetime.fromisoformat(start_date)
+    end_date = datetime.datetime.fromisoformat(end_date) + datetime.timedelta(seconds=1)
+    return start_date, end_date
+
+
+def range_filter(field, start, end, time_zone=None):
+    """
+    Range filter for the local window [start, end), either of which may be None for an open
+    bound. time_zone is the zone to interpret the bounds in when the field is stored in UTC.
+    """
+    bounds = {"format": "yyyy-MM-dd HH:mm:ss"}
+    if start is not None:
+        bounds["gte"] = start.strftime("%Y-%m-%d %H:%M:%S")
+    if end is not None:
+        bounds["lt"] = end.strftime("%Y-%m-%d %H:%M:%S")
+    if time_zone:
+        bounds["time_zone"] = time_zone
+    return {"range": {field: bounds}}
+
+
+def parse_date_parts(year=None, month=None, day=None, hour=None):
+    """
+    Converts the year, month, day and hour query parameters to integers, leaving missing ones as None.
+    Raises ValueError naming the offending parameter.
+    """
+    parts = {"year": year, "month": month, "day": day, "hour": hour}
+    for name, value in parts.items():
+        if value:
+            try:
+                parts[name] = int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer")
+        else:
+            parts[name] = None
+    return parts["year"], parts["month"], parts["day"], parts["hour"]
+
+
+# Time windows. Every window is resolved to naive Melbourne local bounds [start, end),
+# the frame the API's parameters, the rollups and the response caches all use.
+# Sources stored in UTC are converted by Elasticsearch through the range's time_zone.
+# Keep this section in sync with api/utils.py.
+
+LOCAL_TZ_NAME = "Australia/Melbourne"
+LOCAL_TZ = pytz.timezone(LOCAL_TZ_NAME)
+
+# units accepted by relative windows (?last=24h), with the unit their bounds are rounded to
+RELATIVE_UNITS = {
+    "m": (datetime.timedelta(minutes=1), "m"),
+    "h": (datetime.timedelta(hours=1), "h"),
+    "d": (datetime.timedelta(days=1), "h"),
+    "w": (datetime.timedelta(weeks=1), "d"),
+}
+ROUNDING_STEPS = {
+    "m": datetime.timedelta(minutes=1),
+    "h": datetime.timedelta(hours=1),
+    "d": datetime.timedelta(days=1),
+}
+
+
+def local_now():
+    return datetime.datetime.now(LOCAL_TZ).replace(tzinfo=None)
+
+
+def _floor(dt, unit):
+    if unit == "m":
+        return dt.replace(second=0, microsecond=0)
+    if unit == "h":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def parse_datetime(value, name):
+    """
+    Parses an ISO 8601 date or datetime into naive Melbourne local time. Values with a UTC
+    offset are converted, values without one are taken to be local already.
+    """
+    if value.endswith(("Z", "z")):
+        value = value[:-1] + "+00:00"
+    try:
+        dt = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(LOCAL_TZ).replace(tzinfo=None)
+    return dt
+
+
+def resolve_window(year=None, month=None, day=None, hour=None, start=None, end=None, last=None, now=None):
+    """
+    Resolves the time window parameters of a request, which are one of
+        year/month/day/hour  a calendar period
+        start/end            ISO 8601 bounds, end exclusive, either may be left out
+        last                 the period up to now, e.g. 30m, 24h, 7d or 2w
+    into {"start", "end", "relative"}, or None if no window was asked for.
+
+    Relative windows are rounded outwards (minutes to the minute, hours and days to the hour,
+    weeks to the day) and carry the equivalent Elasticsearch date math in "relative", e.g.
+    ("now-24h/h", "now+1h/h"), so refreshes within the same hour send identical queries that
+    the shard request cache can answer.
+
+    Raises ValueError for invalid or conflicting parameters.
+    """
+    year, month, day, hour = parse_date_parts(year, month, day, hour)
+
+    given = [name for name, value in (("year", year), ("start/end", start or end), ("last", last)) if value]
+    if len(given) > 1:
+        raise ValueError(f"{' and '.join(given)} can't be combined")
+
+    if last:
+        match = re.fullmatch(r"(\d+)([mhdw])", last.strip())
+        if not match or int(match.group(1)) == 0:
+            raise ValueError("last must be a positive number followed by m, h, d or w, e.g. 24h")
+        amount, unit = int(match.group(1)), match.group(2)
+        step, rounding = RELATIVE_UNITS[unit]
+        now = now or local_now()
+        return {
+            "start": _floor(now - amount * step, rounding),
+            "end": _floor(now, rounding) + ROUNDING_STEPS[rounding],
+            "relative": (f"now-{amount}{unit}/{rounding}", f"now+1{rounding}/{rounding}"),
+        }
+
+    if start or end:
+        start = parse_datetime(start, "start") if start else None
+        end = parse_datetime(end, "end") if end else None
+        if start is not None and end is not None and start >= end:
+            raise ValueError("start must be before end")
+        return {"start": start, "end": end, "relative": None}
+
+    if year:
+        try:
+            start, end = get_window(year, month, day, hour)
+        except ValueError as e:
+            raise ValueError(f"invalid date: {e}")
+        return {"start": start, "end": end, "relative": None}
+
+    return None
+
+
+def window_bounds(window):
+    """
+    (start, end) of a resolved window, (None, None) if there is none
+    """
+    if window is None:
+        return None, None
+    return window["start"], window["end"]
+
+
+def window_range(field, window, time_zone=None):
+    """
+    Range filter on field for a resolved window. time_zone is given for fields stored in UTC,
+    for which relative windows are sent as date math. Fields holding local times can't use
+    date math, since now is UTC, and are filtered on the rounded local bounds instead, which
+    are just as stable between refreshes.
+    """
+    if time_zone and window["relative"]:
+        gte, lt = window["relative"]
+        return {"range": {field: {"gte": gte, "lt": lt, "time_zone": time_zone}}}
+    return range_filter(field, window["start"], window["end"], time_zone)
+
+
+def describe_window(window):
+    """
+    The date_filter summary returned with results: local start and inclusive end
+    """
+    start, end = window_bounds(window)
+    return {
+        "start": start.strftime("%Y-%m-%d %H:%M:%S") if start else None,
+        "end": (end - datetime.timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S") if end else None,
+    }
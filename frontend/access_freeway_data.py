@@ -1,24 +1,30 @@
 import requests
 
 def access_data():
-    response = requests.get("http://localhost:9090/traffic-freeway")
-    freeways_json = response.json()
+    # one request for every freeway's statistics and most congested segment
+    response = requests.get("http://localhost:9090/traffic-summary?year=2024&month=5")
+    summary = response.json()
 
-    freeways = []
+    aggregated_data = {}
 
-    for entry in freeways_json["freeways"]:
-        freeways.append(entry["key"])
+    for freeway in summary["freeways"]:
+        aggregated_data[freeway["key"]] = freeway
 
-    aggregated_data = {}
+    # geometries are stored once per segment and referenced by id
+    ids = [freeway["segment_id"] for freeway in aggregated_data.values() if freeway.get("segment_id")]
+    segments = {}
+    if ids:
+        response = requests.get(f"http://localhost:9090/traffic-segments?ids={','.join(ids)}")
+        segments = {segment["segment_id"]: segment["geometry"] for segment in response.json()["segments"]}
 
-    for freeway in freeways:
-        response = requests.get(f"http://localhost:9090/traffic-freeway/{freeway}?year=2024&month=5")
-        freeway_data = response.json()
-        # print(freeway, response)
-        aggregated_data[freeway] = freeway_data
+    for freeway in aggregated_data.values():
+        geometry = segments.get(freeway.get("segment_id")) or {}
+        freeway["geometry_type"] = geometry.get("type", "None")
+        freeway["coordinates"] = geometry.get("coordinates", [])
 
     return aggregated_data
 
-aggregated_data = access_data()
+if __name__ == "__main__":
+    aggregated_data = access_data()
 
-print(aggregated_data)
\ No newline at end of file
+    print(aggregated_data)
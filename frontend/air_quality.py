@@ -1,25 +1,26 @@
 import requests
 import pandas as pd
 
+# approximate Melbourne area as min_lon,min_lat,max_lon,max_lat
+MELBOURNE_BBOX = "144.5,-38.1,145.5,-37.5"
+
 def fetch_initial_air_quality_station_data():
-    response = requests.get("http://localhost:9090/air-quality-stations")
-    if response.status_code == 200:
+    # the station list is paginated, follow the cursor until the last page
+    stations = []
+    # only the stations in the Melbourne area, filtered by the API
+    params = {"bbox": MELBOURNE_BBOX}
+    while True:
+        response = requests.get("http://localhost:9090/air-quality-stations", params=params)
+        if response.status_code != 200:
+            break
         air_quality_stations_data = response.json()
-        df_air_quality_stations = pd.DataFrame(air_quality_stations_data['stations'])
-
-        # Define approximate latitude and longitude ranges for Melbourne
-        melbourne_lat_range = (-38.1, -37.5)
-        melbourne_lon_range = (144.5, 145.5)
+        stations.extend(air_quality_stations_data['stations'])
+        if 'next' not in air_quality_stations_data:
+            break
+        params['after'] = air_quality_stations_data['next']
 
-        # Filter air quality stations in Melbourne
-        melbourne_air_quality_stations = df_air_quality_stations[
-            (df_air_quality_stations['latitude'] >= melbourne_lat_range[0]) & 
-            (df_air_quality_stations['latitude'] <= melbourne_lat_range[1]) &
-            (df_air_quality_stations['longitude'] >= melbourne_lon_range[0]) & 
-            (df_air_quality_stations['longitude'] <= melbourne_lon_range[1])
-        ]
-
-        return melbourne_air_quality_stations
+    if response.status_code == 200:
+        return pd.DataFrame(stations)
     else:
         print(f"Failed to retrieve air quality stations: {response.status_code}")
         print(response.text)
@@ -28,25 +29,30 @@ def fetch_initial_air_quality_station_data():
 def fetch_detailed_air_quality_station_data(station_ids, station_names, year=2024, month=5):
     station_data_list = []
 
+    # one request for all stations rather than one per station
+    url = "http://localhost:9090/air-quality-observations"
+    params = {"stations": ",".join(station_ids), "year": year, "month": month}
+    response = requests.get(url, params=params)
+
+    if response.status_code != 200:
+        print(f"Failed to retrieve data for stations {station_ids}: {response.status_code}")
+        print("Response content:")
+        print(response.text)
+        return pd.DataFrame()
+
+    batch_data = response.json()
+    if 'date_filter' not in batch_data or 'start' not in batch_data['date_filter']:
+        print("'date_filter' or 'start' not found in batch response")
+        return pd.DataFrame()
+
     for station_id, station_name in zip(station_ids, station_names):
-        url = f"http://localhost:9090/air-quality-stations/{station_id}?year={year}&month={month}"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            if 'date_filter' in data and 'start' in data['date_filter']:
-                df_station_data = pd.DataFrame([data])
-                df_station_data['date'] = pd.to_datetime(data['date_filter']['start'])
-                df_station_data['station_id'] = station_id
-                df_station_data['station_name'] = station_name
-                station_data_list.append(df_station_data)
-            else:
-                print(f"'date_filter' or 'start' not found in data for {station_name} (Station ID: {station_id})")
-        else:
-            print(f"Failed to retrieve data for {station_name} (Station ID: {station_id}): {response.status_code}")
-            print("Response content:")
-            print(response.text)
+        data = dict(batch_data['stations'].get(station_id, {}))
+        data['date_filter'] = batch_data['date_filter']
+        df_station_data = pd.DataFrame([data])
+        df_station_data['date'] = pd.to_datetime(data['date_filter']['start'])
+        df_station_data['station_id'] = station_id
+        df_station_data['station_name'] = station_name
+        station_data_list.append(df_station_data)
 
     if station_data_list:
         df_stations_data = pd.concat(station_data_list, ignore_index=True)
@@ -0,0 +1,72 @@
+import argparse
+import sys
+import requests
+
+# Downloads raw observations from the /export/<dataset> route, writing the
+# response to disk as it arrives so memory use stays flat for any export size.
+#
+# NDJSON output loads with pd.read_json(path, lines=True), Arrow output with
+# pyarrow.ipc.open_stream(path).read_pandas().
+
+EXPORT_URL = "http://localhost:9090/export/{dataset}"
+CHUNK_SIZE = 1024 * 1024
+
+
+def export_observations(dataset, output, fmt="ndjson", stations=None, fields=None,
+                        year=None, month=None, day=None, hour=None, url=EXPORT_URL,
+                        start=None, end=None, last=None):
+    params = {"format": fmt}
+    if stations:
+        params["stations"] = ",".join(str(station) for station in stations)
+    if fields:
+        params["fields"] = ",".join(fields)
+    for name, value in (("year", year), ("month", month), ("day", day), ("hour", hour),
+                        ("start", start), ("end", end), ("last", last)):
+        if value is not None:
+            params[name] = value
+
+    with requests.get(url.format(dataset=dataset), params=params, stream=True) as response:
+        response.raise_for_status()
+        written = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            output.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export raw observations as NDJSON or an Arrow IPC stream")
+    parser.add_argument("dataset", choices=["weather", "air-quality", "traffic"])
+    parser.add_argument("-o", "--output", help="output file, defaults to stdout")
+    parser.add_argument("-f", "--format", default="ndjson", choices=["ndjson", "arrow"])
+    parser.add_argument("--stations", help="comma separated station IDs (freeway names for traffic)")
+    parser.add_argument("--fields", help="comma separated fields to include")
+    parser.add_argument("--year", type=int)
+    parser.add_argument("--month", type=int)
+    parser.add_argument("--day", type=int)
+    parser.add_argument("--hour", type=int)
+    parser.add_argument("--start", help="ISO 8601 start of the window, instead of --year etc.")
+    parser.add_argument("--end", help="ISO 8601 end of the window (exclusive)")
+    parser.add_argument("--last", help="window up to now, e.g. 24h or 7d")
+    parser.add_argument("--url", default=EXPORT_URL)
+    args = parser.parse_args()
+
+    stations = args.stations.split(",") if args.stations else None
+    fields = args.fields.split(",") if args.fields else None
+
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        written = export_observations(
+            args.dataset, output, args.format, stations, fields,
+            args.year, args.month, args.day, args.hour, args.url,
+            args.start, args.end, args.last
+        )
+    finally:
+        if args.output:
+            output.close()
+
+    print(f"Wrote {written} bytes", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -118,26 +118,22 @@ results = add_closest_station_info(results, air_quality_stations, 'Air_Quality')
 # Add closest weather station info
 results = add_closest_station_info(results, weather_stations, 'Weather')
 
-# Function to fetch weather station data
-def fetch_weather_data(weather_id, year):
-    url = f"http://localhost:9090/weather-stations/{weather_id}?year={year}"
-    response = requests.get(url)
+# Function to fetch weather station data for many stations in one request
+def fetch_weather_data(weather_ids, year):
+    url = "http://localhost:9090/weather-observations"
+    params = {"stations": ",".join(str(weather_id) for weather_id in weather_ids), "year": year}
+    response = requests.get(url, params=params)
     if response.status_code == 200:
-        data = response.json()
-        if 'date_filter' in data:
-            del data['date_filter']
-        return data
+        return response.json().get('stations', {})
     return {}
 
-# Function to fetch air quality station data
-def fetch_air_quality_data(air_quality_id, year):
-    url = f"http://localhost:9090/air-quality-stations/{air_quality_id}?year={year}"
-    response = requests.get(url)
+# Function to fetch air quality station data for many stations in one request
+def fetch_air_quality_data(air_quality_ids, year):
+    url = "http://localhost:9090/air-quality-observations"
+    params = {"stations": ",".join(str(air_quality_id) for air_quality_id in air_quality_ids), "year": year}
+    response = requests.get(url, params=params)
     if response.status_code == 200:
-        data = response.json()
-        if 'date_filter' in data:
-            del data['date_filter']
-        return data
+        return response.json().get('stations', {})
     return {}
 
 # Function to add station data to the DataFrame
@@ -148,17 +144,23 @@ def add_station_data(results, year):
     
     for col in weather_columns + air_quality_columns:
         results[col] = None
+
+    # Fetch every closest station's data up front, one request per station type
+    weather_ids = results['Closest_Weather_ID'].dropna().unique()
+    air_quality_ids = results['Closest_Air_Quality_ID'].dropna().unique()
+    all_weather_data = fetch_weather_data(weather_ids, year) if len(weather_ids) else {}
+    all_air_quality_data = fetch_air_quality_data(air_quality_ids, year) if len(air_quality_ids) else {}
     
-    # Iterate through each row and fetch the corresponding station data
+    # Iterate through each row and fill in the corresponding station data
     for index, row in results.iterrows():
         if pd.notna(row['Closest_Weather_ID']):
-            weather_data = fetch_weather_data(row['Closest_Weather_ID'], year)
+            weather_data = all_weather_data.get(str(row['Closest_Weather_ID']), {})
             for col in weather_columns:
                 if col in weather_data:
                     results.at[index, col] = weather_data[col]
         
         if pd.notna(row['Closest_Air_Quality_ID']):
-            air_quality_data = fetch_air_quality_data(row['Closest_Air_Quality_ID'], year)
+            air_quality_data = all_air_quality_data.get(str(row['Closest_Air_Quality_ID']), {})
             for col in air_quality_columns:
                 if col in air_quality_data:
                     results.at[index, col] = air_quality_data[col]
@@ -167,8 +169,9 @@ def add_station_data(results, year):
 
 results = add_station_data(results, year)
 
-# Load vehicle data and add to the DataFrame
-vehicle_data = requests.get("http://localhost:9090/sudo-vehicle").json()
+# Load vehicle data for the SA2 areas next to the freeways and add to the DataFrame
+sa2_codes = sorted(set(results['Closest_SA2_Code'].astype(str)))
+vehicle_data = requests.get("http://localhost:9090/sudo-vehicle", params={"sa2": ",".join(sa2_codes)}).json()
 
 def add_vehicle_data(results, vehicle_data):
     vehicle_columns = ['Total_Dwellings', 'num_mot_veh_per_dwg_tot_dwgs']
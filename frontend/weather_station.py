@@ -1,26 +1,24 @@
 import requests
 import pandas as pd
 
+# approximate Melbourne area as min_lon,min_lat,max_lon,max_lat
+MELBOURNE_BBOX = "144.5,-38.1,145.5,-37.5"
+
 def fetch_initial_weather_station_data():
     try:
-        response = requests.get("http://localhost:9090/weather-stations")
-        response.raise_for_status()
-        stations_data = response.json()
-        df_stations = pd.DataFrame(stations_data['stations'])
-
-        # Define approximate latitude and longitude ranges for Melbourne
-        melbourne_lat_range = (-38.1, -37.5)
-        melbourne_lon_range = (144.5, 145.5)
-
-        # Filter stations in Melbourne
-        melbourne_stations = df_stations[
-            (df_stations['lat'] >= melbourne_lat_range[0]) & 
-            (df_stations['lat'] <= melbourne_lat_range[1]) &
-            (df_stations['lon'] >= melbourne_lon_range[0]) & 
-            (df_stations['lon'] <= melbourne_lon_range[1])
-        ]
-
-        return melbourne_stations
+        # the station list is paginated, follow the cursor until the last page
+        stations = []
+        # only the stations in the Melbourne area, filtered by the API
+        params = {"bbox": MELBOURNE_BBOX}
+        while True:
+            response = requests.get("http://localhost:9090/weather-stations", params=params)
+            response.raise_for_status()
+            stations_data = response.json()
+            stations.extend(stations_data['stations'])
+            if 'next' not in stations_data:
+                break
+            params['after'] = stations_data['next']
+        return pd.DataFrame(stations)
     except requests.exceptions.RequestException as e:
         print(f"Failed to retrieve weather stations: {e}")
         print(f"Response content: {response.text}")
@@ -29,18 +27,24 @@ def fetch_initial_weather_station_data():
 def fetch_detailed_weather_station_data(station_ids, year=2024, month=5):
     station_data_list = []
 
+    # one request for all stations rather than one per station
+    url = "http://localhost:9090/weather-observations"
+    params = {"stations": ",".join(str(station_id) for station_id in station_ids), "year": year, "month": month}
+    try:
+        response = requests.get(url, params=params)
+        response.raise_for_status()
+        batch_data = response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to retrieve data for stations {station_ids}: {e}")
+        return pd.DataFrame()
+
     for station_id in station_ids:
-        url = f"http://localhost:9090/weather-stations/{station_id}?year={year}&month={month}"
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            station_data = response.json()
-            df_station_data = pd.DataFrame(station_data)
-            df_station_data['station_id'] = station_id
-            station_data_list.append(df_station_data)
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to retrieve data for station {station_id}: {e}")
-            print(f"Response content: {response.text}")
+        station_data = dict(batch_data['stations'].get(str(station_id), {}))
+        if 'date_filter' in batch_data:
+            station_data['date_filter'] = batch_data['date_filter']
+        df_station_data = pd.DataFrame(station_data)
+        df_station_data['station_id'] = station_id
+        station_data_list.append(df_station_data)
 
     if station_data_list:
         df_stations_data = pd.concat(station_data_list, ignore_index=True)
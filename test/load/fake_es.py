@@ -0,0 +1,285 @@
+import time
+import random
+import datetime
+import threading
+import elasticsearch
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, ObjectApiResponse
+
+# In-process stand-in for the Elasticsearch client used by the API handlers.
+#
+# Responses are synthesised from the shape of each request: every aggregation in
+# the body gets a result of the matching type (terms and histograms get buckets,
+# metrics get values, top_hits get documents), so the handlers' parsing code runs
+# as it would against the cluster. Each call sleeps for a configurable latency to
+# stand in for the network and the cluster's own work.
+
+# example documents for the indices the handlers read whole hits from
+DOCUMENTS = {
+    "sudo-vehicle-register": {
+        "sa2_code_2021": "206041122", "total_dwellings": 4521, "num_mot_veh_per_dwg_tot_dwgs": 1.42,
+    },
+    "weather_stations": {"wmo": 94866, "name": "Melbourne Airport", "lat": -37.67, "lon": 144.83},
+    "air_quality_stations": {"siteID": "10001", "siteName": "Alphington", "latitude": -37.78, "longitude": 145.03},
+    "traffic-data": {
+        "freewayName": "Monash Fwy", "segmentName": "Warrigal Rd to Huntingdale Rd", "actualTravelTime": 95,
+        "averageSpeed": 72, "congestionIndex": 1.2, "publishedTime": "2024-05-01T08:00:00", "segmentId": "101",
+    },
+    "traffic-segments": {
+        "segmentId": "101", "freewayName": "Monash Fwy", "segmentName": "Warrigal Rd to Huntingdale Rd",
+        "geometry": {"type": "LineString", "coordinates": [[145.07 + i * 0.0004, -37.88 - (i * 0.0004) ** 2 * 5]
+                                                           for i in range(100)]},
+    },
+}
+
+LINESTRING = {"type": "LineString", "coordinates": [[144.96, -37.81], [144.97, -37.82], [144.99, -37.83]]}
+HISTOGRAM_START = datetime.datetime(2024, 5, 1)
+HISTOGRAM_STEPS = {
+    "minute": datetime.timedelta(minutes=1), "hour": datetime.timedelta(hours=1), "day": datetime.timedelta(days=1),
+    "week": datetime.timedelta(weeks=1), "month": datetime.timedelta(days=30),
+}
+METRICS = ("avg", "max", "min", "sum", "value_count", "cardinality")
+PERCENTS = (1, 5, 25, 50, 75, 95, 99)
+
+
+def _meta(status):
+    return ApiResponseMeta(
+        status=status, http_version="1.1", headers=HttpHeaders(), duration=0.0,
+        node=NodeConfig("http", "localhost", 9200),
+    )
+
+
+def response(body):
+    # what the real client returns, handlers read both res["..."] and res.body
+    return ObjectApiResponse(body=body, meta=_meta(200))
+
+
+def not_found(message="not found"):
+    return elasticsearch.NotFoundError(message, _meta(404), {"error": {"type": "not_found"}})
+
+
+class _Namespace:
+    """
+    es.indices and similar namespaces: every call succeeds after the usual latency
+    """
+
+    def __init__(self, es):
+        self._es = es
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self._es.wait()
+            return {"acknowledged": True}
+        return call
+
+
+class FakeElasticsearch:
+    """
+    latency and jitter are in seconds, buckets caps the buckets of every bucket aggregation
+    and hits the documents of every search asking for them
+    """
+
+    def __init__(self, latency=0.005, jitter=0.001, buckets=24, hits=10, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.buckets = buckets
+        self.hits = hits
+        self.indices = _Namespace(self)
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def options(self, **options):
+        return self
+
+    def wait(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _value(self):
+        with self._lock:
+            return round(self._random.uniform(0, 100), 2)
+
+    def search(self, index=None, body=None, **kwargs):
+        started = time.perf_counter()
+        self.wait()
+        body = dict(body or {}, **{k: v for k, v in kwargs.items() if k in ("size", "query", "aggs", "_source")})
+        res = self._search(index, body)
+        res["took"] = int((time.perf_counter() - started) * 1000)
+        return response(res)
+
+    def msearch(self, searches, index=None, **kwargs):
+        self.wait()
+        responses = []
+        for header, body in zip(searches[::2], searches[1::2]):
+            res = self._search(header.get("index", index), body)
+            res["took"] = int(self.latency * 1000)
+            responses.append(res)
+        return response({"took": int(self.latency * 1000), "responses": responses})
+
+    def get(self, index=None, id=None, **kwargs):
+        # watermarks, checkpoints and shared cache entries are all missing
+        self.wait()
+        raise not_found(f"{index}/{id}")
+
+    def index(self, **kwargs):
+        self.wait()
+        return {"result": "created"}
+
+    def update(self, **kwargs):
+        self.wait()
+        return {"result": "updated"}
+
+    def count(self, index=None, **kwargs):
+        self.wait()
+        return {"count": self.hits}
+
+    def open_point_in_time(self, index=None, **kwargs):
+        self.wait()
+        # searches in a point in time name no index, the id remembers it
+        return {"id": f"fake-pit:{index}"}
+
+    def close_point_in_time(self, **kwargs):
+        return {"succeeded": True}
+
+    def close(self):
+        pass
+
+    def _search(self, index, body):
+        if index is None and body.get("pit"):
+            index = body["pit"]["id"].split(":", 1)[1]
+        size = body.get("size", 10)
+        hits = [
+            {"_index": index, "_id": str(i), "_source": self._source(index, body.get("_source")), "sort": [i]}
+            for i in range(min(size, self.hits))
+        ]
+        res = {
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(hits), "relation": "eq"}, "hits": hits},
+        }
+        if body.get("aggs"):
+            res["aggregations"] = self._aggs(body["aggs"], _filter_values(body.get("query")))
+        return res
+
+    def _source(self, index, fields):
+        template = DOCUMENTS.get(index, {})
+        if isinstance(fields, dict):
+            fields = fields.get("includes")
+        if fields is False:
+            return {}
+        if not fields:
+            fields = list(template)
+        source = {}
+        for field in fields:
+            if field in template:
+                source[field] = template[field]
+            elif field == "geometry":
+                source[field] = LINESTRING
+            elif "name" in field.lower():
+                source[field] = f"{field} {self._value()}"
+            else:
+                source[field] = self._value()
+        return source
+
+    def _aggs(self, aggs, filters):
+        return {name: self._agg(agg, filters) for name, agg in aggs.items()}
+
+    def _agg(self, agg, filters):
+        kind = next(key for key in agg if key not in ("aggs", "aggregations", "meta"))
+        params = agg[kind]
+        children = agg.get("aggs") or agg.get("aggregations") or {}
+
+        def bucket(key, **extra):
+            return dict(key=key, doc_count=self._random.randint(1, 100), **extra, **self._aggs(children, filters))
+
+        if kind in METRICS:
+            return {"value": self._value()}
+        if kind in ("stats", "extended_stats"):
+            low, high = sorted((self._value(), self._value()))
+            stats = {"count": 10, "min": low, "max": high, "avg": (low + high) / 2, "sum": (low + high) * 5}
+            if kind == "extended_stats":
+                stats.update(std_deviation=(high - low) / 4, variance=((high - low) / 4) ** 2)
+            return stats
+        if kind == "percentiles":
+            percents = params.get("percents", PERCENTS)
+            if params.get("keyed", True):
+                return {"values": {str(float(p)): self._value() for p in percents}}
+            return {"values": [{"key": float(p), "value": self._value()} for p in percents]}
+        if kind == "top_hits":
+            source = self._source(None, params.get("_source"))
+            return {"hits": {"total": {"value": 1}, "hits": [{"_source": source}][:params.get("size", 3)]}}
+        if kind == "filter":
+            return {"doc_count": self._random.randint(1, 100), **self._aggs(children, filters)}
+        if kind == "terms":
+            field = params["field"]
+            keys = filters.get(field) or filters.get(field.replace(".keyword", "")) or [
+                f"{field.replace('.keyword', '')}-{i}" for i in range(self.buckets)
+            ]
+            return {"buckets": [bucket(key) for key in keys[:min(params.get("size", 10), self.buckets)]]}
+        if kind == "multi_terms":
+            fields = [term["field"].replace(".keyword", "") for term in params["terms"]]
+            keys = [[f"{field}-{i}" for field in fields] for i in range(min(params.get("size", 10), self.buckets))]
+            return {"buckets": [bucket(key) for key in keys]}
+        if kind in ("date_histogram", "histogram"):
+            step = HISTOGRAM_STEPS.get(params.get("calendar_interval") or params.get("fixed_interval"),
+                                       datetime.timedelta(hours=1))
+            buckets = []
+            for i in range(self.buckets):
+                at = HISTOGRAM_START + i * step
+                buckets.append(bucket(int(at.timestamp() * 1000), key_as_string=at.strftime("%Y-%m-%dT%H:%M:%S")))
+            return {"buckets": buckets}
+        if kind == "composite":
+            # a single page, so callers paging with after_key stop after it
+            if params.get("after"):
+                return {"buckets": []}
+            def key(name, source, i):
+                if "date_histogram" in source:
+                    return (HISTOGRAM_START + i * datetime.timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S")
+                return f"{name}-{i}"
+
+            sources = [next(iter(source.items())) for source in params["sources"]]
+            buckets = [
+                bucket({name: key(name, source, i) for name, source in sources})
+                for i in range(min(params.get("size", 10), self.buckets))
+            ]
+            return {"buckets": buckets, "after_key": buckets[-1]["key"] if buckets else None}
+        if kind in ("range", "date_range"):
+            return {"buckets": [bucket(f"range-{i}") for i, _ in enumerate(params.get("ranges", []))]}
+        if kind == "geo_centroid":
+            return {"location": {"lat": -37.8 - self._value() / 1000, "lon": 144.9 + self._value() / 1000}, "count": 10}
+        if kind in ("geotile_grid", "geohash_grid"):
+            return {"buckets": [bucket(f"10/{i}/{i}") for i in range(self.buckets)]}
+        # unknown aggregations come back empty rather than failing the run
+        return {}
+
+
+def _filter_values(query):
+    """
+    {field: [values]} for the term and terms filters in a query, so bucket keys match what was asked for
+    """
+    values = {}
+
+    def walk(node):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, dict):
+            for key, value in node.items():
+                if key == "terms" and isinstance(value, dict):
+                    for field, items in value.items():
+                        if isinstance(items, list):
+                            values[field] = list(items)
+                elif key == "term" and isinstance(value, dict):
+                    for field, item in value.items():
+                        values[field] = [item["value"] if isinstance(item, dict) else item]
+                else:
+                    walk(value)
+
+    walk(query)
+    return values
@@ -0,0 +1,258 @@
+"""
+Load test for the API handlers, run locally against fake_es.FakeElasticsearch.
+
+Each route is driven by a pool of concurrent clients calling the Flask handler
+directly, and its latency percentiles and throughput are compared against
+baseline.json. The run fails if a route got slower than the baseline allows.
+
+    python test/load/loadtest.py                       # run and compare
+    python test/load/loadtest.py --routes traffic-freeway --concurrency 32
+    python test/load/loadtest.py --update-baseline     # record a new baseline
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import statistics
+import concurrent.futures
+
+from flask import Flask
+
+import fake_es
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+FISSION = os.path.join(REPO, "backend", "fission")
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# station ids cycled through by the observation routes, so concurrent requests
+# aren't all coalesced into one by admission.single_flight
+STATIONS = [str(94800 + i) for i in range(50)]
+FREEWAYS = ["Monash_Fwy", "West_Gate_Fwy", "Eastern_Fwy", "Tullamarine_Fwy", "Calder_Fwy"]
+
+# route -> (package directory, module, handler, request for the i-th call as (path, headers))
+ROUTES = {
+    "weather-stations": ("api", "api", "weather_get_stations", lambda i: ("/weather-stations", {})),
+    "weather-stations-observations": (
+        "api", "api", "weather_aggregate_observations",
+        lambda i: ("/?last=24h", {"X-Fission-Params-station-id": STATIONS[i % len(STATIONS)]}),
+    ),
+    "weather-stations-observations-series": (
+        "api", "api", "weather_aggregate_observations",
+        lambda i: ("/?last=7d&interval=hour", {"X-Fission-Params-station-id": STATIONS[i % len(STATIONS)]}),
+    ),
+    "weather-observations-batch": (
+        "api", "api", "weather_aggregate_observations_batch",
+        lambda i: (f"/?stations={','.join(STATIONS[i % 10:i % 10 + 20])}&last=24h", {}),
+    ),
+    "weather-grid": (
+        "api", "api", "weather_grid", lambda i: (f"/?zoom={6 + i % 8}&bbox=144.5,-38.1,145.5,-37.5&last=24h", {}),
+    ),
+    "air-quality-grid": (
+        "api", "api", "air_quality_grid", lambda i: (f"/?zoom={6 + i % 8}&grid=geohash&last=7d", {}),
+    ),
+    "air-quality-stations": ("api", "api", "air_quality_get_stations", lambda i: ("/air-quality-stations", {})),
+    "air-quality-stations-observations": (
+        "api", "api", "air_quality_aggregate_observations",
+        lambda i: ("/?last=24h", {"X-Fission-Params-station-id": f"1000{i % 10}"}),
+    ),
+    "air-quality-observations-batch": (
+        "api", "api", "air_quality_aggregate_observations_batch",
+        lambda i: (f"/?stations=10001,10002,1000{i % 10}&last=24h", {}),
+    ),
+    "dashboard": (
+        "api", "api", "dashboard",
+        lambda i: (f"/?weather_stations={STATIONS[i % len(STATIONS)]}&air_quality_stations=10001&last=24h", {}),
+    ),
+    "traffic-freeway": ("traffic-api", "traffic_api", "get_freeways", lambda i: ("/traffic-freeway", {})),
+    "traffic-observations": (
+        "traffic-api", "traffic_api", "aggregate_observations",
+        lambda i: ("/?last=24h", {"X-Fission-Params-FreewayName": FREEWAYS[i % len(FREEWAYS)]}),
+    ),
+    "traffic-summary": (
+        "traffic-api", "traffic_api", "get_summary", lambda i: (f"/?last={1 + i % 24}h&top=10", {}),
+    ),
+    "traffic-heatmap": (
+        "traffic-api", "traffic_api", "get_heatmap",
+        lambda i: ("/?start=2024-05-01&end=2024-05-02", {"X-Fission-Params-FreewayName": FREEWAYS[i % len(FREEWAYS)]}),
+    ),
+    "traffic-segments": (
+        "traffic-api", "traffic_api", "get_segments",
+        lambda i: (f"/?zoom={8 + i % 10}", {"X-Fission-Params-FreewayName": FREEWAYS[i % len(FREEWAYS)]}),
+    ),
+    "traffic-grid": (
+        "traffic-api", "traffic_api", "get_grid", lambda i: (f"/?zoom={8 + i % 8}&metric=speed&last={1 + i % 24}h", {}),
+    ),
+    "sudo-vehicle": ("sudo-api", "sudo_api", "get_vehicles", lambda i: ("/sudo-vehicle", {})),
+}
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    k = (len(ordered) - 1) * p / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def load_package(package, module_name, es):
+    """
+    Imports a Fission package's handler module with its Elasticsearch client replaced by es.
+    The packages share module names (es_client, responses, ...), so the previous package's
+    modules are dropped first.
+    """
+    path = os.path.join(FISSION, package)
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None) or ""
+        if module_file.startswith(FISSION + os.sep):
+            del sys.modules[name]
+    sys.path[:] = [p for p in sys.path if not p.startswith(FISSION + os.sep)]
+    sys.path.insert(0, path)
+
+    module = __import__(module_name)
+    sys.modules["es_client"].get_client = lambda: es
+    return module
+
+
+def status_of(response):
+    """
+    The response's status, treating a 200 carrying {"error": ...} as a failure too
+    """
+    if isinstance(response, tuple):
+        return response[1]
+    status = getattr(response, "status_code", 200)
+    if status == 200 and response.mimetype == "application/json" and not response.headers.get("Content-Encoding"):
+        body = json.loads(response.get_data())
+        if isinstance(body, dict) and "error" in body:
+            return 500
+    return status
+
+
+def run_route(app, handler, make_request, requests, concurrency):
+    def call(i):
+        path, headers = make_request(i)
+        with app.test_request_context(path, headers=headers):
+            started = time.perf_counter()
+            response = handler()
+            return time.perf_counter() - started, status_of(response)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(call, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency * 1000 for latency, _ in results]
+    errors = sum(1 for _, status in results if status >= 400)
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p90_ms": round(percentile(latencies, 90), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+    }
+
+
+def run(routes, requests, concurrency, latency, jitter, cache):
+    # measure the handlers rather than the response caches unless asked to
+    os.environ.setdefault("API_ASYNC_ES", "0")
+    if not cache:
+        os.environ["API_CACHE_MAX_ENTRIES"] = "0"
+    logging.disable(logging.WARNING)
+
+    app = Flask(__name__)
+    es = fake_es.FakeElasticsearch(latency=latency, jitter=jitter)
+    results = {}
+    loaded = None
+    # routes of the same package run back to back so it's only imported once
+    for route in sorted(routes, key=lambda route: ROUTES[route][:2]):
+        package, module_name, handler_name, make_request = ROUTES[route]
+        if loaded is None or loaded[0] != (package, module_name):
+            loaded = ((package, module_name), load_package(package, module_name, es))
+        handler = getattr(loaded[1], handler_name)
+        # warm up imports, pools and per-pod state before measuring
+        run_route(app, handler, make_request, concurrency, concurrency)
+        es.calls = 0
+        results[route] = run_route(app, handler, make_request, requests, concurrency)
+        results[route]["es_calls_per_request"] = round(es.calls / requests, 2)
+    return results
+
+
+def compare(results, baseline, tolerance, slack_ms):
+    """
+    Regressions against the baseline: p99 latency above baseline * (1 + tolerance) + slack_ms,
+    throughput below baseline * (1 - tolerance), or new errors
+    """
+    failures = []
+    for route, result in results.items():
+        base = baseline.get(route)
+        if base is None:
+            continue
+        if result["p99_ms"] > base["p99_ms"] * (1 + tolerance) + slack_ms:
+            failures.append(f"{route}: p99 {result['p99_ms']}ms, baseline {base['p99_ms']}ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            failures.append(f"{route}: {result['rps']} requests/s, baseline {base['rps']}")
+        if result["errors"] > base.get("errors", 0):
+            failures.append(f"{route}: {result['errors']} errors, baseline {base.get('errors', 0)}")
+    return failures
+
+
+def report(results, baseline):
+    print(f"{'route':<40}{'rps':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'base p99':>10}{'errors':>8}")
+    for route, result in results.items():
+        base = baseline.get(route, {}).get("p99_ms", "-")
+        print(f"{route:<40}{result['rps']:>9}{result['p50_ms']:>9}{result['p90_ms']:>9}{result['p99_ms']:>9}"
+              f"{base:>10}{result['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", nargs="+", choices=sorted(ROUTES), default=sorted(ROUTES))
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--latency", type=float, default=5, help="fake Elasticsearch latency per call, ms")
+    parser.add_argument("--jitter", type=float, default=1, help="extra random latency per call, up to this many ms")
+    parser.add_argument("--cache", action="store_true", help="keep the in-process response cache enabled")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative regression")
+    parser.add_argument("--slack", type=float, default=5, help="allowed absolute p99 regression, ms")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.routes, args.requests, args.concurrency, args.latency / 1000, args.jitter / 1000, args.cache)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored["routes"]
+        differing = [key for key, value in stored["settings"].items() if getattr(args, key) != value]
+        if differing and not args.update_baseline:
+            print(f"Note: {', '.join(differing)} differ from the baseline's settings {stored['settings']}")
+
+    report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        settings = {key: getattr(args, key) for key in ("requests", "concurrency", "latency", "jitter", "cache")}
+        with open(args.baseline, "w") as f:
+            json.dump({"settings": settings, "routes": dict(baseline, **results)}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    failures = compare(results, baseline, args.tolerance, args.slack)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())